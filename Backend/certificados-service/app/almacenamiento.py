@@ -0,0 +1,199 @@
+# app/almacenamiento.py - CERTIFICADOS SERVICE
+import os
+import re
+import json
+import uuid
+import hashlib
+import ipaddress
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+from app.auth import create_download_token
+from app.models import CertificadoGenerado
+from app.log_writer import log_writer
+from app.template_engine import normalizar_valores, version_plantilla
+
+# Directorio de archivos generados (fuera de /static: solo se sirven con enlace firmado)
+ALMACENAMIENTO_DIR = os.getenv(
+    "ALMACENAMIENTO_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "generated")
+)
+CERTIFICADOS_DIR = os.path.join(ALMACENAMIENTO_DIR, "certificados")
+os.makedirs(CERTIFICADOS_DIR, exist_ok=True)
+# Imágenes extraídas de las plantillas de email (públicas: las abren los destinatarios)
+RECURSOS_EMAIL_DIR = os.path.join(ALMACENAMIENTO_DIR, "recursos-email")
+os.makedirs(RECURSOS_EMAIL_DIR, exist_ok=True)
+
+BASE_URL = os.getenv("BASE_URL", "http://localhost:8003")
+CHUNK_DESCARGA = 64 * 1024
+# Range de un solo intervalo; lo que no encaja (varios intervalos, otra unidad) se ignora
+RANGO_BYTES = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$", re.IGNORECASE)
+
+# Tipos de imagen que se extraen del HTML (SVG no: podría llevar scripts y se serviría desde este dominio)
+EXTENSIONES_RECURSO = {"image/png": "png", "image/jpeg": "jpg", "image/jpg": "jpg", "image/gif": "gif", "image/webp": "webp"}
+TIPOS_RECURSO = {"png": "image/png", "jpg": "image/jpeg", "gif": "image/gif", "webp": "image/webp"}
+
+# Variables que no cambian el contenido "lógico" del certificado
+VARIABLES_VOLATILES = {"FECHA", "ENLACE_CERTIFICADO"}
+
+
+def ruta_certificado(certificado_id) -> str:
+    """Ruta del PDF almacenado para un certificado"""
+    return os.path.join(CERTIFICADOS_DIR, f"{certificado_id}.pdf")
+
+
+def clave_certificado(plantilla, variables: Dict[str, str]) -> str:
+    """Identifica un certificado por plantilla, versión de plantilla y variables"""
+    valores = {
+        k: v for k, v in normalizar_valores(variables).items()
+        if k not in VARIABLES_VOLATILES
+    }
+    base = json.dumps({
+        "plantilla": str(plantilla.id),
+        "version": version_plantilla(plantilla),
+        "variables": valores
+    }, sort_keys=True)
+    return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+
+def guardar_certificado(plantilla, variables: Dict[str, str], pdf_bytes: bytes,
+                        destinatario_email: Optional[str] = None) -> Dict:
+    """
+    Guarda el PDF en disco y encola su registro en certificados_generados
+    El archivo se escribe de forma atómica (temporal + rename)
+    """
+    certificado_id = uuid.uuid4()
+    ruta = ruta_certificado(certificado_id)
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(pdf_bytes)
+    os.replace(temporal, ruta)
+
+    registro = {
+        "id": certificado_id,
+        "clave": clave_certificado(plantilla, variables),
+        "plantilla_certificado_id": plantilla.id,
+        "destinatario_email": destinatario_email,
+        "sha256": hashlib.sha256(pdf_bytes).hexdigest(),
+        "tamano": len(pdf_bytes),
+        "fecha_creacion": datetime.now(timezone.utc)
+    }
+    log_writer.registrar(CertificadoGenerado, registro)
+    return registro
+
+
+def buscar_certificado(db, plantilla, variables: Dict[str, str]) -> Optional[Dict]:
+    """
+    Devuelve el certificado ya generado para la misma plantilla, versión y variables
+    Solo si el archivo sigue en disco; si no, hay que volver a generarlo.
+    """
+    certificado = db.query(CertificadoGenerado).filter(
+        CertificadoGenerado.clave == clave_certificado(plantilla, variables)
+    ).order_by(CertificadoGenerado.fecha_creacion.desc()).first()
+
+    if certificado is None or not os.path.exists(ruta_certificado(certificado.id)):
+        return None
+    return {"id": certificado.id, "sha256": certificado.sha256, "tamano": certificado.tamano}
+
+
+def leer_certificado(certificado_id) -> bytes:
+    """Contenido del PDF almacenado (para adjuntarlo sin volver a generarlo)"""
+    with open(ruta_certificado(certificado_id), "rb") as f:
+        return f.read()
+
+
+def url_publica(url: str) -> bool:
+    """False si la URL apunta a la propia máquina (localhost, 127.x, ::1): un destinatario no la puede abrir"""
+    host = (urlparse(url).hostname or "").lower()
+    if not host or host == "localhost" or host.endswith(".localhost"):
+        return False
+    try:
+        return not ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return True
+
+
+# Las URLs que van en los correos (imágenes, descargas) solo sirven si BASE_URL es accesible desde afuera
+BASE_URL_PUBLICA = url_publica(BASE_URL)
+
+
+def validar_enlaces_publicos():
+    """Lanza ValueError si BASE_URL no sirve para enlaces que se mandan por correo (modo ENLACE)"""
+    if not BASE_URL_PUBLICA:
+        raise ValueError(
+            f"El modo ENLACE necesita que BASE_URL sea una URL pública (actual: {BASE_URL})"
+        )
+
+
+def enlace_descarga(certificado: Dict) -> str:
+    """
+    URL firmada y con expiración para descargar un certificado
+    El token lleva el id y el hash, así la descarga no necesita consultar la BD
+    """
+    token = create_download_token({"sub": str(certificado["id"]), "h": certificado["sha256"]})
+    return f"{BASE_URL}/certificados/descargar/{token}"
+
+
+def guardar_recurso_email(datos: bytes, mimetype: str) -> str:
+    """
+    Guarda una imagen de plantilla de email y devuelve su URL pública
+    El nombre es el hash del contenido: la misma imagen en varias plantillas o versiones
+    se guarda una vez y su URL nunca cambia de contenido (se puede cachear para siempre)
+    """
+    nombre = f"{hashlib.sha256(datos).hexdigest()}.{EXTENSIONES_RECURSO[mimetype]}"
+    ruta = os.path.join(RECURSOS_EMAIL_DIR, nombre)
+    if not os.path.exists(ruta):
+        temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+    return f"{BASE_URL}/recursos-email/{nombre}"
+
+
+def ruta_recurso_email(nombre: str) -> str:
+    return os.path.join(RECURSOS_EMAIL_DIR, nombre)
+
+
+def parsear_rango(rango: Optional[str], tamano: int) -> Optional[Tuple[int, int]]:
+    """
+    Interpreta una cabecera Range de un solo intervalo (bytes=inicio-fin)
+    Devuelve (inicio, fin) inclusivos, o None si no hay rango o está mal formado (RFC 9110:
+    se ignora y se sirve el archivo completo). Lanza ValueError solo si es válido pero no
+    satisfacible (416).
+    """
+    coincidencia = RANGO_BYTES.match(rango or "")
+    if coincidencia is None:
+        return None
+
+    inicio_txt, fin_txt = coincidencia.groups()
+    if inicio_txt == "":
+        if fin_txt == "":
+            return None
+        # Sufijo: últimos N bytes
+        largo = int(fin_txt)
+        if largo == 0 or tamano == 0:
+            raise ValueError("Rango no satisfacible")
+        return max(tamano - largo, 0), tamano - 1
+
+    inicio = int(inicio_txt)
+    fin = int(fin_txt) if fin_txt else tamano - 1
+    if fin_txt and fin < inicio:
+        # last-pos menor que first-pos: rango inválido, se ignora
+        return None
+    if inicio >= tamano:
+        raise ValueError("Rango no satisfacible")
+    return inicio, min(fin, tamano - 1)
+
+
+def leer_archivo(ruta: str, inicio: int, fin: int) -> Iterator[bytes]:
+    """Lee un archivo por bloques entre inicio y fin (inclusivos)"""
+    restante = fin - inicio + 1
+    with open(ruta, "rb") as f:
+        f.seek(inicio)
+        while restante > 0:
+            bloque = f.read(min(CHUNK_DESCARGA, restante))
+            if not bloque:
+                break
+            restante -= len(bloque)
+            yield bloque
@@ -1,5 +1,6 @@
 # app/auth.py - CERTIFICADOS SERVICE (SOLO VERIFICACIÓN)
 import os
+from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 
@@ -8,6 +9,7 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY environment variable is required")
 ALGORITHM = "HS256"
+DOWNLOAD_TOKEN_EXPIRE_DAYS = int(os.getenv("CERTIFICADO_ENLACE_DIAS", "30"))
 
 def verify_token(token: str, token_type: str = "access") -> Optional[dict]:
     """
@@ -24,4 +26,14 @@ def verify_token(token: str, token_type: str = "access") -> Optional[dict]:
         return payload
         
     except JWTError:
-        return None
\ No newline at end of file
+        return None
+
+def create_download_token(data: dict) -> str:
+    """
+    Crear JWT firmado para enlaces de descarga de certificados
+    Es el único token que emite este servicio
+    """
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(days=DOWNLOAD_TOKEN_EXPIRE_DAYS)
+    to_encode.update({"exp": expire, "type": "descarga"})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
\ No newline at end of file
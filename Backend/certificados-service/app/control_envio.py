@@ -0,0 +1,271 @@
+# app/control_envio.py - CERTIFICADOS SERVICE
+import os
+import time
+import threading
+from typing import Dict, Optional
+
+# Tasa de envío (correos por segundo) y concurrencia hacia el proveedor
+EMAIL_TASA_INICIAL = float(os.getenv("EMAIL_TASA_INICIAL", "5"))
+EMAIL_TASA_MIN = float(os.getenv("EMAIL_TASA_MIN", "0.2"))
+EMAIL_TASA_MAX = float(os.getenv("EMAIL_TASA_MAX", "20"))
+EMAIL_CONCURRENCIA_INICIAL = int(os.getenv("EMAIL_CONCURRENCIA_INICIAL", "2"))
+EMAIL_CONCURRENCIA_MAX = int(os.getenv("EMAIL_CONCURRENCIA_MAX", "8"))
+# AIMD: subida aditiva por segundo de éxito, bajada multiplicativa ante saturación
+EMAIL_AIMD_INCREMENTO = float(os.getenv("EMAIL_AIMD_INCREMENTO", "1"))
+EMAIL_AIMD_FACTOR = float(os.getenv("EMAIL_AIMD_FACTOR", "0.5"))
+# Latencia por encima de la cual se considera que el proveedor está saturado
+EMAIL_LATENCIA_OBJETIVO_MS = float(os.getenv("EMAIL_LATENCIA_OBJETIVO_MS", "3000"))
+
+# Circuit breaker
+EMAIL_BREAKER_UMBRAL = int(os.getenv("EMAIL_BREAKER_UMBRAL", "5"))
+EMAIL_BREAKER_ESPERA_SEG = float(os.getenv("EMAIL_BREAKER_ESPERA_SEG", "30"))
+EMAIL_BREAKER_ESPERA_MAX_SEG = float(os.getenv("EMAIL_BREAKER_ESPERA_MAX_SEG", "600"))
+
+
+class Prioridad:
+    INTERACTIVO = "INTERACTIVO"  # envíos individuales pedidos desde el panel
+    MASIVO = "MASIVO"            # trabajos de envío masivo
+    REINTENTO = "REINTENTO"      # cola de reintentos
+
+
+# Peso de cada prioridad en el reparto de la tasa cuando compiten entre sí
+PESOS_PRIORIDAD = {
+    Prioridad.INTERACTIVO: float(os.getenv("EMAIL_PESO_INTERACTIVO", "20")),
+    Prioridad.MASIVO: float(os.getenv("EMAIL_PESO_MASIVO", "4")),
+    Prioridad.REINTENTO: float(os.getenv("EMAIL_PESO_REINTENTO", "1")),
+}
+
+
+class EstadoCircuito:
+    CERRADO = "CERRADO"          # envío normal
+    ABIERTO = "ABIERTO"          # proveedor caído: la cola se pausa
+    SEMIABIERTO = "SEMIABIERTO"  # se deja pasar un envío de prueba
+
+
+class ControlEnvio:
+    """
+    Control adaptativo del envío hacia el proveedor de correo
+
+    - Tasa (token bucket) y concurrencia con AIMD: suben de a poco mientras el
+      proveedor responde bien y rápido; se reducen a la mitad ante 429, 5xx,
+      timeouts o latencia alta (como mucho una vez por ventana, para no desplomarse
+      con una ráfaga de errores).
+    - Retry-After de un 429 detiene todos los envíos hasta esa hora.
+    - Circuit breaker: tras EMAIL_BREAKER_UMBRAL fallos seguidos se abre y pausa la
+      cola; pasada la espera deja pasar un envío de prueba y se cierra si funciona.
+    - Prioridades: cuando hay envíos de varias clases esperando, cada turno libre va a
+      la clase con menor tiempo virtual (cada turno le suma 1/peso). Así un envío
+      individual sale en cuanto se libera un turno aunque haya un masivo en curso, y
+      el masivo y los reintentos se reparten el resto sin dejarse sin turno.
+
+    Uso: adquirir() antes de llamar al proveedor y registrar() con el resultado.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.tasa = EMAIL_TASA_INICIAL
+        self.concurrencia = float(EMAIL_CONCURRENCIA_INICIAL)
+        self._tokens = 1.0
+        self._ultimo_relleno = time.monotonic()
+        self._en_vuelo = 0
+        self._pausa_hasta = 0.0
+        self._ultima_reduccion = 0.0
+
+        self.circuito = EstadoCircuito.CERRADO
+        self._fallos_seguidos = 0
+        self._abierto_hasta = 0.0
+        self._espera_circuito = EMAIL_BREAKER_ESPERA_SEG
+        self._prueba_en_vuelo = False
+
+        self._esperando = {p: 0 for p in PESOS_PRIORIDAD}
+        self._tiempo_virtual = {p: 0.0 for p in PESOS_PRIORIDAD}
+        self._reloj_virtual = 0.0
+
+        self._latencia_ms: Optional[float] = None
+        self._contadores = {"exitos": 0, "fallos": 0, "limitados": 0, "aperturas": 0}
+
+    # ==================== API PÚBLICA ====================
+
+    def disponible(self) -> bool:
+        """False mientras el circuito está abierto (sin esperar)"""
+        with self._cond:
+            return not (self.circuito == EstadoCircuito.ABIERTO and time.monotonic() < self._abierto_hasta)
+
+    def adquirir(self, espera_maxima: Optional[float] = None,
+                 prioridad: str = Prioridad.INTERACTIVO) -> bool:
+        """
+        Espera turno para llamar al proveedor (circuito, pausa, concurrencia, tasa y prioridad)
+        Devuelve False si no lo consigue en espera_maxima segundos (None = sin límite).
+        """
+        limite = None if espera_maxima is None else time.monotonic() + espera_maxima
+        with self._cond:
+            self._entrar_en_espera(prioridad)
+            try:
+                while True:
+                    ahora = time.monotonic()
+                    espera = self._espera_necesaria(ahora)
+                    if espera == 0:
+                        if self._turno() == prioridad:
+                            self._conceder(prioridad)
+                            return True
+                        # El turno es de otra clase; notify_all despierta al concederlo
+                        espera = 1.0
+
+                    if limite is not None:
+                        restante = limite - ahora
+                        if restante <= 0:
+                            return False
+                        espera = min(espera, restante)
+                    self._cond.wait(timeout=espera)
+            finally:
+                self._esperando[prioridad] -= 1
+                # Al salir (con o sin turno) puede cambiar a qué clase le toca
+                self._cond.notify_all()
+
+    def registrar(self, exito: bool, saturado: bool, latencia_seg: float,
+                  retry_after: Optional[float] = None):
+        """
+        Informa el resultado de una llamada al proveedor
+        saturado=True para 429, 5xx y errores de conexión; un rechazo permanente
+        (dirección inválida, etc.) no dice nada de la salud del proveedor.
+        """
+        ahora = time.monotonic()
+        latencia_ms = latencia_seg * 1000
+        with self._cond:
+            self._en_vuelo = max(0, self._en_vuelo - 1)
+            self._latencia_ms = latencia_ms if self._latencia_ms is None else (
+                0.8 * self._latencia_ms + 0.2 * latencia_ms
+            )
+
+            if saturado:
+                self._contadores["fallos"] += 1
+                if retry_after:
+                    self._contadores["limitados"] += 1
+                    self._pausa_hasta = max(self._pausa_hasta, ahora + retry_after)
+                self._reducir(ahora)
+                self._registrar_fallo_circuito(ahora)
+            else:
+                if exito:
+                    self._contadores["exitos"] += 1
+                if latencia_ms > EMAIL_LATENCIA_OBJETIVO_MS:
+                    self._reducir(ahora)
+                else:
+                    self._aumentar()
+                self._registrar_exito_circuito()
+
+            self._cond.notify_all()
+
+    def liberar(self):
+        """Devuelve el turno sin resultado (la llamada no llegó a hacerse)"""
+        with self._cond:
+            self._en_vuelo = max(0, self._en_vuelo - 1)
+            self._prueba_en_vuelo = False
+            self._cond.notify_all()
+
+    def metricas(self) -> Dict:
+        """Estado actual para /metricas-envio"""
+        ahora = time.monotonic()
+        with self._cond:
+            return {
+                "tasa_por_segundo": round(self.tasa, 3),
+                "concurrencia_limite": int(self.concurrencia),
+                "en_vuelo": self._en_vuelo,
+                "estado_circuito": self.circuito,
+                "fallos_seguidos": self._fallos_seguidos,
+                "segundos_para_reintentar": round(max(0.0, self._abierto_hasta - ahora), 1)
+                if self.circuito == EstadoCircuito.ABIERTO else 0,
+                "pausa_retry_after_seg": round(max(0.0, self._pausa_hasta - ahora), 1),
+                "latencia_promedio_ms": round(self._latencia_ms, 1) if self._latencia_ms is not None else None,
+                "esperando": dict(self._esperando),
+                **self._contadores
+            }
+
+    # ==================== INTERNOS (con el lock tomado) ====================
+
+    def _espera_necesaria(self, ahora: float) -> float:
+        """Segundos a esperar antes de poder enviar; 0 si ya se puede"""
+        if self.circuito == EstadoCircuito.ABIERTO:
+            if ahora < self._abierto_hasta:
+                return self._abierto_hasta - ahora
+            self.circuito = EstadoCircuito.SEMIABIERTO
+            print("🟡 Circuito SEMIABIERTO: enviando correo de prueba")
+
+        if self.circuito == EstadoCircuito.SEMIABIERTO and (self._prueba_en_vuelo or self._en_vuelo > 0):
+            return 1.0
+
+        if ahora < self._pausa_hasta:
+            return self._pausa_hasta - ahora
+
+        if self._en_vuelo >= max(1, int(self.concurrencia)):
+            return 1.0  # se despierta antes con notify_all al terminar otro envío
+
+        # Rellenar el token bucket (ráfaga máxima: un segundo de tasa)
+        self._tokens = min(max(1.0, self.tasa), self._tokens + (ahora - self._ultimo_relleno) * self.tasa)
+        self._ultimo_relleno = ahora
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.tasa
+        return 0
+
+    def _entrar_en_espera(self, prioridad: str):
+        if self._esperando[prioridad] == 0:
+            # Una clase que estuvo inactiva no acumula crédito: arranca desde el reloj actual
+            self._tiempo_virtual[prioridad] = max(self._tiempo_virtual[prioridad], self._reloj_virtual)
+        self._esperando[prioridad] += 1
+
+    def _turno(self) -> str:
+        """Clase con envíos esperando y menor tiempo virtual (a igualdad, la de más peso)"""
+        return min(
+            (p for p, n in self._esperando.items() if n > 0),
+            key=lambda p: (self._tiempo_virtual[p], -PESOS_PRIORIDAD[p])
+        )
+
+    def _conceder(self, prioridad: str):
+        self._reloj_virtual = self._tiempo_virtual[prioridad]
+        self._tiempo_virtual[prioridad] += 1 / PESOS_PRIORIDAD[prioridad]
+        self._tokens -= 1
+        self._en_vuelo += 1
+        if self.circuito == EstadoCircuito.SEMIABIERTO:
+            self._prueba_en_vuelo = True
+
+    def _aumentar(self):
+        # Subida aditiva: ~EMAIL_AIMD_INCREMENTO por segundo de envíos exitosos
+        self.tasa = min(EMAIL_TASA_MAX, self.tasa + EMAIL_AIMD_INCREMENTO / max(self.tasa, 1.0))
+        self.concurrencia = min(float(EMAIL_CONCURRENCIA_MAX), self.concurrencia + 1 / max(self.concurrencia, 1.0))
+
+    def _reducir(self, ahora: float):
+        # Una sola bajada por ventana: los fallos de envíos que ya estaban en vuelo no cuentan doble
+        ventana = max(1.0, (self._latencia_ms or 0) / 1000)
+        if ahora - self._ultima_reduccion < ventana:
+            return
+        self._ultima_reduccion = ahora
+        self.tasa = max(EMAIL_TASA_MIN, self.tasa * EMAIL_AIMD_FACTOR)
+        self.concurrencia = max(1.0, self.concurrencia * EMAIL_AIMD_FACTOR)
+        print(f"🐢 Proveedor saturado: tasa {self.tasa:.2f}/s, concurrencia {int(self.concurrencia)}")
+
+    def _registrar_fallo_circuito(self, ahora: float):
+        self._fallos_seguidos += 1
+        if self.circuito == EstadoCircuito.SEMIABIERTO:
+            # Falló la prueba: se vuelve a abrir con una espera más larga
+            self._prueba_en_vuelo = False
+            self._espera_circuito = min(EMAIL_BREAKER_ESPERA_MAX_SEG, self._espera_circuito * 2)
+            self._abrir(ahora)
+        elif self.circuito == EstadoCircuito.CERRADO and self._fallos_seguidos >= EMAIL_BREAKER_UMBRAL:
+            self._abrir(ahora)
+
+    def _registrar_exito_circuito(self):
+        self._fallos_seguidos = 0
+        if self.circuito == EstadoCircuito.SEMIABIERTO:
+            print("🟢 Circuito CERRADO: el proveedor respondió")
+            self._prueba_en_vuelo = False
+            self.circuito = EstadoCircuito.CERRADO
+            self._espera_circuito = EMAIL_BREAKER_ESPERA_SEG
+
+    def _abrir(self, ahora: float):
+        self.circuito = EstadoCircuito.ABIERTO
+        self._abierto_hasta = ahora + self._espera_circuito
+        self._contadores["aperturas"] += 1
+        print(f"🔴 Circuito ABIERTO: se pausan los envíos por {self._espera_circuito:.0f}s")
+
+
+# Instancia compartida por todo el servicio
+control_envio = ControlEnvio()
@@ -21,4 +21,6 @@ def get_db() -> Session:
 def create_tables():
     """Crear todas las tablas en la base de datos"""
     from app.models import Base
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    from app.migraciones import aplicar_migraciones
+    Base.metadata.create_all(bind=engine)
+    aplicar_migraciones(engine)
\ No newline at end of file
@@ -1,9 +1,11 @@
 # app/dependencies.py - CERTIFICADOS SERVICE
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.auth import verify_token
 
 security = HTTPBearer()
+security_opcional = HTTPBearer(auto_error=False)
 
 def get_current_user_info(
     credentials: HTTPAuthorizationCredentials = Depends(security)
@@ -41,4 +43,21 @@ def require_auth(
     """
     Dependency simple que requiere autenticación
     """
-    return user_info
\ No newline at end of file
+    return user_info
+
+def require_auth_stream(
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security_opcional)
+) -> dict:
+    """
+    Autenticación para streams (Server-Sent Events)
+    EventSource no permite cabeceras: se acepta también el JWT en ?token=
+    """
+    if credentials is not None:
+        return get_current_user_info(credentials)
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token requerido"
+        )
+    return get_current_user_info(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
\ No newline at end of file
@@ -5,9 +5,11 @@ import json
 import base64
 import requests
 import time
-from typing import List, Dict, Optional, Tuple
-from datetime import datetime
+import uuid
+from typing import List, Dict, Optional, Tuple, Iterable, Iterator
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
+from sqlalchemy import and_, or_, tuple_, case, func, distinct
 from sqlalchemy.orm import Session
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.platypus import SimpleDocTemplate, Image as ReportLabImage
@@ -15,15 +17,110 @@ from reportlab.lib.units import inch
 from reportlab.pdfgen import canvas
 from PIL import Image
 
-from app.models import LogEmail, EstadoEmail, PlantillaEmail, Plantilla, Usuario
+from app.models import (
+    LogEmail, EstadoEmail, EstadoTrabajo, ModoEntrega, TrabajoEnvio, EstadisticaEmailDiaria,
+    EstadisticaEmailHoraria,
+    PlantillaEmail, Plantilla, Usuario, Curso, Inscripcion
+)
 from app.schemas import EnvioEmailIndividual, LogEmailResponse
+from app.log_writer import log_writer
+from app.almacenamiento import (
+    guardar_certificado, buscar_certificado, leer_certificado, enlace_descarga, validar_enlaces_publicos
+)
+from app.reintentos import programar_reintento
+from app.idempotencia import (
+    clave_trabajo, clave_mensaje, identificador_version,
+    fila_reserva, reservar_trabajo, reservar_logs, buscar_log_por_clave
+)
+from app.trabajos import bloquear_trabajo, guardar_checkpoint, dentro_de_ventana, parsear_hora, puede_ejecutarse
+from app.control_envio import control_envio, Prioridad
+from app.transportes import ResultadoEnvio, obtener_transporte
+from app.eventos import bus_eventos, MedidorProgreso
+from app.migraciones import SIN_PLANTILLA
+from app.supresiones import indice_supresiones
+from app.template_engine import (
+    VARIABLES_BASE, compilar_texto, normalizar_valores, obtener_plantilla_compilada
+)
 
-# Configuración SMTP2GO
-SMTP2GO_API_KEY = os.getenv("SMTP2GO_API_KEY")
-SMTP2GO_API_URL = "https://api.smtp2go.com/v3/email/send"
-SENDER_EMAIL = os.getenv("SMTP2GO_SENDER_EMAIL", "Centro de Desarrollo Profesional CDP <documentos@capacitacionescdp.com>")
+# Configuración de envío (el transporte y sus credenciales están en app/transportes.py)
 LOTE_SIZE = int(os.getenv("SMTP2GO_LOTE_SIZE", "10"))
 PAUSA_LOTES = int(os.getenv("SMTP2GO_PAUSA_LOTES", "20"))
+DESTINATARIOS_YIELD_PER = int(os.getenv("DESTINATARIOS_YIELD_PER", "500"))
+# Cuánto espera un envío individual su turno antes de quedar programado como reintento
+EMAIL_ESPERA_INDIVIDUAL_SEG = float(os.getenv("EMAIL_ESPERA_INDIVIDUAL_SEG", "15"))
+MARCADOR_ENLACE = "{ENLACE_CERTIFICADO}"
+# Series de estadísticas: rango por defecto y máximo (días) para cada granularidad
+SERIES_RANGOS_DIAS = {"hora": (7, 90), "dia": (90, 1100)}
+# Tamaño máximo de página de GET /logs-email
+LOGS_LIMITE_MAXIMO = int(os.getenv("LOGS_LIMITE_MAXIMO", "500"))
+# Métricas de la entrega que se guardan como columnas de logs_email (no en metadatos)
+METRICAS_ENTREGA = ("tiempo_render_ms", "latencia_envio_ms", "tamano_adjunto")
+# Orden de GET /logs-email/mas-lentos: métrica -> plantilla con índice compuesto para ella
+METRICAS_LENTITUD = {"latencia_envio_ms": "plantilla_email_id", "tiempo_render_ms": "plantilla_certificado_id"}
+
+def _ms(segundos: Optional[float]) -> Optional[int]:
+    return None if segundos is None else int(round(segundos * 1000))
+
+def _en_lotes(items: Iterable, tamano: int) -> Iterator[List]:
+    """Agrupa un iterable en listas de `tamano` elementos sin materializarlo completo"""
+    lote = []
+    for item in items:
+        lote.append(item)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def variables_destinatario(usuario: Usuario, nombre_curso: Optional[str] = None,
+                            variables_globales: Optional[Dict] = None) -> Dict[str, str]:
+    """
+    Variables de un destinatario para el correo y su certificado
+    La pregeneración usa la misma función: con las mismas variables la clave del
+    certificado coincide y el envío reutiliza el PDF guardado
+    """
+    variables = {
+        "NOMBRE": usuario.nombre or "",
+        "APELLIDO": usuario.apellido or "",
+        "NOMBRE_COMPLETO": usuario.nombre_completo or "",
+        "EMAIL": usuario.email or "",
+        "CEDULA": usuario.cedula or "",
+        "CURSO": (variables_globales or {}).get("CURSO") or nombre_curso or "",
+        "FECHA": datetime.now().strftime("%d/%m/%Y"),
+        "INSTITUCION": "Centro de Desarrollo Profesional CDP"
+    }
+    
+    # Agregar variables globales
+    if variables_globales:
+        variables.update(variables_globales)
+    return variables
+
+def insertar_enlace_certificado(contenido_html: str, enlace: str) -> str:
+    """
+    Coloca el enlace de descarga en el correo
+    Usa {ENLACE_CERTIFICADO} si la plantilla lo tiene; si no, agrega un párrafo al final
+    """
+    if MARCADOR_ENLACE in contenido_html:
+        return contenido_html.replace(MARCADOR_ENLACE, enlace)
+    
+    bloque = f'<p><a href="{enlace}">Descargar certificado</a></p>'
+    cierre = contenido_html.lower().rfind("</body>")
+    if cierre == -1:
+        return contenido_html + bloque
+    return contenido_html[:cierre] + bloque + contenido_html[cierre:]
+
+def codificar_cursor(fecha_envio: datetime, log_id) -> str:
+    """Cursor opaco con la posición (fecha_envio, id) del último log de una página"""
+    return base64.urlsafe_b64encode(f"{fecha_envio.isoformat()}|{log_id}".encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """Inversa de codificar_cursor; lanza ValueError si el cursor no es válido"""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        fecha, log_id = texto.split("|")
+        return datetime.fromisoformat(fecha), uuid.UUID(log_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
 
 class EmailService:
     def __init__(self, db: Session):
@@ -33,14 +130,9 @@ class EmailService:
         """
         Procesa las variables en el contenido HTML
         Reemplaza {VARIABLE} con el valor correspondiente
+        El texto se compila una vez (caché por contenido) y se renderiza con un join
         """
-        contenido_procesado = contenido
-        
-        for variable, valor in variables.items():
-            patron = f"{{{variable.upper()}}}"
-            contenido_procesado = contenido_procesado.replace(patron, str(valor))
-        
-        return contenido_procesado
+        return compilar_texto(contenido).renderizar(normalizar_valores(variables), estricto=False)
     
     def extraer_variables_plantilla(self, contenido_html: str) -> List[str]:
         """
@@ -242,157 +334,460 @@ class EmailService:
             print(f"  Campo: {field}")
             print(f"  Variables: {variables}")
     
-    def enviar_email_smtp2go(self, destinatario: str, asunto: str, contenido_html: str, 
-                           adjunto_pdf: Optional[bytes] = None, nombre_adjunto: str = "certificado.pdf") -> Tuple[bool, str]:
+    def enviar_email_proveedor(self, destinatario: str, asunto: str, contenido_html: str, 
+                               adjunto_pdf: Optional[bytes] = None, nombre_adjunto: str = "certificado.pdf",
+                               espera_maxima: Optional[float] = None,
+                               prioridad: str = Prioridad.INTERACTIVO) -> ResultadoEnvio:
         """
-        Envía email usando SMTP2GO
+        Envía email con el transporte configurado (EMAIL_TRANSPORTE: smtp2go o smtp)
+        Cada llamada pasa por el control adaptativo de tasa y el circuit breaker;
+        espera_maxima limita cuánto se espera turno (None = lo que haga falta) y
+        prioridad decide quién sale primero cuando compiten varios envíos
         """
-        if not SMTP2GO_API_KEY:
-            return False, "SMTP2GO_API_KEY no configurado"
+        transporte = obtener_transporte()
+        if not transporte.configurado:
+            return ResultadoEnvio(False, f"Transporte {transporte.nombre} no configurado")
+        
+        if not control_envio.adquirir(espera_maxima, prioridad):
+            return ResultadoEnvio(False, "Envío pausado: el proveedor no está disponible", reintentable=True)
         
+        inicio = time.monotonic()
         try:
-            payload = {
-                "api_key": SMTP2GO_API_KEY,
-                "sender": SENDER_EMAIL,
-                "to": [destinatario],
-                "subject": asunto,
-                "html_body": contenido_html
-            }
-            
-            # Agregar adjunto si existe
-            if adjunto_pdf:
-                pdf_base64 = base64.b64encode(adjunto_pdf).decode('utf-8')
-                payload["attachments"] = [{
-                    "filename": nombre_adjunto,
-                    "fileblob": pdf_base64,
-                    "mimetype": "application/pdf"
-                }]
-            
-            response = requests.post(
-                SMTP2GO_API_URL,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=30
-            )
+            resultado = transporte.enviar(destinatario, asunto, contenido_html, adjunto_pdf, nombre_adjunto)
+        except Exception:
+            # Sin resultado del proveedor: se devuelve el turno para no dejarlo ocupado para siempre
+            control_envio.liberar()
+            raise
+        latencia = time.monotonic() - inicio
+        control_envio.registrar(resultado.exito, resultado.reintentable, latencia, resultado.retry_after)
+        return resultado._replace(latencia=latencia)
+    
+    def entregar_email(self, destinatario_email: str, asunto: str, contenido_html: str,
+                       plantilla_certificado_id: Optional[str] = None,
+                       variables: Optional[Dict[str, str]] = None,
+                       modo_entrega: ModoEntrega = ModoEntrega.ADJUNTO,
+                       espera_maxima: Optional[float] = None,
+                       prioridad: str = Prioridad.INTERACTIVO) -> Tuple[ResultadoEnvio, Dict]:
+        """
+        Genera el certificado (si corresponde) y envía un correo ya renderizado
+        Devuelve el resultado del proveedor y los metadatos de la entrega
+        (incluidas las METRICAS_ENTREGA; tiempo_render_ms aquí es solo el del certificado)
+        """
+        inicio_render = time.monotonic()
+        # Generar PDF si hay plantilla de certificado
+        adjunto_pdf = None
+        certificado = None
+        if plantilla_certificado_id:
+            print(f"  📄 Generando PDF para plantilla: {plantilla_certificado_id}")
+            plantilla = self.db.query(Plantilla).filter(
+                Plantilla.id == plantilla_certificado_id
+            ).first()
             
-            if response.status_code == 200:
-                data = response.json().get('data', {})
-                if data.get('succeeded', 0) > 0:
-                    return True, "Email enviado exitosamente"
+            if plantilla:
+                print(f"  📄 Plantilla encontrada: {plantilla.nombre}")
+                variables_pdf = variables or {}
+                
+                if modo_entrega == ModoEntrega.ENLACE:
+                    # Un certificado ya guardado (p. ej. de un trabajo reanudado) no se vuelve a generar
+                    certificado = buscar_certificado(self.db, plantilla, variables_pdf)
+                    if certificado:
+                        print(f"  📄 Reutilizando certificado guardado: {certificado['id']}")
+                    else:
+                        print(f"  📄 Variables para PDF: {variables_pdf}")
+                        pdf_bytes = self.generar_pdf_certificado(plantilla, variables_pdf)
+                        print(f"  📄 PDF generado: {len(pdf_bytes) if pdf_bytes else 0} bytes")
+                        # Guardar el PDF y enviar solo un enlace firmado
+                        certificado = guardar_certificado(
+                            plantilla, variables_pdf, pdf_bytes, destinatario_email
+                        )
+                    contenido_html = insertar_enlace_certificado(
+                        contenido_html, enlace_descarga(certificado)
+                    )
                 else:
-                    error = data.get('failures', ['Error desconocido'])[0] if data.get('failures') else "Error API"
-                    return False, f"Falló el envío: {error}"
+                    # Un certificado pregenerado (o ya guardado) se adjunta sin volver a generarlo
+                    certificado = buscar_certificado(self.db, plantilla, variables_pdf)
+                    if certificado:
+                        print(f"  📄 Adjuntando certificado guardado: {certificado['id']}")
+                        adjunto_pdf = leer_certificado(certificado["id"])
+                    else:
+                        print(f"  📄 Variables para PDF: {variables_pdf}")
+                        pdf_bytes = self.generar_pdf_certificado(plantilla, variables_pdf)
+                        print(f"  📄 PDF generado: {len(pdf_bytes) if pdf_bytes else 0} bytes")
+                        adjunto_pdf = pdf_bytes
             else:
-                return False, f"HTTP {response.status_code}: {response.text}"
-                
-        except Exception as e:
-            return False, f"Error de conexión: {str(e)}"
+                print(f"  ❌ Plantilla no encontrada: {plantilla_certificado_id}")
+        tiempo_render = time.monotonic() - inicio_render
+        
+        # Enviar email
+        resultado = self.enviar_email_proveedor(
+            destinatario=destinatario_email,
+            asunto=asunto,
+            contenido_html=contenido_html,
+            adjunto_pdf=adjunto_pdf,
+            espera_maxima=espera_maxima,
+            prioridad=prioridad
+        )
+        
+        entrega = {
+            "tiene_adjunto": adjunto_pdf is not None,
+            "modo_entrega": modo_entrega.value,
+            "certificado_id": str(certificado["id"]) if certificado else None,
+            "tiempo_render_ms": _ms(tiempo_render),
+            "latencia_envio_ms": _ms(resultado.latencia),
+            "tamano_adjunto": len(adjunto_pdf) if adjunto_pdf else None
+        }
+        return resultado, entrega
+    
+    def log_a_respuesta(self, log: LogEmail) -> LogEmailResponse:
+        """Convierte un LogEmail guardado en respuesta (metadatos ya llega como dict desde JSONB)"""
+        return LogEmailResponse.model_validate(log)
     
-    def enviar_email_individual(self, envio_data: EnvioEmailIndividual) -> LogEmailResponse:
+    def listar_logs(self, limite: int = 100, cursor: Optional[str] = None, skip: int = 0,
+                    estado: Optional[EstadoEmail] = None, destinatario_email: Optional[str] = None,
+                    desde: Optional[datetime] = None, hasta: Optional[datetime] = None,
+                    plantilla_email_id: Optional[uuid.UUID] = None,
+                    plantilla_certificado_id: Optional[uuid.UUID] = None,
+                    trabajo_id: Optional[uuid.UUID] = None,
+                    metadatos: Optional[Dict] = None) -> Tuple[List[LogEmailResponse], Optional[str]]:
         """
-        Envía un email individual y registra el log
+        Página de logs ordenada por (fecha_envio, id) descendente
+        Con cursor se pagina por keyset: la consulta arranca justo después del último log de la
+        página anterior usando los índices compuestos, así el costo no crece con la profundidad.
+        skip (offset) se mantiene solo para clientes viejos.
+        metadatos filtra por contención (@>), resuelto con el índice GIN.
+        Devuelve los logs y el cursor de la página siguiente (None si no hay más).
+        """
+        limite = max(1, min(limite, LOGS_LIMITE_MAXIMO))
+        query = self.db.query(LogEmail)
+        
+        if estado is not None:
+            query = query.filter(LogEmail.estado == estado)
+        if destinatario_email:
+            query = query.filter(LogEmail.destinatario_email == destinatario_email)
+        if desde is not None:
+            query = query.filter(LogEmail.fecha_envio >= desde)
+        if hasta is not None:
+            query = query.filter(LogEmail.fecha_envio < hasta)
+        if plantilla_email_id:
+            query = query.filter(LogEmail.plantilla_email_id == plantilla_email_id)
+        if plantilla_certificado_id:
+            query = query.filter(LogEmail.plantilla_certificado_id == plantilla_certificado_id)
+        if trabajo_id:
+            query = query.filter(LogEmail.trabajo_id == trabajo_id)
+        if metadatos:
+            query = query.filter(LogEmail.metadatos.contains(metadatos))
+        
+        if cursor:
+            fecha, log_id = decodificar_cursor(cursor)
+            # La comparación de tuplas no poda particiones; el filtro por fecha_envio sí
+            query = query.filter(
+                LogEmail.fecha_envio <= fecha,
+                tuple_(LogEmail.fecha_envio, LogEmail.id) < tuple_(fecha, log_id)
+            )
+        elif skip:
+            query = query.offset(skip)
+        
+        # Un log de más indica si hay página siguiente
+        logs = query.order_by(LogEmail.fecha_envio.desc(), LogEmail.id.desc()).limit(limite + 1).all()
+        siguiente = None
+        if len(logs) > limite:
+            logs = logs[:limite]
+            siguiente = codificar_cursor(logs[-1].fecha_envio, logs[-1].id)
+        
+        return [self.log_a_respuesta(log) for log in logs], siguiente
+    
+    def logs_mas_lentos(self, metrica: str = "latencia_envio_ms", limite: int = 20,
+                        plantilla_email_id: Optional[uuid.UUID] = None,
+                        plantilla_certificado_id: Optional[uuid.UUID] = None,
+                        desde: Optional[datetime] = None,
+                        hasta: Optional[datetime] = None) -> List[LogEmailResponse]:
         """
-        # Crear log inicial
-        log_email = LogEmail(
-            destinatario_email=envio_data.destinatario_email,
-            destinatario_nombre=envio_data.destinatario_nombre,
-            asunto=envio_data.asunto,
-            plantilla_certificado_id=envio_data.plantilla_certificado_id,
-            estado=EstadoEmail.PENDIENTE
+        Envíos con mayor latencia del proveedor o mayor tiempo de render
+        Filtrando por la plantilla de METRICAS_LENTITUD (email para latencia, certificado para
+        render) la consulta es un recorrido hacia atrás del índice compuesto, partición por
+        partición, que se corta al llegar al límite.
+        """
+        if metrica not in METRICAS_LENTITUD:
+            raise ValueError(f"Métrica inválida: {metrica} (opciones: {', '.join(METRICAS_LENTITUD)})")
+        columna = getattr(LogEmail, metrica)
+        limite = max(1, min(limite, LOGS_LIMITE_MAXIMO))
+        
+        query = self.db.query(LogEmail).filter(columna.isnot(None))
+        if plantilla_email_id:
+            query = query.filter(LogEmail.plantilla_email_id == plantilla_email_id)
+        if plantilla_certificado_id:
+            query = query.filter(LogEmail.plantilla_certificado_id == plantilla_certificado_id)
+        if desde is not None:
+            query = query.filter(LogEmail.fecha_envio >= desde)
+        if hasta is not None:
+            query = query.filter(LogEmail.fecha_envio < hasta)
+        
+        logs = query.order_by(columna.desc()).limit(limite).all()
+        return [self.log_a_respuesta(log) for log in logs]
+    
+    def enviar_email_idempotente(self, envio_data: EnvioEmailIndividual,
+                                 idempotency_key: Optional[str] = None) -> LogEmailResponse:
+        """
+        Envía un email individual protegido por clave de idempotencia
+        Si la clave ya existe devuelve el log existente sin renderizar ni llamar al proveedor
+        """
+        if envio_data.modo_entrega == ModoEntrega.ENLACE:
+            validar_enlaces_publicos()
+        
+        plantilla_certificado = None
+        if envio_data.plantilla_certificado_id:
+            plantilla_certificado = self.db.query(Plantilla).filter(
+                Plantilla.id == envio_data.plantilla_certificado_id
+            ).first()
+        
+        clave_trab = clave_trabajo(idempotency_key, {
+            "tipo": "individual",
+            "destinatario_email": envio_data.destinatario_email,
+            "asunto": envio_data.asunto,
+            "contenido_html": envio_data.contenido_html,
+            "variables": envio_data.variables,
+            "modo_entrega": envio_data.modo_entrega.value,
+            "plantilla_certificado": identificador_version(plantilla_certificado)
+        })
+        clave = clave_mensaje(
+            clave_trab, envio_data.destinatario_email, "", identificador_version(plantilla_certificado)
         )
         
+        reservados = reservar_logs([fila_reserva(
+            clave, envio_data.destinatario_email, envio_data.destinatario_nombre,
+            envio_data.asunto, plantilla_certificado_id=envio_data.plantilla_certificado_id
+        )])
+        
+        if clave not in reservados:
+            print(f"🔁 Envío repetido para {envio_data.destinatario_email}: se devuelve el resultado existente")
+            # Lo pendiente en el buffer tiene que estar en la BD antes de leer el log
+            log_writer.flush()
+            log = buscar_log_por_clave(self.db, clave)
+            return self.log_a_respuesta(log)
+        
+        return self.enviar_email_individual(
+            envio_data, log_id=reservados[clave], espera_maxima=EMAIL_ESPERA_INDIVIDUAL_SEG
+        )
+    
+    def enviar_email_individual(self, envio_data: EnvioEmailIndividual, renderizado: bool = False,
+                                trabajo_id=None, plantilla_email_id=None, log_id=None,
+                                espera_maxima: Optional[float] = None,
+                                prioridad: str = Prioridad.INTERACTIVO,
+                                tiempo_render: float = 0.0) -> LogEmailResponse:
+        """
+        Envía un email individual y registra el log
+        El log se encola en el LogEmailWriter y se persiste en el siguiente flush
+        Si renderizado=True el contenido ya viene con las variables aplicadas
+        (tiempo_render: segundos que llevó renderizarlo, para el log)
+        Si log_id viene, el log ya fue reservado (idempotencia) y solo se actualiza
+        Si el envío falla queda programado un reintento o pasa a dead-letter
+        """
+        # Crear log inicial (id y fecha se generan aquí para no esperar a la BD)
+        log_data = {
+            "id": log_id or uuid.uuid4(),
+            "destinatario_email": envio_data.destinatario_email,
+            "destinatario_nombre": envio_data.destinatario_nombre,
+            "asunto": envio_data.asunto,
+            "plantilla_email_id": plantilla_email_id,
+            "plantilla_certificado_id": envio_data.plantilla_certificado_id,
+            "estado": EstadoEmail.PENDIENTE,
+            "mensaje_error": None,
+            "fecha_envio": datetime.now(timezone.utc),
+            "fecha_entrega": None,
+            "metadatos": None,
+            "trabajo_id": trabajo_id,
+            "intentos": 1,
+            "proveedor_message_id": None,
+            **dict.fromkeys(METRICAS_ENTREGA)
+        }
+        contenido_procesado = None
+        resultado = None
+        
         try:
             # Procesar contenido con variables
+            inicio_render = time.monotonic()
             contenido_procesado = envio_data.contenido_html
-            if envio_data.variables:
+            if envio_data.variables and not renderizado:
                 contenido_procesado = self.procesar_variables(contenido_procesado, envio_data.variables)
+            tiempo_render += time.monotonic() - inicio_render
             
-            # Generar PDF si hay plantilla de certificado
-            adjunto_pdf = None
-            if envio_data.plantilla_certificado_id:
-                print(f"  📄 Generando PDF para plantilla: {envio_data.plantilla_certificado_id}")
-                plantilla = self.db.query(Plantilla).filter(
-                    Plantilla.id == envio_data.plantilla_certificado_id
-                ).first()
-                
-                if plantilla:
-                    print(f"  📄 Plantilla encontrada: {plantilla.nombre}")
-                    variables_pdf = envio_data.variables or {}
-                    print(f"  📄 Variables para PDF: {variables_pdf}")
-                    adjunto_pdf = self.generar_pdf_certificado(plantilla, variables_pdf)
-                    print(f"  📄 PDF generado: {len(adjunto_pdf) if adjunto_pdf else 0} bytes")
-                else:
-                    print(f"  ❌ Plantilla no encontrada: {envio_data.plantilla_certificado_id}")
-            
-            # Enviar email
-            exito, mensaje = self.enviar_email_smtp2go(
-                destinatario=envio_data.destinatario_email,
+            resultado, entrega = self.entregar_email(
+                destinatario_email=envio_data.destinatario_email,
                 asunto=envio_data.asunto,
                 contenido_html=contenido_procesado,
-                adjunto_pdf=adjunto_pdf
+                plantilla_certificado_id=envio_data.plantilla_certificado_id,
+                variables=envio_data.variables,
+                modo_entrega=envio_data.modo_entrega,
+                espera_maxima=espera_maxima,
+                prioridad=prioridad
             )
             
             # Actualizar log
-            if exito:
-                log_email.estado = EstadoEmail.ENVIADO
-                log_email.fecha_entrega = datetime.utcnow()
+            if resultado.exito:
+                log_data["estado"] = EstadoEmail.ENVIADO
+                log_data["fecha_entrega"] = datetime.now(timezone.utc)
+                log_data["proveedor_message_id"] = resultado.message_id
             else:
-                log_email.estado = EstadoEmail.ERROR
-                log_email.mensaje_error = mensaje
+                log_data["estado"] = EstadoEmail.ERROR
+                log_data["mensaje_error"] = resultado.mensaje
             
-            # Guardar metadatos
-            metadatos = {
+            # Métricas como columnas; el resto a metadatos
+            for metrica in METRICAS_ENTREGA:
+                log_data[metrica] = entrega.pop(metrica)
+            log_data["tiempo_render_ms"] = (log_data["tiempo_render_ms"] or 0) + _ms(tiempo_render)
+            log_data["metadatos"] = {
                 "variables_utilizadas": list(envio_data.variables.keys()) if envio_data.variables else [],
-                "tiene_adjunto": adjunto_pdf is not None,
-                "timestamp_envio": datetime.utcnow().isoformat()
+                **entrega,
+                "timestamp_envio": datetime.now(timezone.utc).isoformat()
             }
-            log_email.metadatos = json.dumps(metadatos)
             
         except Exception as e:
-            log_email.estado = EstadoEmail.ERROR
-            log_email.mensaje_error = f"Error interno: {str(e)}"
+            log_data["estado"] = EstadoEmail.ERROR
+            log_data["mensaje_error"] = f"Error interno: {str(e)}"
         
-        # Guardar log en base de datos
-        self.db.add(log_email)
-        self.db.commit()
-        self.db.refresh(log_email)
+        # Fallo: reintento programado (transitorio) o dead-letter
+        if log_data["estado"] == EstadoEmail.ERROR:
+            log_data["estado"] = programar_reintento(
+                log_data, contenido_procesado or envio_data.contenido_html, envio_data, resultado
+            )
+        
+        # Encolar log para escritura por lotes
+        fila = dict(log_data)
+        if log_id is not None:
+            # La fila reservada ya tiene su id, clave y fecha de envío
+            del fila["id"], fila["fecha_envio"]
+            log_writer.actualizar(LogEmail, log_id, **fila)
+        else:
+            log_writer.registrar(LogEmail, fila)
         
-        # Convertir metadatos de string JSON a dict si es necesario
-        log_data = {
-            "id": log_email.id,
-            "destinatario_email": log_email.destinatario_email,
-            "destinatario_nombre": log_email.destinatario_nombre,
-            "asunto": log_email.asunto,
-            "plantilla_email_id": log_email.plantilla_email_id,
-            "plantilla_certificado_id": log_email.plantilla_certificado_id,
-            "estado": log_email.estado,
-            "mensaje_error": log_email.mensaje_error,
-            "fecha_envio": log_email.fecha_envio,
-            "fecha_entrega": log_email.fecha_entrega,
-            "metadatos": json.loads(log_email.metadatos) if log_email.metadatos else None
-        }
         return LogEmailResponse(**log_data)
     
-    def enviar_email_masivo_lotes(self, plantilla_email_id: str, destinatarios_ids: List[str], 
+    def iterar_destinatarios(self, destinatarios_ids: Optional[List[str]] = None,
+                             cursos_ids: Optional[List[str]] = None,
+                             desde_id=None) -> Iterator[Tuple[Usuario, Optional[str]]]:
+        """
+        Genera (usuario, nombre_curso) para los destinatarios de un envío
+        Usuarios sueltos y estudiantes de los cursos salen de una sola consulta ordenada
+        por id y leída con cursor del lado del servidor; cada usuario aparece una sola vez.
+        El orden por id permite reanudar desde el último destinatario procesado (desde_id).
+        """
+        if not destinatarios_ids and not cursos_ids:
+            return
+        
+        query = self._consulta_destinatarios(destinatarios_ids, cursos_ids)
+        if desde_id:
+            query = query.filter(Usuario.id > desde_id)
+        
+        # DISTINCT ON (usuarios.id): un registro por estudiante aunque esté en varios cursos
+        filas = query.distinct(Usuario.id).order_by(
+            Usuario.id, Curso.nombre
+        ).yield_per(DESTINATARIOS_YIELD_PER)
+        
+        for usuario, nombre_curso in filas:
+            yield usuario, nombre_curso
+    
+    def iterar_destinatarios_campana(self, cursos_ids: List[str],
+                                     desde_id=None) -> Iterator[Tuple[Usuario, Optional[str], int]]:
+        """
+        Genera (usuario, nombre_curso, grupo) para una campaña; grupo es la posición del curso en cursos_ids
+        Todos los cursos salen de una sola consulta: DISTINCT ON (usuarios.id) deja a cada
+        estudiante una vez, con el primer curso de la lista en el que está inscrito.
+        """
+        if not cursos_ids:
+            return
+        
+        orden_grupo = case(
+            {uuid.UUID(str(curso_id)): indice for indice, curso_id in enumerate(cursos_ids)},
+            value=Inscripcion.curso_id
+        )
+        query = self._consulta_destinatarios(None, cursos_ids).add_columns(orden_grupo)
+        if desde_id:
+            query = query.filter(Usuario.id > desde_id)
+        
+        filas = query.distinct(Usuario.id).order_by(
+            Usuario.id, orden_grupo
+        ).yield_per(DESTINATARIOS_YIELD_PER)
+        
+        for usuario, nombre_curso, grupo in filas:
+            yield usuario, nombre_curso, grupo
+    
+    def contar_destinatarios(self, destinatarios_ids: Optional[List[str]] = None,
+                             cursos_ids: Optional[List[str]] = None) -> int:
+        """Cantidad de destinatarios distintos de un envío (misma consulta que iterar_destinatarios)"""
+        if not destinatarios_ids and not cursos_ids:
+            return 0
+        return self._consulta_destinatarios(destinatarios_ids, cursos_ids).with_entities(
+            func.count(distinct(Usuario.id))
+        ).scalar() or 0
+    
+    def _consulta_destinatarios(self, destinatarios_ids: Optional[List[str]], cursos_ids: Optional[List[str]]):
+        """Usuarios activos de destinatarios_ids o inscritos en cursos_ids, con el nombre del curso"""
+        # LEFT JOIN: un usuario de destinatarios_ids puede no estar inscrito en los cursos
+        condiciones = []
+        if destinatarios_ids:
+            condiciones.append(Usuario.id.in_(destinatarios_ids))
+        if cursos_ids:
+            condiciones.append(Inscripcion.id.isnot(None))
+        
+        return self.db.query(Usuario, Curso.nombre).outerjoin(
+            Inscripcion, and_(
+                Inscripcion.estudiante_id == Usuario.id,
+                Inscripcion.curso_id.in_(cursos_ids or []),
+                Inscripcion.is_active == True
+            )
+        ).outerjoin(
+            Curso, Curso.id == Inscripcion.curso_id
+        ).filter(
+            Usuario.is_active == True,
+            or_(*condiciones)
+        )
+    
+    def enviar_email_masivo_lotes(self, plantilla_email_id: str, destinatarios_ids: Optional[List[str]] = None, 
                                  plantilla_certificado_id: Optional[str] = None,
                                  variables_globales: Optional[Dict] = None,
-                                 configuracion_lotes: Optional[Dict] = None) -> Dict:
+                                 configuracion_lotes: Optional[Dict] = None,
+                                 cursos_ids: Optional[List[str]] = None,
+                                 modo_entrega: ModoEntrega = ModoEntrega.ADJUNTO,
+                                 idempotency_key: Optional[str] = None) -> Dict:
         """
         Envía emails masivos por lotes con configuración de pausas
+        Los destinatarios pueden venir como IDs de usuario, como cursos o ambos
+        Un pedido repetido (misma Idempotency-Key o mismos parámetros) devuelve el
+        resultado del trabajo existente sin volver a enviar
         """
-        import time
-        from datetime import datetime
-        
-        # Configuración de lotes
-        lote_size = LOTE_SIZE
-        pausa_lotes = PAUSA_LOTES
-        pausa_individual = 1.0
-        
-        if configuracion_lotes:
-            lote_size = configuracion_lotes.get("lote_size", lote_size)
-            pausa_lotes = configuracion_lotes.get("pausa_lotes", pausa_lotes)
-            pausa_individual = configuracion_lotes.get("pausa_individual", pausa_individual)
+        trabajo, pendiente = self.registrar_trabajo_masivo(
+            plantilla_email_id, destinatarios_ids, plantilla_certificado_id,
+            variables_globales, configuracion_lotes, cursos_ids, modo_entrega, idempotency_key
+        )
+        if not pendiente:
+            print(f"🔁 Pedido repetido: se devuelve el trabajo {trabajo.id}")
+            return self.resumen_trabajo(trabajo)
         
+        with bloquear_trabajo(trabajo.clave_idempotencia) as bloqueado:
+            # Otro pedido (o el reanudador) puede estar ejecutando este mismo trabajo
+            self.db.refresh(trabajo)
+            if not bloqueado or trabajo.estado != EstadoTrabajo.EN_CURSO:
+                print(f"🔁 Pedido repetido: el trabajo {trabajo.id} ya está en curso")
+                return self.resumen_trabajo(trabajo)
+            
+            return self.ejecutar_trabajo(trabajo)
+    
+    def registrar_trabajo_masivo(self, plantilla_email_id: str, destinatarios_ids: Optional[List[str]] = None,
+                                 plantilla_certificado_id: Optional[str] = None,
+                                 variables_globales: Optional[Dict] = None,
+                                 configuracion_lotes: Optional[Dict] = None,
+                                 cursos_ids: Optional[List[str]] = None,
+                                 modo_entrega: ModoEntrega = ModoEntrega.ADJUNTO,
+                                 idempotency_key: Optional[str] = None,
+                                 no_antes_de: Optional[datetime] = None,
+                                 ventana_inicio: Optional[str] = None,
+                                 ventana_fin: Optional[str] = None) -> Tuple[TrabajoEnvio, bool]:
+        """
+        Valida un envío masivo y registra su trabajo (o encuentra el existente)
+        Con no_antes_de o una ventana (HH:MM-HH:MM) el trabajo queda PROGRAMADO hasta
+        que el reanudador lo active, salvo que ya pueda ejecutarse
+        Devuelve (trabajo, pendiente); pendiente=False si ya estaba completado
+        """
         # Obtener plantilla de email
         print(f"🔍 Buscando plantilla de email con ID: {plantilla_email_id}")
         plantilla_email = self.db.query(PlantillaEmail).filter(
@@ -406,57 +801,343 @@ class EmailService:
         
         print(f"✅ Plantilla encontrada: {plantilla_email.nombre} - Asunto: {plantilla_email.asunto}")
         
-        # Obtener destinatarios
-        usuarios = self.db.query(Usuario).filter(
-            Usuario.id.in_(destinatarios_ids),
-            Usuario.is_active == True
-        ).all()
+        # Se valida antes de registrar el trabajo para no dejar trabajos inválidos
+        self._validar_plantilla(plantilla_email, variables_globales, modo_entrega)
+        programacion, estado_inicial = self._programacion(no_antes_de, ventana_inicio, ventana_fin)
         
-        if not usuarios:
-            raise ValueError("No se encontraron usuarios válidos")
+        plantilla_certificado = None
+        if plantilla_certificado_id:
+            plantilla_certificado = self.db.query(Plantilla).filter(
+                Plantilla.id == plantilla_certificado_id
+            ).first()
+        
+        # Todo lo necesario para ejecutar (o reanudar) el trabajo queda guardado con él
+        # La clave incluye las versiones de las plantillas: editar una plantilla habilita un nuevo envío
+        parametros = {
+            "destinatarios_ids": sorted(destinatarios_ids or []),
+            "cursos_ids": sorted(cursos_ids or []),
+            "variables_globales": variables_globales or {},
+            "configuracion_lotes": configuracion_lotes or {},
+            "modo_entrega": modo_entrega.value,
+            "version_plantilla_email": identificador_version(plantilla_email),
+            "version_plantilla_certificado": identificador_version(plantilla_certificado)
+        }
+        clave_trab = clave_trabajo(idempotency_key, {
+            "tipo": "masivo",
+            **{k: v for k, v in parametros.items() if k != "configuracion_lotes"}
+        })
+        
+        return self._reservar_trabajo(
+            clave_trab, plantilla_email.id, plantilla_certificado_id, parametros, estado_inicial, programacion
+        )
+    
+    def registrar_campana(self, grupos: List[Dict], configuracion_lotes: Optional[Dict] = None,
+                          modo_entrega: ModoEntrega = ModoEntrega.ADJUNTO,
+                          idempotency_key: Optional[str] = None,
+                          no_antes_de: Optional[datetime] = None,
+                          ventana_inicio: Optional[str] = None,
+                          ventana_fin: Optional[str] = None) -> Tuple[TrabajoEnvio, bool]:
+        """
+        Valida una campaña (varios cursos, cada uno con sus plantillas) y registra su trabajo
+        grupos: dicts con curso_id, plantilla_email_id, plantilla_certificado_id y variables_globales
+        Toda la campaña es un solo trabajo: una consulta de destinatarios sin repetidos y
+        una sola cola de envío, en lugar de un envío masivo por curso compitiendo entre sí
+        Devuelve (trabajo, pendiente) como registrar_trabajo_masivo
+        """
+        programacion, estado_inicial = self._programacion(no_antes_de, ventana_inicio, ventana_fin)
+        
+        # Las plantillas de todos los grupos se cargan con una consulta por tipo
+        plantillas_email = {
+            str(p.id): p for p in self.db.query(PlantillaEmail).filter(
+                PlantillaEmail.id.in_({grupo["plantilla_email_id"] for grupo in grupos}),
+                PlantillaEmail.is_active == True
+            )
+        }
+        ids_certificado = {grupo["plantilla_certificado_id"] for grupo in grupos if grupo.get("plantilla_certificado_id")}
+        plantillas_certificado = {
+            str(p.id): p for p in self.db.query(Plantilla).filter(Plantilla.id.in_(ids_certificado))
+        } if ids_certificado else {}
         
+        grupos_trabajo = []
+        for num_grupo, grupo in enumerate(grupos, 1):
+            plantilla_email = plantillas_email.get(grupo["plantilla_email_id"])
+            if not plantilla_email:
+                raise ValueError(f"Grupo {num_grupo}: plantilla de email no encontrada")
+            plantilla_certificado = None
+            if grupo.get("plantilla_certificado_id"):
+                plantilla_certificado = plantillas_certificado.get(grupo["plantilla_certificado_id"])
+                if not plantilla_certificado:
+                    raise ValueError(f"Grupo {num_grupo}: plantilla de certificado no encontrada")
+            try:
+                self._validar_plantilla(plantilla_email, grupo.get("variables_globales"), modo_entrega)
+            except ValueError as e:
+                raise ValueError(f"Grupo {num_grupo}: {e}")
+            
+            grupos_trabajo.append({
+                "curso_id": grupo["curso_id"],
+                "plantilla_email_id": grupo["plantilla_email_id"],
+                "plantilla_certificado_id": grupo.get("plantilla_certificado_id"),
+                "variables_globales": grupo.get("variables_globales") or {},
+                "version_plantilla_email": identificador_version(plantilla_email),
+                "version_plantilla_certificado": identificador_version(plantilla_certificado)
+            })
+        
+        # El orden de los grupos es parte del pedido (decide qué correo recibe quien está en
+        # varios cursos), por eso no se ordenan antes de calcular la clave
+        parametros = {
+            "tipo": "campana",
+            "grupos": grupos_trabajo,
+            "configuracion_lotes": configuracion_lotes or {},
+            "modo_entrega": modo_entrega.value
+        }
+        clave_trab = clave_trabajo(idempotency_key, {
+            k: v for k, v in parametros.items() if k != "configuracion_lotes"
+        })
+        
+        print(f"📣 Campaña de {len(grupos_trabajo)} cursos con {len(plantillas_email)} plantillas de email")
+        return self._reservar_trabajo(clave_trab, None, None, parametros, estado_inicial, programacion)
+    
+    def _programacion(self, no_antes_de: Optional[datetime], ventana_inicio: Optional[str],
+                      ventana_fin: Optional[str]) -> Tuple[Dict, EstadoTrabajo]:
+        """Valida la programación de un trabajo; devuelve sus columnas y el estado inicial"""
+        if bool(ventana_inicio) != bool(ventana_fin):
+            raise ValueError("La ventana de ejecución necesita inicio y fin")
+        if ventana_inicio:
+            if parsear_hora(ventana_inicio) == parsear_hora(ventana_fin):
+                raise ValueError("La ventana de ejecución no puede empezar y terminar a la misma hora")
+        programacion = {
+            "no_antes_de": no_antes_de,
+            "ventana_inicio": ventana_inicio,
+            "ventana_fin": ventana_fin
+        }
+        estado_inicial = EstadoTrabajo.EN_CURSO if puede_ejecutarse(
+            no_antes_de, ventana_inicio, ventana_fin
+        ) else EstadoTrabajo.PROGRAMADO
+        return programacion, estado_inicial
+    
+    def _reservar_trabajo(self, clave_trab: str, plantilla_email_id, plantilla_certificado_id,
+                          parametros: Dict, estado_inicial: EstadoTrabajo,
+                          programacion: Dict) -> Tuple[TrabajoEnvio, bool]:
+        """Registra el trabajo o retoma el existente con la misma clave; devuelve (trabajo, pendiente)"""
+        # Registrar el trabajo: agrupa los logs y permite reintentar solo sus fallidos
+        # La programación no forma parte de la clave: reprogramar no habilita un segundo envío
+        trabajo, creado = reservar_trabajo(
+            self.db, clave_trab, plantilla_email_id, plantilla_certificado_id,
+            json.dumps(parametros), estado_inicial, programacion
+        )
+        
+        if not creado:
+            if trabajo.estado == EstadoTrabajo.COMPLETADO:
+                return trabajo, False
+            if trabajo.estado == EstadoTrabajo.ERROR:
+                # El intento anterior falló: se retoma; las claves por correo evitan duplicados
+                trabajo.estado = EstadoTrabajo.EN_CURSO
+                trabajo.parametros = json.dumps(parametros)
+                trabajo.fecha_fin = None
+                self.db.commit()
+            # EN_CURSO: en ejecución o interrumpido; quien tome el lock continúa desde el checkpoint
+            # PROGRAMADO o PAUSADO: el reanudador lo activa cuando corresponda
+            if not trabajo.parametros:
+                trabajo.parametros = json.dumps(parametros)
+                self.db.commit()
+        
+        return trabajo, True
+    
+    def _validar_plantilla(self, plantilla_email: PlantillaEmail, variables_globales: Optional[Dict],
+                           modo_entrega: ModoEntrega):
+        """Plantilla compilada (caché por id y versión); lanza ValueError si quedarían variables sin valor"""
+        plantilla_compilada = obtener_plantilla_compilada(plantilla_email)
+        variables_conocidas = VARIABLES_BASE | set(normalizar_valores(variables_globales or {}))
+        if modo_entrega == ModoEntrega.ENLACE:
+            # Un enlace a localhost no lo puede abrir ningún destinatario: se rechaza antes de enviar
+            validar_enlaces_publicos()
+            variables_conocidas = variables_conocidas | {"ENLACE_CERTIFICADO"}
+        plantilla_compilada.validar(variables_conocidas)
+        return plantilla_compilada
+    
+    def ejecutar_trabajo(self, trabajo: TrabajoEnvio) -> Dict:
+        """
+        Ejecuta un trabajo de envío masivo desde su último checkpoint
+        Al terminar cada lote se guarda el avance (último destinatario, contadores), así
+        un reinicio del servicio continúa donde quedó sin repetir lo ya enviado.
+        El llamador debe tener el lock del trabajo (bloquear_trabajo).
+        """
+        parametros = json.loads(trabajo.parametros)
+        campana = parametros.get("tipo") == "campana"
+        destinatarios_ids = parametros.get("destinatarios_ids") or []
+        cursos_ids = parametros.get("cursos_ids") or []
+        configuracion_lotes = parametros.get("configuracion_lotes") or {}
+        modo_entrega = ModoEntrega(parametros.get("modo_entrega", ModoEntrega.ADJUNTO.value))
+        
+        # Un envío masivo es un solo grupo; una campaña trae un grupo (curso y plantillas) por curso
+        if campana:
+            grupos = parametros.get("grupos") or []
+            cursos_ids = [grupo["curso_id"] for grupo in grupos]
+        else:
+            grupos = [{
+                "plantilla_email_id": trabajo.plantilla_email_id,
+                "plantilla_certificado_id": str(trabajo.plantilla_certificado_id) if trabajo.plantilla_certificado_id else None,
+                "variables_globales": parametros.get("variables_globales") or None,
+                "version_plantilla_email": parametros.get("version_plantilla_email", ""),
+                "version_plantilla_certificado": parametros.get("version_plantilla_certificado", "")
+            }]
+        
+        # Configuración de lotes
+        # Una campaña no pausa salvo que se pida: el ritmo lo marca control_envio
+        lote_size = configuracion_lotes.get("lote_size", LOTE_SIZE)
+        pausa_lotes = configuracion_lotes.get("pausa_lotes", 0 if campana else PAUSA_LOTES)
+        pausa_individual = configuracion_lotes.get("pausa_individual", 0 if campana else 1.0)
+        
+        trabajo_id = trabajo.id
+        clave_trab = trabajo.clave_idempotencia
+        desde_id = trabajo.ultimo_destinatario_id
+        reanudando = desde_id is not None or bool(trabajo.total_destinatarios)
+        
+        # Cada plantilla se carga y compila una vez por ejecución, no por destinatario
+        plantillas_email = {}
+        try:
+            if not grupos:
+                raise ValueError("La campaña no tiene grupos")
+            for grupo in grupos:
+                plantilla_email_id = str(grupo["plantilla_email_id"])
+                if plantilla_email_id not in plantillas_email:
+                    plantillas_email[plantilla_email_id] = self.db.query(PlantillaEmail).filter(
+                        PlantillaEmail.id == plantilla_email_id,
+                        PlantillaEmail.is_active == True
+                    ).first()
+                grupo["plantilla_email"] = plantillas_email[plantilla_email_id]
+                if not grupo["plantilla_email"]:
+                    raise ValueError("Plantilla de email no encontrada")
+                grupo["plantilla_compilada"] = self._validar_plantilla(
+                    grupo["plantilla_email"], grupo["variables_globales"], modo_entrega
+                )
+        except ValueError as e:
+            trabajo.estado = EstadoTrabajo.ERROR
+            trabajo.fecha_fin = datetime.now(timezone.utc)
+            self.db.commit()
+            bus_eventos.publicar(trabajo_id, "error_trabajo", {"mensaje": str(e)}, final=True)
+            raise
+        
+        # Total para progreso y ETA: una sola consulta por ejecución, antes de abrir el cursor
+        if trabajo.destinatarios_estimados is None:
+            trabajo.destinatarios_estimados = self.contar_destinatarios(destinatarios_ids, cursos_ids)
+            self.db.commit()
+        
+        # Destinatarios resueltos en streaming (sin cargar la lista completa), desde el checkpoint,
+        # como (usuario, nombre_curso, índice del grupo)
+        if campana:
+            destinatarios = self.iterar_destinatarios_campana(cursos_ids, desde_id=desde_id)
+        else:
+            destinatarios = (
+                (usuario, nombre_curso, 0) for usuario, nombre_curso
+                in self.iterar_destinatarios(destinatarios_ids, cursos_ids, desde_id=desde_id)
+            )
+        
+        # Los contadores parten de lo ya guardado si el trabajo se está reanudando
         resultados = {
-            "total_destinatarios": len(usuarios),
-            "enviados_exitosos": 0,
-            "errores": 0,
+            "trabajo_id": trabajo_id,
+            "total_destinatarios": trabajo.total_destinatarios or 0,
+            "enviados_exitosos": trabajo.enviados_exitosos or 0,
+            "errores": trabajo.errores or 0,
+            "omitidos": 0,
+            "suprimidos": 0,
             "log_ids": [],
             "errores_detalle": [],
             "tiempo_total": 0
         }
         
-        # Dividir en lotes
-        lotes = [usuarios[i:i + lote_size] for i in range(0, len(usuarios), lote_size)]
         tiempo_inicio = time.time()
         
-        print(f"🚀 Iniciando envío masivo: {len(usuarios)} destinatarios en {len(lotes)} lotes")
+        # Progreso en vivo para /trabajos-envio/{id}/eventos
+        progreso = MedidorProgreso(trabajo.destinatarios_estimados, resultados["total_destinatarios"])
+        
+        def publicar_destinatario(email: str, estado: str, log_id=None, mensaje_error: Optional[str] = None):
+            progreso.avanzar()
+            bus_eventos.publicar(trabajo_id, "destinatario", {
+                "email": email,
+                "estado": estado,
+                "log_id": log_id,
+                "mensaje_error": mensaje_error,
+                "enviados_exitosos": resultados["enviados_exitosos"],
+                "errores": resultados["errores"],
+                **progreso.datos()
+            })
+        
+        bus_eventos.publicar(trabajo_id, "inicio", {"reanudado": reanudando, **progreso.datos()})
+        
+        if reanudando:
+            print(f"♻️ Reanudando envío masivo después de {resultados['total_destinatarios']} destinatarios")
+        print(f"🚀 Iniciando envío masivo en lotes de {lote_size}")
         
         # Procesar cada lote
-        for num_lote, lote in enumerate(lotes, 1):
-            print(f"📦 Procesando lote {num_lote}/{len(lotes)} ({len(lote)} correos)")
+        for num_lote, lote in enumerate(_en_lotes(destinatarios, lote_size), 1):
+            # Fuera de la ventana de ejecución: se pausa; el checkpoint del lote anterior ya está guardado
+            if not dentro_de_ventana(trabajo.ventana_inicio, trabajo.ventana_fin):
+                return self._pausar_trabajo(trabajo, resultados, progreso)
+            
+            # Pausa entre lotes (antes de cada lote excepto el primero)
+            if num_lote > 1 and pausa_lotes > 0:
+                print(f"⏳ Pausa entre lotes: {pausa_lotes}s...")
+                time.sleep(pausa_lotes)
+            
+            print(f"📦 Procesando lote {num_lote} ({len(lote)} correos)")
+            resultados["total_destinatarios"] += len(lote)
+            
+            # Lista de supresión: se descartan antes de reservar logs o generar certificados
+            indice_supresiones.refrescar()
+            enviables = []
+            for usuario, nombre_curso, indice in lote:
+                if indice_supresiones.contiene(usuario.email):
+                    resultados["suprimidos"] += 1
+                    print(f"  🚫 {usuario.email} está en la lista de supresión, se omite")
+                    publicar_destinatario(usuario.email, "SUPRIMIDO")
+                else:
+                    enviables.append((usuario, nombre_curso, grupos[indice]))
             
-            for num_correo, usuario in enumerate(lote, 1):
+            # Reservar los logs del lote en una sola sentencia; las claves que ya existen se omiten,
+            # salvo los logs PENDIENTES de este mismo trabajo: si el proceso murió a mitad de un lote
+            # (aunque fuera el primero, sin checkpoint) se reclaman. El lock del trabajo asegura un solo ejecutor
+            claves = [
+                clave_mensaje(
+                    clave_trab, usuario.email,
+                    grupo["version_plantilla_email"], grupo["version_plantilla_certificado"]
+                )
+                for usuario, _, grupo in enviables
+            ]
+            reservados = reservar_logs([
+                fila_reserva(
+                    clave, usuario.email, usuario.nombre_completo, grupo["plantilla_email"].asunto,
+                    grupo["plantilla_email"].id, grupo["plantilla_certificado_id"], trabajo_id
+                )
+                for clave, (usuario, _, grupo) in zip(claves, enviables)
+            ], reclamar_trabajo_id=trabajo_id)
+            
+            for num_correo, ((usuario, nombre_curso, grupo), clave) in enumerate(zip(enviables, claves), 1):
+                plantilla_email = grupo["plantilla_email"]
+                plantilla_compilada = grupo["plantilla_compilada"]
+                plantilla_certificado_id = grupo["plantilla_certificado_id"]
+                variables_globales = grupo["variables_globales"]
+                
+                if clave not in reservados:
+                    resultados["omitidos"] += 1
+                    print(f"  ⏭️ {num_correo}/{len(enviables)}: {usuario.email} ya fue enviado, se omite")
+                    publicar_destinatario(usuario.email, "OMITIDO")
+                    continue
+                
                 try:
-                    print(f"  📧 {num_correo}/{len(lote)}: {usuario.email}")
+                    print(f"  📧 {num_correo}/{len(enviables)}: {usuario.email}")
                     
-                    # Preparar variables personalizadas
-                    variables = {
-                        "NOMBRE": usuario.nombre or "",
-                        "APELLIDO": usuario.apellido or "",
-                        "NOMBRE_COMPLETO": usuario.nombre_completo or "",
-                        "EMAIL": usuario.email or "",
-                        "CEDULA": usuario.cedula or "",
-                        "CURSO": variables_globales.get("CURSO", "") if variables_globales else "",
-                        "FECHA": datetime.now().strftime("%d/%m/%Y"),
-                        "INSTITUCION": "Centro de Desarrollo Profesional CDP"
-                    }
+                    # Preparar variables personalizadas (más las globales)
+                    variables = variables_destinatario(usuario, nombre_curso, variables_globales)
                     
-                    # Agregar variables globales
-                    if variables_globales:
-                        variables.update(variables_globales)
-                    
-                    # Procesar asunto y contenido
-                    asunto_procesado = self.procesar_variables(plantilla_email.asunto, variables)
-                    contenido_procesado = self.procesar_variables(plantilla_email.contenido_html, variables)
+                    # Renderizar asunto y contenido
+                    # El enlace del certificado se conoce después de generarlo: se conserva el marcador
+                    valores = normalizar_valores(variables)
+                    if modo_entrega == ModoEntrega.ENLACE:
+                        valores["ENLACE_CERTIFICADO"] = MARCADOR_ENLACE
+                    inicio_render = time.monotonic()
+                    asunto_procesado, contenido_procesado = plantilla_compilada.renderizar(valores)
+                    tiempo_render = time.monotonic() - inicio_render
                     
                     print(f"📧 Procesando email para {usuario.email}:")
                     print(f"   Asunto original: {plantilla_email.asunto}")
@@ -470,7 +1151,8 @@ class EmailService:
                         asunto=asunto_procesado,
                         contenido_html=contenido_procesado,
                         plantilla_certificado_id=plantilla_certificado_id,
-                        variables=variables
+                        variables=variables,
+                        modo_entrega=modo_entrega
                     )
                     
                     print(f"  📧 Datos de envío:")
@@ -479,7 +1161,12 @@ class EmailService:
                     print(f"     Variables: {envio_data.variables}")
                     
                     # Enviar email
-                    log_result = self.enviar_email_individual(envio_data)
+                    log_result = self.enviar_email_individual(
+                        envio_data, renderizado=True,
+                        trabajo_id=trabajo_id, plantilla_email_id=plantilla_email.id,
+                        log_id=reservados[clave], prioridad=Prioridad.MASIVO,
+                        tiempo_render=tiempo_render
+                    )
                     resultados["log_ids"].append(log_result.id)
                     
                     if log_result.estado == EstadoEmail.ENVIADO:
@@ -488,9 +1175,15 @@ class EmailService:
                     else:
                         resultados["errores"] += 1
                         error_msg = f"{usuario.email}: {log_result.mensaje_error}"
+                        if log_result.estado == EstadoEmail.ERROR:
+                            error_msg += " (reintento programado)"
                         resultados["errores_detalle"].append(error_msg)
                         print(f"     ❌ FALLÓ: {log_result.mensaje_error}")
                     
+                    publicar_destinatario(
+                        usuario.email, log_result.estado.value, log_result.id, log_result.mensaje_error
+                    )
+                    
                     # Pausa entre correos individuales
                     if pausa_individual > 0:
                         time.sleep(pausa_individual)
@@ -500,16 +1193,51 @@ class EmailService:
                     error_msg = f"{usuario.email}: {str(e)}"
                     resultados["errores_detalle"].append(error_msg)
                     print(f"     ❌ ERROR: {str(e)}")
+                    # El log ya está reservado como PENDIENTE: sin esto quedaría así para siempre
+                    # (el checkpoint lo deja atrás y los resúmenes lo contarían como pendiente)
+                    log_writer.actualizar(
+                        LogEmail, reservados[clave], estado=EstadoEmail.ERROR, mensaje_error=str(e)[:1000]
+                    )
+                    publicar_destinatario(
+                        usuario.email, EstadoEmail.ERROR.value, reservados[clave], mensaje_error=str(e)
+                    )
             
-            # Pausa entre lotes (excepto el último)
-            if num_lote < len(lotes) and pausa_lotes > 0:
-                print(f"⏳ Pausa entre lotes: {pausa_lotes}s...")
-                time.sleep(pausa_lotes)
+            # Checkpoint: los estados del lote quedan en la BD antes de avanzar el cursor
+            log_writer.flush()
+            guardar_checkpoint(
+                trabajo_id, resultados["total_destinatarios"], lote[-1][0].id,
+                resultados["enviados_exitosos"], resultados["errores"]
+            )
+        
+        if resultados["total_destinatarios"] == 0:
+            trabajo.estado = EstadoTrabajo.ERROR
+            trabajo.fecha_fin = datetime.now(timezone.utc)
+            self.db.commit()
+            bus_eventos.publicar(trabajo_id, "error_trabajo", {"mensaje": "No se encontraron usuarios válidos"}, final=True)
+            raise ValueError("No se encontraron usuarios válidos")
         
         # Calcular tiempo total
         tiempo_total = time.time() - tiempo_inicio
         resultados["tiempo_total"] = round(tiempo_total, 2)
         
+        # Cerrar el trabajo
+        trabajo.estado = EstadoTrabajo.COMPLETADO
+        trabajo.total_destinatarios = resultados["total_destinatarios"]
+        trabajo.enviados_exitosos = resultados["enviados_exitosos"]
+        trabajo.errores = resultados["errores"]
+        trabajo.fecha_fin = datetime.now(timezone.utc)
+        self.db.commit()
+        
+        bus_eventos.publicar(trabajo_id, "fin", {
+            "estado": EstadoTrabajo.COMPLETADO.value,
+            "total_destinatarios": resultados["total_destinatarios"],
+            "enviados_exitosos": resultados["enviados_exitosos"],
+            "errores": resultados["errores"],
+            "omitidos": resultados["omitidos"],
+            "suprimidos": resultados["suprimidos"],
+            "tiempo_total": resultados["tiempo_total"]
+        }, final=True)
+        
         print(f"\n🏁 ENVÍO COMPLETADO")
         print(f"✅ Exitosos: {resultados['enviados_exitosos']}")
         print(f"❌ Fallidos: {resultados['errores']}")
@@ -517,21 +1245,77 @@ class EmailService:
         
         return resultados
     
+    def _pausar_trabajo(self, trabajo: TrabajoEnvio, resultados: Dict, progreso: MedidorProgreso) -> Dict:
+        """Deja el trabajo PAUSADO hasta su próxima ventana; el reanudador lo retoma desde el checkpoint"""
+        trabajo.estado = EstadoTrabajo.PAUSADO
+        self.db.commit()
+        
+        print(f"⏸️ Trabajo {trabajo.id} pausado fuera de su ventana ({trabajo.ventana_inicio}-{trabajo.ventana_fin})")
+        bus_eventos.publicar(trabajo.id, "pausado", {
+            "ventana_inicio": trabajo.ventana_inicio,
+            "ventana_fin": trabajo.ventana_fin,
+            "enviados_exitosos": resultados["enviados_exitosos"],
+            "errores": resultados["errores"],
+            **progreso.datos()
+        })
+        return resultados
+    
+    def resumen_trabajo(self, trabajo: TrabajoEnvio) -> Dict:
+        """
+        Resultado de un trabajo ya registrado, armado desde sus logs
+        Es lo que recibe un pedido repetido en lugar de un nuevo envío
+        """
+        log_writer.flush()
+        
+        logs = self.db.query(
+            LogEmail.id, LogEmail.destinatario_email, LogEmail.estado, LogEmail.mensaje_error
+        ).filter(LogEmail.trabajo_id == trabajo.id).order_by(LogEmail.fecha_envio).all()
+        
+        exitosos = [log for log in logs if log.estado in (EstadoEmail.ENVIADO, EstadoEmail.ENTREGADO)]
+        fallidos = [log for log in logs if log.estado in (
+            EstadoEmail.ERROR, EstadoEmail.DESCARTADO, EstadoEmail.REBOTADO
+        )]
+        
+        tiempo_total = None
+        if trabajo.fecha_fin and trabajo.fecha_creacion:
+            tiempo_total = round((trabajo.fecha_fin - trabajo.fecha_creacion).total_seconds(), 2)
+        
+        return {
+            "trabajo_id": trabajo.id,
+            "total_destinatarios": len(logs),
+            "enviados_exitosos": len(exitosos),
+            "errores": len(fallidos),
+            "log_ids": [log.id for log in logs],
+            "errores_detalle": [f"{log.destinatario_email}: {log.mensaje_error}" for log in fallidos],
+            "tiempo_total": tiempo_total,
+            "repetido": True
+        }
+    
     def obtener_estadisticas_email(self) -> Dict:
         """
         Obtiene estadísticas de envíos de email
+        Una sola consulta agrupada sobre estadisticas_email_diarias (un registro por día y
+        estado), así el costo no crece con la cantidad de logs
         """
-        from sqlalchemy import func
+        # Los logs pendientes de escribir también cuentan
+        log_writer.flush()
         
-        # Estadísticas generales
-        total_enviados = self.db.query(LogEmail).count()
-        total_entregados = self.db.query(LogEmail).filter(LogEmail.estado == EstadoEmail.ENVIADO).count()
-        total_errores = self.db.query(LogEmail).filter(LogEmail.estado == EstadoEmail.ERROR).count()
-        total_pendientes = self.db.query(LogEmail).filter(LogEmail.estado == EstadoEmail.PENDIENTE).count()
+        hoy = datetime.now(timezone.utc).date()
+        filas = self.db.query(
+            EstadisticaEmailDiaria.estado,
+            func.sum(EstadisticaEmailDiaria.cantidad),
+            func.sum(EstadisticaEmailDiaria.cantidad).filter(EstadisticaEmailDiaria.fecha == hoy)
+        ).group_by(EstadisticaEmailDiaria.estado).all()
         
-        # Estadísticas por tiempo
-        hoy = datetime.now().date()
-        emails_hoy = self.db.query(LogEmail).filter(func.date(LogEmail.fecha_envio) == hoy).count()
+        por_estado = {estado: int(total or 0) for estado, total, _ in filas}
+        total_enviados = sum(por_estado.values())
+        # Aceptados por el proveedor, con o sin confirmación de entrega (webhook)
+        total_entregados = por_estado.get(EstadoEmail.ENVIADO, 0) + por_estado.get(EstadoEmail.ENTREGADO, 0)
+        total_errores = sum(por_estado.get(estado, 0) for estado in (
+            EstadoEmail.ERROR, EstadoEmail.DESCARTADO, EstadoEmail.REBOTADO
+        ))
+        total_pendientes = por_estado.get(EstadoEmail.PENDIENTE, 0)
+        emails_hoy = sum(int(del_dia or 0) for _, _, del_dia in filas)
         
         return {
             "total_enviados": total_enviados,
@@ -540,4 +1324,84 @@ class EmailService:
             "total_pendientes": total_pendientes,
             "emails_hoy": emails_hoy,
             "tasa_exito": round((total_entregados / total_enviados * 100), 2) if total_enviados > 0 else 0
+        }
+    
+    def obtener_series_email(self, granularidad: str = "hora", desde: Optional[datetime] = None,
+                             hasta: Optional[datetime] = None, por: Optional[str] = None,
+                             plantilla_email_id: Optional[uuid.UUID] = None,
+                             plantilla_certificado_id: Optional[uuid.UUID] = None) -> Dict:
+        """
+        Serie temporal de correos por hora o por día, opcionalmente desglosada por estado,
+        plantilla de email o plantilla de certificado
+        Lee estadisticas_email_horarias (la mantienen triggers sobre logs_email), así que el
+        costo depende del rango pedido y no de la cantidad de logs. Los buckets son UTC y
+        solo aparecen los que tienen correos.
+        """
+        if granularidad not in SERIES_RANGOS_DIAS:
+            raise ValueError(f"Granularidad inválida: {granularidad} (hora o dia)")
+        dimensiones = {
+            "estado": EstadisticaEmailHoraria.estado,
+            "plantilla_email": EstadisticaEmailHoraria.plantilla_email_id,
+            "plantilla_certificado": EstadisticaEmailHoraria.plantilla_certificado_id
+        }
+        if por is not None and por not in dimensiones:
+            raise ValueError(f"Desglose inválido: {por} (opciones: {', '.join(dimensiones)})")
+        
+        # Fechas sin zona se toman como UTC; la tabla guarda UTC sin zona
+        dias_defecto, dias_maximo = SERIES_RANGOS_DIAS[granularidad]
+        hasta = (hasta or datetime.now(timezone.utc))
+        hasta = hasta.replace(tzinfo=timezone.utc) if hasta.tzinfo is None else hasta.astimezone(timezone.utc)
+        desde = desde or hasta - timedelta(days=dias_defecto)
+        desde = desde.replace(tzinfo=timezone.utc) if desde.tzinfo is None else desde.astimezone(timezone.utc)
+        desde = desde.replace(minute=0, second=0, microsecond=0)
+        if granularidad == "dia":
+            desde = desde.replace(hour=0)
+        if desde >= hasta:
+            raise ValueError("'desde' debe ser anterior a 'hasta'")
+        if hasta - desde > timedelta(days=dias_maximo):
+            raise ValueError(f"El rango máximo por {granularidad} es de {dias_maximo} días")
+        
+        # Los logs pendientes de escribir también cuentan
+        log_writer.flush()
+        
+        tabla = EstadisticaEmailHoraria
+        inicio = tabla.hora if granularidad == "hora" else func.date_trunc("day", tabla.hora)
+        dimension = dimensiones.get(por)
+        columnas = [inicio.label("inicio")]
+        if dimension is not None:
+            columnas.append(dimension.label("clave"))
+        
+        query = self.db.query(*columnas, func.sum(tabla.cantidad).label("cantidad")).filter(
+            tabla.hora >= desde.replace(tzinfo=None),
+            tabla.hora < hasta.replace(tzinfo=None)
+        )
+        if plantilla_email_id:
+            query = query.filter(tabla.plantilla_email_id == plantilla_email_id)
+        if plantilla_certificado_id:
+            query = query.filter(tabla.plantilla_certificado_id == plantilla_certificado_id)
+        
+        agrupar = [inicio] + ([dimension] if dimension is not None else [])
+        filas = query.group_by(*agrupar).having(func.sum(tabla.cantidad) != 0).order_by(*agrupar).all()
+        
+        def clave(fila):
+            if dimension is None:
+                return None
+            valor = fila.clave
+            if isinstance(valor, EstadoEmail):
+                return valor.value
+            return None if str(valor) == SIN_PLANTILLA else str(valor)
+        
+        puntos = [{
+            "inicio": fila.inicio.replace(tzinfo=timezone.utc),
+            "clave": clave(fila),
+            "cantidad": int(fila.cantidad)
+        } for fila in filas]
+        
+        return {
+            "granularidad": granularidad,
+            "desde": desde,
+            "hasta": hasta,
+            "por": por,
+            "total": sum(p["cantidad"] for p in puntos),
+            "puntos": puntos
         }
\ No newline at end of file
@@ -0,0 +1,145 @@
+# app/eventos.py - CERTIFICADOS SERVICE
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+# Eventos que se guardan por trabajo para reenviar a quien se reconecta
+EVENTOS_BUFFER = int(os.getenv("EVENTOS_BUFFER", "1000"))
+# Tiempo que se conservan los eventos de un trabajo terminado
+EVENTOS_RETENCION_SEG = int(os.getenv("EVENTOS_RETENCION_SEG", "3600"))
+
+# Identifica esta ejecución del proceso: los ids de evento de un proceso anterior no sirven
+_EPOCA = format(int(time.time()), "x")
+
+
+class Evento:
+    """Evento de progreso de un trabajo, con id `<época>-<secuencia>` para Last-Event-ID"""
+    __slots__ = ("secuencia", "tipo", "datos")
+
+    def __init__(self, secuencia: int, tipo: str, datos: Dict):
+        self.secuencia = secuencia
+        self.tipo = tipo
+        self.datos = datos
+
+    @property
+    def id(self) -> str:
+        return f"{_EPOCA}-{self.secuencia}"
+
+    def formato_sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.tipo}\ndata: {json.dumps(self.datos, default=str)}\n\n"
+
+
+def parsear_last_event_id(last_event_id: Optional[str]) -> int:
+    """Secuencia desde la que hay que reenviar (0 = todo lo que haya en el buffer)"""
+    if not last_event_id:
+        return 0
+    epoca, _, secuencia = last_event_id.partition("-")
+    if epoca != _EPOCA or not secuencia.isdigit():
+        return 0
+    return int(secuencia)
+
+
+class _Canal:
+    __slots__ = ("secuencia", "eventos", "suscriptores", "terminado_en")
+
+    def __init__(self):
+        self.secuencia = 0
+        self.eventos: Deque[Evento] = deque(maxlen=EVENTOS_BUFFER)
+        self.suscriptores: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+        self.terminado_en: Optional[float] = None
+
+
+class BusEventos:
+    """
+    Pub/sub en memoria para el progreso de los trabajos de envío
+    Los hilos de envío publican; las conexiones SSE (asyncio) se suscriben.
+    La entrega cruza de hilo a event loop con call_soon_threadsafe, sin tocar la BD.
+    """
+
+    def __init__(self):
+        self._canales: Dict[str, _Canal] = {}
+        self._lock = threading.Lock()
+
+    def publicar(self, trabajo_id, tipo: str, datos: Dict, final: bool = False):
+        """Publica un evento; final=True marca el fin del trabajo"""
+        with self._lock:
+            self._limpiar()
+            canal = self._canales.setdefault(str(trabajo_id), _Canal())
+            canal.secuencia += 1
+            evento = Evento(canal.secuencia, tipo, datos)
+            canal.eventos.append(evento)
+            if final:
+                canal.terminado_en = time.monotonic()
+            suscriptores = list(canal.suscriptores)
+
+        for loop, cola in suscriptores:
+            try:
+                loop.call_soon_threadsafe(cola.put_nowait, evento)
+            except RuntimeError:
+                # El loop de esa conexión ya se cerró
+                pass
+
+    def suscribir(self, trabajo_id, desde: int = 0) -> Tuple[asyncio.Queue, List[Evento]]:
+        """
+        Registra una cola para el trabajo y devuelve los eventos ya emitidos después de `desde`
+        Se hace bajo el mismo lock que publicar, así no se pierde ni se duplica ningún evento.
+        Debe llamarse desde el event loop que va a leer la cola.
+        """
+        cola: asyncio.Queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            canal = self._canales.setdefault(str(trabajo_id), _Canal())
+            canal.suscriptores.add((loop, cola))
+            previos = [e for e in canal.eventos if e.secuencia > desde]
+        return cola, previos
+
+    def desuscribir(self, trabajo_id, cola: asyncio.Queue):
+        with self._lock:
+            canal = self._canales.get(str(trabajo_id))
+            if canal:
+                canal.suscriptores = {s for s in canal.suscriptores if s[1] is not cola}
+
+    def _limpiar(self):
+        """Descarta los canales de trabajos terminados hace más de EVENTOS_RETENCION_SEG"""
+        ahora = time.monotonic()
+        for clave in [
+            c for c, canal in self._canales.items()
+            if canal.terminado_en is not None and not canal.suscriptores
+            and ahora - canal.terminado_en > EVENTOS_RETENCION_SEG
+        ]:
+            del self._canales[clave]
+
+
+class MedidorProgreso:
+    """Calcula procesados, throughput y ETA de una ejecución de trabajo"""
+
+    def __init__(self, total: Optional[int], procesados_previos: int = 0):
+        self.total = total
+        self.procesados = procesados_previos
+        self._previos = procesados_previos
+        self._inicio = time.monotonic()
+
+    def avanzar(self, cantidad: int = 1):
+        self.procesados += cantidad
+
+    def datos(self) -> Dict:
+        transcurrido = time.monotonic() - self._inicio
+        hechos = self.procesados - self._previos
+        tasa = hechos / transcurrido if transcurrido > 0 else 0.0
+        eta = None
+        if self.total is not None and tasa > 0:
+            eta = round(max(0, self.total - self.procesados) / tasa, 1)
+        return {
+            "procesados": self.procesados,
+            "total": self.total,
+            "correos_por_segundo": round(tasa, 3),
+            "eta_segundos": eta
+        }
+
+
+# Instancia compartida por todo el servicio
+bus_eventos = BusEventos()
@@ -0,0 +1,409 @@
+# app/html_email.py - CERTIFICADOS SERVICE
+import os
+import re
+import base64
+import binascii
+from html import escape
+from html.parser import HTMLParser
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from app.almacenamiento import guardar_recurso_email, EXTENSIONES_RECURSO, BASE_URL_PUBLICA
+
+# Preprocesado del HTML de las plantillas de email al guardarlas (opt-in; false = se envía tal cual)
+EMAIL_HTML_PREPROCESAR = os.getenv("EMAIL_HTML_PREPROCESAR", "false").lower() == "true"
+
+# Elementos que no llevan estilos en línea ni cierre
+ETIQUETAS_SIN_ESTILO = {"html", "head", "title", "meta", "link", "style", "script", "base"}
+ETIQUETAS_VACIAS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"}
+# Contenido que se copia sin tocar los espacios
+ETIQUETAS_LITERALES = {"pre", "textarea", "script"}
+# Entre estas etiquetas los espacios no se ven y se eliminan
+ETIQUETAS_BLOQUE = (
+    "html|head|body|title|meta|link|style|table|thead|tbody|tfoot|tr|td|th|caption|colgroup|col|"
+    "div|p|h[1-6]|ul|ol|li|center|hr|br|blockquote|section|header|footer"
+)
+
+PATRON_STYLE = re.compile(r"<style\b[^>]*>(.*?)</style\s*>", re.S | re.I)
+PATRON_COMENTARIO_CSS = re.compile(r"/\*.*?\*/", re.S)
+PATRON_COMPUESTO = re.compile(r"^(\*|[a-zA-Z][\w-]*)?((?:[.#][\w-]+)*)$")
+PATRON_IMAGEN_BASE64 = re.compile(
+    r"data:(image/[a-z+.-]+);base64,([A-Za-z0-9+/=\s]+)", re.I
+)
+PATRON_ESPACIOS_ANTES_BLOQUE = re.compile(r"\s+(?=</?(?:%s)\b)" % ETIQUETAS_BLOQUE, re.I)
+PATRON_ESPACIOS_DESPUES_BLOQUE = re.compile(r"(</?(?:%s)\b[^>]*>)\s+" % ETIQUETAS_BLOQUE, re.I)
+PATRON_LITERAL = re.compile(r"(<pre\b.*?</pre\s*>|<textarea\b.*?</textarea\s*>)", re.S | re.I)
+
+# (etiqueta, clases, id) de un elemento; una regla CSS es (especificidad, orden, selector, declaraciones)
+Elemento = Tuple[str, FrozenSet[str], Optional[str]]
+Compuesto = Tuple[Optional[str], FrozenSet[str], Optional[str]]
+Declaracion = Tuple[str, str, bool]
+
+
+# ==================== CSS ====================
+
+def _dividir(texto: str, separador: str) -> List[str]:
+    """Divide por separador fuera de paréntesis y comillas (url(data:...;base64,...) lleva ';')"""
+    partes, actual, profundidad, comilla = [], [], 0, None
+    for caracter in texto:
+        if comilla:
+            comilla = None if caracter == comilla else comilla
+        elif caracter in "\"'":
+            comilla = caracter
+        elif caracter == "(":
+            profundidad += 1
+        elif caracter == ")":
+            profundidad = max(profundidad - 1, 0)
+        elif caracter == separador and profundidad == 0:
+            partes.append("".join(actual))
+            actual = []
+            continue
+        actual.append(caracter)
+    partes.append("".join(actual))
+    return partes
+
+
+def parsear_declaraciones(texto: str) -> List[Declaracion]:
+    """'color: red; margin:0 !important' -> [(propiedad, valor, importante)]"""
+    declaraciones = []
+    for parte in _dividir(texto, ";"):
+        propiedad, dos_puntos, valor = parte.partition(":")
+        propiedad, valor = propiedad.strip().lower(), " ".join(valor.split())
+        if not dos_puntos or not propiedad or not valor:
+            continue
+        importante = valor.lower().endswith("!important")
+        if importante:
+            valor = valor[:-len("!important")].rstrip()
+        declaraciones.append((propiedad, valor, importante))
+    return declaraciones
+
+
+def _compilar_selector(selector: str) -> Optional[Tuple[List[Compuesto], List[str]]]:
+    """
+    Selectores que se pueden resolver en el servidor: etiqueta, .clase, #id y sus combinaciones,
+    con descendiente (espacio) o hijo (>). Pseudoclases, atributos y hermanos devuelven None.
+    """
+    if not selector or re.search(r"[:\[\]+~\"'@\\]", selector):
+        return None
+    tokens = [t for t in re.split(r"\s*(>)\s*|\s+", selector.strip()) if t is not None and t != ""]
+    compuestos, combinadores, esperando_compuesto = [], [], True
+    for token in tokens:
+        if token == ">":
+            if esperando_compuesto:
+                return None
+            combinadores.append(">")
+            esperando_compuesto = True
+            continue
+        coincidencia = PATRON_COMPUESTO.match(token)
+        if not coincidencia or not token:
+            return None
+        if not esperando_compuesto:
+            combinadores.append(" ")
+        etiqueta = coincidencia[1] if coincidencia[1] and coincidencia[1] != "*" else None
+        simples = re.findall(r"([.#])([\w-]+)", coincidencia[2])
+        ids = [nombre for tipo, nombre in simples if tipo == "#"]
+        if len(ids) > 1:
+            return None
+        compuestos.append((
+            etiqueta.lower() if etiqueta else None,
+            frozenset(nombre for tipo, nombre in simples if tipo == "."),
+            ids[0] if ids else None
+        ))
+        esperando_compuesto = False
+    if not compuestos or esperando_compuesto:
+        return None
+    return compuestos, combinadores
+
+
+def _especificidad(compuestos: List[Compuesto]) -> Tuple[int, int, int]:
+    return (
+        sum(1 for _, _, id_ in compuestos if id_),
+        sum(len(clases) for _, clases, _ in compuestos),
+        sum(1 for etiqueta, _, _ in compuestos if etiqueta)
+    )
+
+
+def _fin_regla_arroba(css: str, inicio: int) -> int:
+    """Fin de una regla @ (@media, @font-face, @import...): su ';' o su bloque balanceado"""
+    punto_coma, llave = css.find(";", inicio), css.find("{", inicio)
+    if llave == -1 or (punto_coma != -1 and punto_coma < llave):
+        return len(css) if punto_coma == -1 else punto_coma + 1
+    profundidad = 0
+    for posicion in range(llave, len(css)):
+        if css[posicion] == "{":
+            profundidad += 1
+        elif css[posicion] == "}":
+            profundidad -= 1
+            if profundidad == 0:
+                return posicion + 1
+    return len(css)
+
+
+def _media_importante(regla: str) -> str:
+    """
+    Marca !important las declaraciones de un @media (o @supports) ya minificado
+    El CSS base pasa a atributos style, que le ganan a toda regla de hoja sin !important:
+    sin esto las variantes del bloque (p. ej. las de móvil) no se aplicarían nunca
+    """
+    llave = regla.find("{")
+    if llave == -1 or not regla.endswith("}"):
+        return regla
+    interior, partes, posicion = regla[llave + 1:-1], [], 0
+    while posicion < len(interior):
+        if interior[posicion] == "@":
+            fin = _fin_regla_arroba(interior, posicion)
+            partes.append(_media_importante(interior[posicion:fin]))
+            posicion = fin
+            continue
+        abre = interior.find("{", posicion)
+        cierra = interior.find("}", abre + 1) if abre != -1 else -1
+        if cierra == -1:
+            partes.append(interior[posicion:])
+            break
+        declaraciones = [(p, v, True) for p, v, _ in parsear_declaraciones(interior[abre + 1:cierra])]
+        partes.append(f"{interior[posicion:abre]}{{{_declaraciones_css(declaraciones)}}}")
+        posicion = cierra + 1
+    return regla[:llave + 1] + "".join(partes) + "}"
+
+
+def parsear_css(css: str) -> Tuple[list, List[str]]:
+    """
+    Separa el CSS en reglas que se pueden pasar a atributos style y el resto
+    (reglas @, pseudoclases, selectores complejos), que queda en un <style>
+    Las declaraciones de @media y @supports quedan !important para seguir ganándole al style en línea
+    """
+    css = PATRON_COMENTARIO_CSS.sub("", css)
+    reglas, resto, posicion, orden = [], [], 0, 0
+    while True:
+        while posicion < len(css) and css[posicion].isspace():
+            posicion += 1
+        if posicion >= len(css):
+            break
+        if css[posicion] == "@":
+            fin = _fin_regla_arroba(css, posicion)
+            regla = _minificar_css(css[posicion:fin])
+            if regla[:6].lower() == "@media" or regla[:9].lower() == "@supports":
+                regla = _media_importante(regla)
+            resto.append(regla)
+            posicion = fin
+            continue
+        llave = css.find("{", posicion)
+        cierre = css.find("}", llave + 1) if llave != -1 else -1
+        if cierre == -1:
+            break
+        selectores, cuerpo = css[posicion:llave], css[llave + 1:cierre]
+        posicion = cierre + 1
+        declaraciones = parsear_declaraciones(cuerpo)
+        if not declaraciones:
+            continue
+        for selector in _dividir(selectores, ","):
+            selector = " ".join(selector.split())
+            compilado = _compilar_selector(selector)
+            if compilado is None:
+                resto.append(f"{selector}{{{_declaraciones_css(declaraciones)}}}")
+            else:
+                reglas.append((_especificidad(compilado[0]), orden, compilado, declaraciones))
+                orden += 1
+    reglas.sort(key=lambda regla: (regla[0], regla[1]))
+    return reglas, resto
+
+
+def _minificar_css(css: str) -> str:
+    css = " ".join(css.split())
+    return re.sub(r"\s*([{};,>])\s*", r"\1", css).replace(";}", "}")
+
+
+def _declaraciones_css(declaraciones: List[Declaracion]) -> str:
+    return ";".join(f"{p}:{v}{' !important' if imp else ''}" for p, v, imp in declaraciones)
+
+
+def _coincide_compuesto(compuesto: Compuesto, elemento: Elemento) -> bool:
+    etiqueta, clases, id_ = compuesto
+    return (
+        (etiqueta is None or etiqueta == elemento[0])
+        and clases <= elemento[1]
+        and (id_ is None or id_ == elemento[2])
+    )
+
+
+def _coincide_ancestros(compuestos, combinadores, i: int, ancestros: List[Elemento], j: int) -> bool:
+    """compuestos[i] (y los anteriores) contra ancestros[j] hacia la raíz"""
+    if i < 0:
+        return True
+    if combinadores[i] == ">":
+        return j >= 0 and _coincide_compuesto(compuestos[i], ancestros[j]) and \
+            _coincide_ancestros(compuestos, combinadores, i - 1, ancestros, j - 1)
+    return any(
+        _coincide_compuesto(compuestos[i], ancestros[k])
+        and _coincide_ancestros(compuestos, combinadores, i - 1, ancestros, k - 1)
+        for k in range(j, -1, -1)
+    )
+
+
+def coincide(selector, elemento: Elemento, ancestros: List[Elemento]) -> bool:
+    compuestos, combinadores = selector
+    return _coincide_compuesto(compuestos[-1], elemento) and \
+        _coincide_ancestros(compuestos, combinadores, len(compuestos) - 2, ancestros, len(ancestros) - 1)
+
+
+# ==================== HTML ====================
+
+class _Reescritor(HTMLParser):
+    """
+    Vuelve a escribir el HTML con los estilos en línea, sin comentarios y con los
+    espacios colapsados. Conserva los comentarios condicionales de Outlook ([if mso]).
+    """
+
+    def __init__(self, reglas: list, css_restante: str):
+        super().__init__(convert_charrefs=False)
+        self.reglas = reglas
+        self.css_restante = css_restante
+        self.salida: List[str] = []
+        self.ancestros: List[Elemento] = []
+        self.literal = 0
+        self.en_style = False
+        self.style_omitido = False
+
+    def _estilo(self, elemento: Elemento, en_linea: Optional[str]) -> Optional[str]:
+        """Reglas que aplican por especificidad, luego el style propio, luego las !important"""
+        normales: Dict[str, str] = {}
+        importantes: Dict[str, str] = {}
+        for _, _, selector, declaraciones in self.reglas:
+            if coincide(selector, elemento, self.ancestros):
+                for propiedad, valor, importante in declaraciones:
+                    destino = importantes if importante else normales
+                    destino.pop(propiedad, None)
+                    destino[propiedad] = valor
+        for propiedad, valor, _ in parsear_declaraciones(en_linea or ""):
+            normales.pop(propiedad, None)
+            normales[propiedad] = valor
+        for propiedad, valor in importantes.items():
+            normales.pop(propiedad, None)
+            normales[propiedad] = valor + " !important"
+        return ";".join(f"{p}:{v}" for p, v in normales.items()) or None
+
+    def _etiqueta(self, tag: str, attrs, cerrada: bool):
+        atributos = dict(attrs)
+        if tag not in ETIQUETAS_SIN_ESTILO and (self.reglas or "style" in atributos):
+            elemento = (tag, frozenset((atributos.get("class") or "").split()), atributos.get("id"))
+            estilo = self._estilo(elemento, atributos.get("style"))
+            attrs = [(n, v) for n, v in attrs if n != "style"]
+            if estilo:
+                attrs.append(("style", estilo))
+        partes = [tag] + [n if v is None else f'{n}="{escape(v, quote=True)}"' for n, v in attrs]
+        self.salida.append("<" + " ".join(partes) + (" />" if cerrada else ">"))
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "style":
+            self.en_style = True
+            self.style_omitido = not self.css_restante
+            if not self.style_omitido:
+                self.salida.append("<style>" + self.css_restante)
+            return
+        self._etiqueta(tag, attrs, False)
+        if tag in ETIQUETAS_LITERALES:
+            self.literal += 1
+        if tag not in ETIQUETAS_VACIAS:
+            clases = frozenset((dict(attrs).get("class") or "").split())
+            self.ancestros.append((tag, clases, dict(attrs).get("id")))
+
+    def handle_startendtag(self, tag, attrs):
+        self._etiqueta(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        if tag == "style":
+            if not self.style_omitido:
+                self.salida.append("</style>")
+            self.en_style = False
+            return
+        if tag in ETIQUETAS_LITERALES and self.literal:
+            self.literal -= 1
+        # HTML mal cerrado: se cierra hasta la etiqueta abierta correspondiente, si la hay
+        for posicion in range(len(self.ancestros) - 1, -1, -1):
+            if self.ancestros[posicion][0] == tag:
+                del self.ancestros[posicion:]
+                break
+        if tag not in ETIQUETAS_VACIAS:
+            self.salida.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if self.en_style:
+            return
+        self.salida.append(data if self.literal else re.sub(r"\s+", " ", data))
+
+    def handle_entityref(self, name):
+        self.salida.append(f"&{name};")
+
+    def handle_charref(self, name):
+        self.salida.append(f"&#{name};")
+
+    def handle_comment(self, data):
+        if data.startswith("[if") or data.startswith("<![endif]") or data.endswith("[endif]"):
+            self.salida.append(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self.salida.append(f"<!{decl}>")
+
+    def unknown_decl(self, data):
+        self.salida.append(f"<![{data}]>")
+
+    def handle_pi(self, data):
+        self.salida.append(f"<?{data}>")
+
+
+def quitar_espacios_entre_bloques(html: str) -> str:
+    """Espacios junto a etiquetas de bloque (no se ven); el contenido de <pre> y <textarea> no se toca"""
+    partes = PATRON_LITERAL.split(html)
+    for i in range(0, len(partes), 2):
+        partes[i] = PATRON_ESPACIOS_DESPUES_BLOQUE.sub(r"\1", PATRON_ESPACIOS_ANTES_BLOQUE.sub("", partes[i]))
+    return "".join(partes)
+
+
+def extraer_imagenes(html: str) -> str:
+    """Reemplaza las imágenes data:...;base64 por URLs de archivos guardados (una vez por contenido)"""
+    def reemplazar(coincidencia):
+        mimetype = coincidencia[1].lower()
+        if mimetype not in EXTENSIONES_RECURSO:
+            return coincidencia[0]
+        try:
+            datos = base64.b64decode("".join(coincidencia[2].split()), validate=True)
+        except (binascii.Error, ValueError):
+            return coincidencia[0]
+        return guardar_recurso_email(datos, mimetype)
+
+    return PATRON_IMAGEN_BASE64.sub(reemplazar, html)
+
+
+def preprocesar_html(html: str) -> str:
+    """
+    Prepara el HTML de una plantilla de email para enviarlo muchas veces:
+    CSS de los <style> en atributos style, comentarios fuera, espacios colapsados
+    e imágenes base64 extraídas a /recursos-email (solo si BASE_URL es pública; si no, las
+    imágenes quedarían apuntando a la máquina del destinatario y se dejan embebidas).
+    Las variables {VARIABLE} se conservan. Si algo falla se devuelve el HTML original.
+    """
+    if not EMAIL_HTML_PREPROCESAR or not html:
+        return html
+    try:
+        bloques = PATRON_STYLE.findall(html)
+        reglas, resto = parsear_css("\n".join(bloques))
+        # Solo queda el primer <style> (vacío); el reescritor le pone el CSS que no se pudo pasar a línea
+        primero = [True]
+
+        def vaciar(coincidencia):
+            if primero[0]:
+                primero[0] = False
+                return "<style></style>"
+            return ""
+
+        reescritor = _Reescritor(reglas, "".join(resto))
+        reescritor.feed(PATRON_STYLE.sub(vaciar, html))
+        reescritor.close()
+        resultado = quitar_espacios_entre_bloques("".join(reescritor.salida)).strip()
+        if not BASE_URL_PUBLICA:
+            if PATRON_IMAGEN_BASE64.search(resultado):
+                print("⚠️ BASE_URL no es pública: las imágenes base64 de la plantilla no se extraen")
+            return resultado
+        return extraer_imagenes(resultado)
+    except Exception as e:
+        print(f"⚠️ No se pudo preprocesar el HTML de la plantilla, se usa tal cual: {e}")
+        return html
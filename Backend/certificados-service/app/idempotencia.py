@@ -0,0 +1,155 @@
+# app/idempotencia.py - CERTIFICADOS SERVICE
+import os
+import json
+import time
+import uuid
+import hashlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app.models import LogEmail, ClaveEmail, EstadoEmail, TrabajoEnvio, EstadoTrabajo
+from app.template_engine import version_plantilla
+
+# Sin Idempotency-Key, dos pedidos iguales dentro de esta ventana son el mismo pedido
+# (doble clic, reintento del proxy); pasado ese tiempo, repetirlo es un envío nuevo
+IDEMPOTENCIA_VENTANA_SEG = int(os.getenv("IDEMPOTENCIA_VENTANA_SEG", "300"))
+
+
+def _sha256(*partes) -> str:
+    return hashlib.sha256("|".join(str(p) for p in partes).encode("utf-8")).hexdigest()
+
+
+def identificador_version(plantilla) -> str:
+    """id@versión de una plantilla (o vacío si no hay)"""
+    if plantilla is None:
+        return ""
+    return f"{plantilla.id}@{version_plantilla(plantilla)}"
+
+
+def clave_trabajo(idempotency_key: Optional[str], parametros: Dict) -> str:
+    """
+    Clave de un trabajo de envío
+    Si el cliente envía Idempotency-Key se usa esa; si no, el hash de los parámetros
+    del pedido y del tramo de IDEMPOTENCIA_VENTANA_SEG en curso: repetir el mismo pedido
+    enseguida es un replay, pero un reenvío posterior (p. ej. con alumnos nuevos) es otro trabajo.
+    Un reintento justo en el cambio de tramo cae en otro; por eso los clientes deben
+    mandar la cabecera.
+    """
+    if idempotency_key:
+        return _sha256("cliente", idempotency_key.strip())
+    tramo = int(time.time() // max(IDEMPOTENCIA_VENTANA_SEG, 1))
+    return _sha256("pedido", tramo, json.dumps(parametros, sort_keys=True, default=str))
+
+
+def clave_mensaje(clave_trab: str, destinatario_email: str, version_email: str = "",
+                  version_certificado: str = "") -> str:
+    """
+    Clave de un correo: trabajo + destinatario + versión de plantilla y certificado
+    Las versiones llegan ya como identificador_version para que un trabajo reanudado
+    use las mismas que al empezar.
+    """
+    return _sha256(
+        clave_trab,
+        destinatario_email.strip().lower(),
+        version_email,
+        version_certificado
+    )
+
+
+def reservar_trabajo(db: Session, clave: str, plantilla_email_id=None,
+                     plantilla_certificado_id=None, parametros: Optional[str] = None,
+                     estado: EstadoTrabajo = EstadoTrabajo.EN_CURSO,
+                     programacion: Optional[Dict] = None) -> Tuple[TrabajoEnvio, bool]:
+    """
+    Crea el trabajo si su clave no existe (INSERT ... ON CONFLICT DO NOTHING)
+    programacion: no_antes_de, ventana_inicio y ventana_fin de un envío programado
+    Devuelve (trabajo, creado); creado=False significa que el pedido es un replay.
+    """
+    stmt = pg_insert(TrabajoEnvio.__table__).values(
+        id=uuid.uuid4(),
+        clave_idempotencia=clave,
+        plantilla_email_id=plantilla_email_id,
+        plantilla_certificado_id=plantilla_certificado_id,
+        parametros=parametros,
+        estado=estado,
+        **(programacion or {})
+    ).on_conflict_do_nothing(index_elements=["clave_idempotencia"]).returning(TrabajoEnvio.__table__.c.id)
+
+    trabajo_id = db.execute(stmt).scalar()
+    db.commit()
+
+    if trabajo_id is not None:
+        return db.query(TrabajoEnvio).filter(TrabajoEnvio.id == trabajo_id).first(), True
+    return db.query(TrabajoEnvio).filter(TrabajoEnvio.clave_idempotencia == clave).first(), False
+
+
+def fila_reserva(clave: str, destinatario_email: str, destinatario_nombre: Optional[str], asunto: str,
+                 plantilla_email_id=None, plantilla_certificado_id=None, trabajo_id=None) -> Dict:
+    """Fila PENDIENTE de logs_email que reserva un envío antes de renderizarlo"""
+    return {
+        "id": uuid.uuid4(),
+        "clave_idempotencia": clave,
+        "destinatario_email": destinatario_email,
+        "destinatario_nombre": destinatario_nombre,
+        "asunto": asunto,
+        "plantilla_email_id": plantilla_email_id,
+        "plantilla_certificado_id": plantilla_certificado_id,
+        "estado": EstadoEmail.PENDIENTE,
+        "fecha_envio": datetime.now(timezone.utc),
+        "trabajo_id": trabajo_id,
+        "intentos": 1
+    }
+
+
+def reservar_logs(filas: List[Dict], reclamar_trabajo_id=None) -> Dict[str, uuid.UUID]:
+    """
+    Reserva las claves de un lote en claves_email, saltando las ya existentes, e inserta
+    los logs de las reservadas, todo en una transacción
+    Devuelve {clave_idempotencia: id} solo de las filas reservadas ahora; el resto ya
+    fue enviado (o se está enviando) por otro pedido y no debe procesarse.
+    Con reclamar_trabajo_id también se devuelven los logs de ese trabajo que quedaron
+    PENDIENTES: se reservaron pero el proceso murió antes de enviarlos.
+    Usa su propia conexión: la sesión del envío puede estar leyendo destinatarios con
+    un cursor del lado del servidor, que un commit cerraría.
+    """
+    if not filas:
+        return {}
+
+    tabla = LogEmail.__table__
+    claves = ClaveEmail.__table__
+    stmt = pg_insert(claves).values([
+        {"clave": fila["clave_idempotencia"], "log_id": fila["id"], "fecha_envio": fila["fecha_envio"]}
+        for fila in filas
+    ]).on_conflict_do_nothing(index_elements=["clave"]).returning(claves.c.clave, claves.c.log_id)
+
+    with engine.begin() as conn:
+        reservados = {clave: log_id for clave, log_id in conn.execute(stmt)}
+        if reservados:
+            conn.execute(insert(tabla), [fila for fila in filas if fila["clave_idempotencia"] in reservados])
+
+        existentes = [fila["clave_idempotencia"] for fila in filas if fila["clave_idempotencia"] not in reservados]
+        if reclamar_trabajo_id is not None and existentes:
+            # El join por (id, fecha_envio) deja que cada búsqueda vaya a una sola partición
+            pendientes = conn.execute(
+                select(claves.c.clave, tabla.c.id).join(
+                    tabla, and_(tabla.c.id == claves.c.log_id, tabla.c.fecha_envio == claves.c.fecha_envio)
+                ).where(
+                    claves.c.clave.in_(existentes),
+                    tabla.c.estado == EstadoEmail.PENDIENTE,
+                    tabla.c.trabajo_id == reclamar_trabajo_id
+                )
+            )
+            reservados.update({clave: log_id for clave, log_id in pendientes})
+        return reservados
+
+
+def buscar_log_por_clave(db: Session, clave: str) -> Optional[LogEmail]:
+    """Log de una clave de idempotencia, yendo directo a su partición"""
+    return db.query(LogEmail).join(
+        ClaveEmail, and_(LogEmail.id == ClaveEmail.log_id, LogEmail.fecha_envio == ClaveEmail.fecha_envio)
+    ).filter(ClaveEmail.clave == clave).first()
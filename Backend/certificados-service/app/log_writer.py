@@ -0,0 +1,265 @@
+# app/log_writer.py - CERTIFICADOS SERVICE
+import os
+import atexit
+import threading
+import time
+from typing import Dict, List, Optional, Any
+
+from sqlalchemy import insert, update, bindparam
+from sqlalchemy.exc import DisconnectionError, InterfaceError, OperationalError
+
+from app.database import SessionLocal
+
+# Configuración del buffer de escritura
+LOG_WRITER_LOTE = int(os.getenv("LOG_WRITER_LOTE", "200"))
+LOG_WRITER_INTERVALO_MS = int(os.getenv("LOG_WRITER_INTERVALO_MS", "500"))
+LOG_WRITER_REINTENTOS_CIERRE = 3
+# Intentos de una fila que falla sola (restricción, partición inexistente) antes de descartarla
+LOG_WRITER_MAX_INTENTOS = int(os.getenv("LOG_WRITER_MAX_INTENTOS", "5"))
+
+
+def _agrupar_por_columnas(filas: List[Dict[str, Any]]) -> Dict[tuple, List[Dict[str, Any]]]:
+    """
+    Agrupa filas por su conjunto de columnas.
+    executemany necesita que todas las filas de una sentencia tengan las mismas claves.
+    """
+    grupos: Dict[tuple, List[Dict[str, Any]]] = {}
+    for fila in filas:
+        grupos.setdefault(tuple(sorted(fila.keys())), []).append(fila)
+    return grupos
+
+
+def _es_transitorio(error: Exception) -> bool:
+    """Errores de conexión: no son culpa de una fila, se reintenta todo sin contar intentos"""
+    return isinstance(error, (OperationalError, InterfaceError, DisconnectionError))
+
+
+class LogEmailWriter:
+    """
+    Buffer de escritura para los logs de email.
+
+    Acumula inserciones y cambios de estado en memoria y los persiste en una
+    sola transacción (INSERT multi-fila + UPDATE por lotes) cada
+    LOG_WRITER_LOTE filas o cada LOG_WRITER_INTERVALO_MS milisegundos.
+    Si falla la conexión, las filas vuelven al buffer y se reintentan en el
+    siguiente ciclo; al detener el servicio se vacía el buffer completo.
+    Si falla el lote por otra causa se escribe fila por fila: una fila que falla
+    siempre no frena al resto y se descarta (con su error en el log) tras
+    LOG_WRITER_MAX_INTENTOS intentos.
+    """
+
+    def __init__(self, session_factory=SessionLocal, lote: int = LOG_WRITER_LOTE,
+                 intervalo_ms: int = LOG_WRITER_INTERVALO_MS):
+        self.session_factory = session_factory
+        self.lote = lote
+        self.intervalo = intervalo_ms / 1000
+        # modelo -> {id: fila}, en orden de llegada
+        self._inserciones: Dict[Any, Dict[Any, Dict[str, Any]]] = {}
+        # modelo -> {id: campos a actualizar}
+        self._actualizaciones: Dict[Any, Dict[Any, Dict[str, Any]]] = {}
+        # (tabla, id, es_actualizacion) -> intentos fallidos de esa operación sola
+        self._intentos: Dict[tuple, int] = {}
+        self._pendientes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    # ==================== API PÚBLICA ====================
+
+    def iniciar(self):
+        """Arranca el hilo de escritura (idempotente)"""
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="log-email-writer", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        """Detiene el hilo y persiste todo lo que quede en el buffer"""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None and self._hilo is not threading.current_thread():
+            self._hilo.join(timeout=30)
+        self._hilo = None
+
+        for intento in range(1, LOG_WRITER_REINTENTOS_CIERRE + 1):
+            try:
+                self.flush()
+                return
+            except Exception as e:
+                print(f"❌ LogWriter: error vaciando buffer al cerrar (intento {intento}): {e}")
+                time.sleep(intento)
+        print(f"❌ LogWriter: se perdieron {self._pendientes} operaciones pendientes")
+
+    def registrar(self, modelo, fila: Dict[str, Any]):
+        """
+        Encola la inserción de una fila.
+        La fila debe traer su propio `id` (generado en la aplicación).
+        """
+        with self._lock:
+            self._inserciones.setdefault(modelo, {})[fila["id"]] = dict(fila)
+            self._pendientes += 1
+            lleno = self._pendientes >= self.lote
+        self._asegurar_hilo()
+        if lleno:
+            self._despertar.set()
+
+    def actualizar(self, modelo, fila_id, **campos):
+        """
+        Encola un cambio de estado para una fila.
+        Si la fila todavía está en el buffer se modifica ahí mismo.
+        """
+        with self._lock:
+            pendiente = self._inserciones.get(modelo, {}).get(fila_id)
+            if pendiente is not None:
+                pendiente.update(campos)
+            else:
+                self._actualizaciones.setdefault(modelo, {}).setdefault(fila_id, {}).update(campos)
+                self._pendientes += 1
+            lleno = self._pendientes >= self.lote
+        self._asegurar_hilo()
+        if lleno:
+            self._despertar.set()
+
+    def flush(self):
+        """Persiste inmediatamente el contenido del buffer"""
+        with self._flush_lock:
+            with self._lock:
+                inserciones, self._inserciones = self._inserciones, {}
+                actualizaciones, self._actualizaciones = self._actualizaciones, {}
+                self._pendientes = 0
+
+            if not inserciones and not actualizaciones:
+                return
+
+            try:
+                self._escribir(inserciones, actualizaciones)
+            except Exception as e:
+                if _es_transitorio(e):
+                    self._devolver_al_buffer(inserciones, actualizaciones)
+                    raise
+                print(f"⚠️ LogWriter: falló el lote, se escribe fila por fila: {e}")
+                self._escribir_por_fila(inserciones, actualizaciones)
+                return
+            self._olvidar_intentos(inserciones, actualizaciones)
+
+    # ==================== INTERNOS ====================
+
+    def _asegurar_hilo(self):
+        if self._hilo is None and not self._detener.is_set():
+            self.iniciar()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._despertar.wait(timeout=self.intervalo)
+            self._despertar.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ LogWriter: error escribiendo logs, se reintentará: {e}")
+
+    def _escribir(self, inserciones, actualizaciones):
+        """Escribe inserciones y actualizaciones en una sola transacción"""
+        db = self.session_factory()
+        try:
+            for modelo, filas in inserciones.items():
+                tabla = modelo.__table__
+                for _, grupo in _agrupar_por_columnas(list(filas.values())).items():
+                    db.execute(insert(tabla), grupo)
+
+            for modelo, cambios in actualizaciones.items():
+                tabla = modelo.__table__
+                # Los bindparam no pueden llamarse igual que las columnas del SET
+                filas = [
+                    {"b_id": fila_id, **{f"b_{k}": v for k, v in campos.items()}}
+                    for fila_id, campos in cambios.items()
+                ]
+                for columnas, grupo in _agrupar_por_columnas(filas).items():
+                    valores = {c[2:]: bindparam(c) for c in columnas if c != "b_id"}
+                    stmt = update(tabla).where(tabla.c.id == bindparam("b_id")).values(valores)
+                    db.execute(stmt, grupo)
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _escribir_por_fila(self, inserciones, actualizaciones):
+        """
+        Escribe cada operación en su propia transacción (después de que falló el lote)
+        Las que fallan vuelven al buffer con un intento más; al agotar los intentos se descartan
+        """
+        operaciones = [
+            (modelo, fila_id, fila, False)
+            for modelo, filas in inserciones.items() for fila_id, fila in filas.items()
+        ] + [
+            (modelo, fila_id, campos, True)
+            for modelo, cambios in actualizaciones.items() for fila_id, campos in cambios.items()
+        ]
+        devolver_ins: Dict[Any, Dict[Any, Dict[str, Any]]] = {}
+        devolver_act: Dict[Any, Dict[Any, Dict[str, Any]]] = {}
+
+        def devolver(modelo, fila_id, datos, es_actualizacion):
+            destino = devolver_act if es_actualizacion else devolver_ins
+            destino.setdefault(modelo, {})[fila_id] = datos
+
+        for indice, (modelo, fila_id, datos, es_actualizacion) in enumerate(operaciones):
+            clave = (modelo.__tablename__, fila_id, es_actualizacion)
+            try:
+                if es_actualizacion:
+                    self._escribir({}, {modelo: {fila_id: datos}})
+                else:
+                    self._escribir({modelo: {fila_id: datos}}, {})
+                self._intentos.pop(clave, None)
+            except Exception as e:
+                if _es_transitorio(e):
+                    # Se cayó la conexión: esta y las que faltan vuelven sin contar el intento
+                    for operacion in operaciones[indice:]:
+                        devolver(*operacion)
+                    self._devolver_al_buffer(devolver_ins, devolver_act)
+                    raise
+                intentos = self._intentos.pop(clave, 0) + 1
+                if intentos >= LOG_WRITER_MAX_INTENTOS:
+                    print(f"☠️ LogWriter: se descarta {'actualización' if es_actualizacion else 'inserción'} "
+                          f"en {modelo.__tablename__} {fila_id} tras {intentos} intentos: {e} | {datos}")
+                else:
+                    self._intentos[clave] = intentos
+                    print(f"❌ LogWriter: {modelo.__tablename__} {fila_id} falló (intento {intentos}): {e}")
+                    devolver(modelo, fila_id, datos, es_actualizacion)
+
+        self._devolver_al_buffer(devolver_ins, devolver_act)
+
+    def _olvidar_intentos(self, inserciones, actualizaciones):
+        """Borra los intentos fallidos de operaciones que ya se escribieron"""
+        if not self._intentos:
+            return
+        for operaciones, es_actualizacion in ((inserciones, False), (actualizaciones, True)):
+            for modelo, filas in operaciones.items():
+                for fila_id in filas:
+                    self._intentos.pop((modelo.__tablename__, fila_id, es_actualizacion), None)
+
+    def _devolver_al_buffer(self, inserciones, actualizaciones):
+        """Reincorpora al buffer las operaciones de un flush fallido, antes que las nuevas"""
+        with self._lock:
+            for modelo, filas in inserciones.items():
+                nuevas = self._inserciones.get(modelo, {})
+                self._inserciones[modelo] = {**filas, **nuevas}
+                self._pendientes += len(filas)
+            for modelo, cambios in actualizaciones.items():
+                nuevos = self._actualizaciones.setdefault(modelo, {})
+                for fila_id, campos in cambios.items():
+                    if fila_id in nuevos:
+                        nuevos[fila_id] = {**campos, **nuevos[fila_id]}
+                    else:
+                        nuevos[fila_id] = campos
+                        self._pendientes += 1
+
+
+# Instancia compartida por todo el servicio
+log_writer = LogEmailWriter()
+atexit.register(log_writer.detener)
@@ -6,6 +6,13 @@ from fastapi.staticfiles import StaticFiles
 
 from app.routes import router
 from app.database import create_tables
+from app.log_writer import log_writer
+from app.reintentos import programador_reintentos
+from app.trabajos import reanudador_trabajos
+from app.particiones import mantenimiento_logs
+from app.webhooks import buffer_eventos_entrega
+from app.outbox import consumidor_outbox
+from app.prerender import pregenerador_certificados
 
 # Crear app FastAPI
 app = FastAPI(
@@ -22,6 +29,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Siguiente-Cursor"],
 )
 
 # Incluir rutas
@@ -35,4 +43,27 @@ app.mount("/static", StaticFiles(directory=uploads_dir), name="static")
 @app.on_event("startup")
 def startup_event():
     """Ejecutar al iniciar la aplicación"""
-    create_tables()
\ No newline at end of file
+    create_tables()
+    log_writer.iniciar()
+    buffer_eventos_entrega.iniciar()
+    programador_reintentos.iniciar()
+    # Retomar los envíos masivos que quedaron a medias
+    reanudador_trabajos.iniciar()
+    # Eventos de cursos-service (inscripciones completadas y graduaciones)
+    consumidor_outbox.iniciar()
+    # Certificados pedidos por esos eventos o por ediciones de plantillas
+    pregenerador_certificados.iniciar()
+    # Particiones de logs_email: meses siguientes, congelado y archivo
+    mantenimiento_logs.iniciar()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Ejecutar al detener la aplicación"""
+    mantenimiento_logs.detener()
+    consumidor_outbox.detener()
+    pregenerador_certificados.detener()
+    reanudador_trabajos.detener()
+    programador_reintentos.detener()
+    # Aplicar los eventos de entrega y vaciar el buffer de logs antes de salir
+    buffer_eventos_entrega.detener()
+    log_writer.detener()
\ No newline at end of file
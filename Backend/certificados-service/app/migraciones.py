@@ -0,0 +1,251 @@
+# app/migraciones.py - CERTIFICADOS SERVICE
+from sqlalchemy import text
+
+# Estadísticas de correos: estadisticas_email_diarias y estadisticas_email_horarias se mantienen
+# con triggers por sentencia (con tablas de transición), así cada INSERT/UPDATE/DELETE sobre
+# logs_email ajusta los contadores una sola vez por grupo, sin importar por dónde se escribió el log.
+# Las plantillas nulas se guardan como SIN_PLANTILLA porque forman parte de la clave primaria.
+SIN_PLANTILLA = "00000000-0000-0000-0000-000000000000"
+
+FUNCION_ESTADISTICAS_EMAIL = """
+CREATE OR REPLACE FUNCTION estadisticas_email_actualizar() RETURNS trigger AS $$
+DECLARE
+    columnas CONSTANT text := 'COALESCE(fecha_envio, now()) AT TIME ZONE ''UTC'' AS momento, estado, '
+        || 'COALESCE(plantilla_email_id, ''""" + SIN_PLANTILLA + """'') AS plantilla_email_id, '
+        || 'COALESCE(plantilla_certificado_id, ''""" + SIN_PLANTILLA + """'') AS plantilla_certificado_id';
+    origen text;
+BEGIN
+    -- Cada log viejo resta y cada log nuevo suma; en un UPDATE solo quedan los grupos con saldo
+    IF TG_OP = 'INSERT' THEN
+        origen := format('SELECT %s, 1 AS delta FROM nuevas', columnas);
+    ELSIF TG_OP = 'UPDATE' THEN
+        origen := format('SELECT %s, -1 AS delta FROM viejas UNION ALL SELECT %s, 1 FROM nuevas', columnas, columnas);
+    ELSE
+        origen := format('SELECT %s, -1 AS delta FROM viejas', columnas);
+    END IF;
+
+    EXECUTE format($sql$
+        WITH cambios AS (%s),
+        diarias AS (
+            INSERT INTO estadisticas_email_diarias (fecha, estado, cantidad)
+            SELECT CAST(momento AS date), estado, sum(delta) FROM cambios
+            GROUP BY 1, 2 HAVING sum(delta) <> 0 ORDER BY 1, 2
+            ON CONFLICT (fecha, estado)
+            DO UPDATE SET cantidad = estadisticas_email_diarias.cantidad + EXCLUDED.cantidad
+        )
+        INSERT INTO estadisticas_email_horarias (hora, estado, plantilla_email_id, plantilla_certificado_id, cantidad)
+        SELECT date_trunc('hour', momento), estado, plantilla_email_id, plantilla_certificado_id, sum(delta)
+        FROM cambios
+        GROUP BY 1, 2, 3, 4 HAVING sum(delta) <> 0 ORDER BY 1, 2, 3, 4
+        ON CONFLICT (hora, estado, plantilla_email_id, plantilla_certificado_id)
+        DO UPDATE SET cantidad = estadisticas_email_horarias.cantidad + EXCLUDED.cantidad
+    $sql$, origen);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Carga inicial y triggers en una sola transacción: con logs_email bloqueada para escritura
+# no se pierde ni se cuenta dos veces ningún log entre el backfill y el primer trigger
+TRIGGERS_ESTADISTICAS_EMAIL = """
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'logs_email_estadisticas_insert') THEN
+        LOCK TABLE logs_email IN SHARE ROW EXCLUSIVE MODE;
+        DELETE FROM estadisticas_email_diarias;
+        INSERT INTO estadisticas_email_diarias (fecha, estado, cantidad)
+        SELECT CAST(COALESCE(fecha_envio, now()) AT TIME ZONE 'UTC' AS date), estado, count(*)
+        FROM logs_email GROUP BY 1, 2;
+
+        CREATE TRIGGER logs_email_estadisticas_insert AFTER INSERT ON logs_email
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_email_actualizar();
+        CREATE TRIGGER logs_email_estadisticas_update AFTER UPDATE ON logs_email
+            REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_email_actualizar();
+        CREATE TRIGGER logs_email_estadisticas_delete AFTER DELETE ON logs_email
+            REFERENCING OLD TABLE AS viejas
+            FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_email_actualizar();
+    END IF;
+END
+$$
+"""
+
+# Carga de los buckets horarios para bases que ya tenían los triggers diarios. Con logs_email
+# bloqueada se descarta lo que los triggers sumaron desde el arranque y se recalcula todo.
+BACKFILL_ESTADISTICAS_HORARIAS = """
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM migraciones_aplicadas WHERE nombre = 'backfill_estadisticas_horarias') THEN
+        LOCK TABLE logs_email IN SHARE ROW EXCLUSIVE MODE;
+        DELETE FROM estadisticas_email_horarias;
+        INSERT INTO estadisticas_email_horarias (hora, estado, plantilla_email_id, plantilla_certificado_id, cantidad)
+        SELECT date_trunc('hour', COALESCE(fecha_envio, now()) AT TIME ZONE 'UTC'), estado,
+               COALESCE(plantilla_email_id, '""" + SIN_PLANTILLA + """'),
+               COALESCE(plantilla_certificado_id, '""" + SIN_PLANTILLA + """'), count(*)
+        FROM logs_email GROUP BY 1, 2, 3, 4;
+        INSERT INTO migraciones_aplicadas (nombre) VALUES ('backfill_estadisticas_horarias');
+    END IF;
+END
+$$
+"""
+
+# Particiones mensuales de logs_email (logs_email_AAAA_MM), con límites en UTC. Las particiones
+# nuevas toleran poco trabajo muerto antes de que autovacuum pase, así el mes en uso se mantiene
+# chico y barato de limpiar. particiones.py la llama para crear los meses siguientes.
+FUNCION_CREAR_PARTICIONES = """
+CREATE OR REPLACE FUNCTION logs_email_crear_particiones(desde date, hasta date) RETURNS integer AS $$
+DECLARE
+    mes date := date_trunc('month', desde)::date;
+    nombre text;
+    creadas integer := 0;
+BEGIN
+    WHILE mes <= hasta LOOP
+        nombre := 'logs_email_' || to_char(mes, 'YYYY_MM');
+        IF to_regclass(nombre) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF logs_email FOR VALUES FROM (%L) TO (%L) '
+                'WITH (autovacuum_vacuum_scale_factor = 0.02, autovacuum_analyze_scale_factor = 0.01)',
+                nombre, mes::timestamp AT TIME ZONE 'UTC', (mes + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+            );
+            creadas := creadas + 1;
+        END IF;
+        mes := (mes + interval '1 month')::date;
+    END LOOP;
+    RETURN creadas;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Conversión de una logs_email sin particionar (bases anteriores). Se hace una sola vez, con la
+# tabla bloqueada: se copia a la tabla particionada con las particiones de todo su rango, las
+# claves de idempotencia pasan a claves_email y los índices se crean después de la carga.
+# Los triggers de estadísticas desaparecen con la tabla vieja; TRIGGERS_ESTADISTICAS_EMAIL los
+# vuelve a crear sobre la nueva.
+PARTICIONAR_LOGS_EMAIL = """
+DO $$
+DECLARE
+    desde date;
+    hasta date;
+    hoy date := CAST(now() AT TIME ZONE 'UTC' AS date);
+    indice record;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'logs_email'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    LOCK TABLE logs_email IN ACCESS EXCLUSIVE MODE;
+    UPDATE logs_email SET fecha_envio = COALESCE(fecha_entrega, now()) WHERE fecha_envio IS NULL;
+    ALTER TABLE logs_email RENAME TO logs_email_anterior;
+    -- Los nombres de índice son por esquema: se liberan para la tabla nueva
+    FOR indice IN
+        SELECT indexname FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = 'logs_email_anterior'
+    LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', indice.indexname, left('anterior_' || indice.indexname, 63));
+    END LOOP;
+
+    CREATE TABLE logs_email (LIKE logs_email_anterior INCLUDING DEFAULTS) PARTITION BY RANGE (fecha_envio);
+    ALTER TABLE logs_email ALTER COLUMN fecha_envio SET NOT NULL;
+
+    SELECT CAST(min(fecha_envio) AT TIME ZONE 'UTC' AS date), CAST(max(fecha_envio) AT TIME ZONE 'UTC' AS date)
+    INTO desde, hasta FROM logs_email_anterior;
+    PERFORM logs_email_crear_particiones(LEAST(COALESCE(desde, hoy), hoy), GREATEST(COALESCE(hasta, hoy), hoy));
+
+    INSERT INTO logs_email SELECT * FROM logs_email_anterior;
+    INSERT INTO claves_email (clave, log_id, fecha_envio)
+    SELECT clave_idempotencia, id, fecha_envio FROM logs_email_anterior
+    WHERE clave_idempotencia IS NOT NULL
+    ON CONFLICT (clave) DO NOTHING;
+    DROP TABLE logs_email_anterior;
+
+    ALTER TABLE logs_email ADD PRIMARY KEY (id, fecha_envio);
+    CREATE INDEX ix_logs_email_fecha_id ON logs_email (fecha_envio, id);
+    CREATE INDEX ix_logs_email_estado_fecha_id ON logs_email (estado, fecha_envio, id);
+    CREATE INDEX ix_logs_email_destinatario_fecha_id ON logs_email (destinatario_email, fecha_envio, id);
+    CREATE INDEX ix_logs_email_trabajo_fecha_id ON logs_email (trabajo_id, fecha_envio, id);
+    CREATE INDEX ix_logs_email_plantilla_fecha_id ON logs_email (plantilla_email_id, fecha_envio, id);
+END
+$$
+"""
+
+# metadatos pasa de TEXT (salida de json.dumps) a JSONB; reescribe la tabla una sola vez
+METADATOS_JSONB = """
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'logs_email' AND column_name = 'metadatos') = 'text' THEN
+        ALTER TABLE logs_email ALTER COLUMN metadatos TYPE JSONB USING metadatos::jsonb;
+    END IF;
+END
+$$
+"""
+
+# create_all solo crea tablas nuevas: los cambios sobre tablas existentes van aquí.
+# Cada sentencia debe ser idempotente porque se ejecutan en cada arranque.
+MIGRACIONES = [
+    # Reintentos y dead-letter
+    "ALTER TYPE estadoemail ADD VALUE IF NOT EXISTS 'DESCARTADO'",
+    "ALTER TABLE logs_email ADD COLUMN IF NOT EXISTS trabajo_id UUID",
+    "ALTER TABLE logs_email ADD COLUMN IF NOT EXISTS intentos INTEGER DEFAULT 1",
+    # Idempotencia de envíos (la unicidad de las claves de logs está en claves_email)
+    "ALTER TABLE logs_email ADD COLUMN IF NOT EXISTS clave_idempotencia VARCHAR(64)",
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS clave_idempotencia VARCHAR(64)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_trabajos_envio_clave_idempotencia ON trabajos_envio (clave_idempotencia)",
+    # Checkpoint y reanudación de envíos masivos
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS parametros TEXT",
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS ultimo_destinatario_id UUID",
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS fecha_checkpoint TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS interrupciones INTEGER DEFAULT 0",
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS ultimo_error TEXT",
+    # Progreso en vivo
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS destinatarios_estimados INTEGER",
+    # Envíos programados con ventana de ejecución
+    "ALTER TYPE estadotrabajo ADD VALUE IF NOT EXISTS 'PROGRAMADO'",
+    "ALTER TYPE estadotrabajo ADD VALUE IF NOT EXISTS 'PAUSADO'",
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS no_antes_de TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS ventana_inicio VARCHAR(5)",
+    "ALTER TABLE trabajos_envio ADD COLUMN IF NOT EXISTS ventana_fin VARCHAR(5)",
+    # logs_email particionada por mes; los meses siguientes los agrega particiones.py
+    FUNCION_CREAR_PARTICIONES,
+    PARTICIONAR_LOGS_EMAIL,
+    "SELECT logs_email_crear_particiones(CAST(now() AT TIME ZONE 'UTC' AS date), "
+    "CAST((now() + interval '3 months') AT TIME ZONE 'UTC' AS date))",
+    # Metadatos JSONB y métricas de cada envío como columnas
+    "ALTER TABLE logs_email ADD COLUMN IF NOT EXISTS tiempo_render_ms INTEGER",
+    "ALTER TABLE logs_email ADD COLUMN IF NOT EXISTS latencia_envio_ms INTEGER",
+    "ALTER TABLE logs_email ADD COLUMN IF NOT EXISTS tamano_adjunto INTEGER",
+    METADATOS_JSONB,
+    "CREATE INDEX IF NOT EXISTS ix_logs_email_metadatos ON logs_email USING gin (metadatos jsonb_path_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_logs_email_plantilla_latencia ON logs_email (plantilla_email_id, latencia_envio_ms)",
+    "CREATE INDEX IF NOT EXISTS ix_logs_email_certificado_render "
+    "ON logs_email (plantilla_certificado_id, tiempo_render_ms)",
+    # Eventos de entrega del proveedor (webhook)
+    "ALTER TYPE estadoemail ADD VALUE IF NOT EXISTS 'REBOTADO'",
+    "ALTER TABLE logs_email ADD COLUMN IF NOT EXISTS proveedor_message_id VARCHAR(255)",
+    "ALTER TABLE logs_email ADD COLUMN IF NOT EXISTS fecha_apertura TIMESTAMP WITH TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_logs_email_proveedor_message_id ON logs_email (proveedor_message_id)",
+    # Lista de supresión (la tabla la crea create_all): incluye los rebotes ya registrados
+    "INSERT INTO supresiones_email (email, motivo, detalle, is_active) "
+    "SELECT DISTINCT lower(destinatario_email), 'REBOTE', 'Rebote duro informado por el proveedor', true "
+    "FROM logs_email WHERE estado = 'REBOTADO' ON CONFLICT (email) DO NOTHING",
+    # Variables de las plantillas de email guardadas al escribir (las lecturas ya no las extraen)
+    "UPDATE plantillas_email SET variables_disponibles = ("
+    "SELECT json_agg(DISTINCT m[1])::text FROM regexp_matches(contenido_html, '\\{([A-Z_]+)\\}', 'g') AS m"
+    ") WHERE variables_disponibles IS NULL AND contenido_html ~ '\\{[A-Z_]+\\}'",
+    # HTML preprocesado de las plantillas de email (se completa al guardarlas)
+    "ALTER TABLE plantillas_email ADD COLUMN IF NOT EXISTS contenido_html_procesado TEXT",
+    # Estadísticas diarias y horarias (las tablas las crea create_all)
+    "CREATE TABLE IF NOT EXISTS migraciones_aplicadas (nombre VARCHAR(100) PRIMARY KEY, "
+    "fecha TIMESTAMP WITH TIME ZONE DEFAULT now())",
+    FUNCION_ESTADISTICAS_EMAIL,
+    TRIGGERS_ESTADISTICAS_EMAIL,
+    BACKFILL_ESTADISTICAS_HORARIAS,
+]
+
+
+def aplicar_migraciones(engine):
+    """Ejecuta las migraciones en autocommit (ALTER TYPE no admite transacción)"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for sentencia in MIGRACIONES:
+            conn.execute(text(sentencia))
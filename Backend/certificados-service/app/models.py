@@ -1,6 +1,6 @@
 # app/models.py - CERTIFICADOS SERVICE
-from sqlalchemy import Column, String, DateTime, Boolean, Enum, Text
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, DateTime, Boolean, Enum, Text, Integer, BigInteger, Date, Index, text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 import uuid
@@ -13,6 +13,34 @@ class EstadoEmail(str, enum.Enum):
     ENVIADO = "ENVIADO"
     ERROR = "ERROR"
     ENTREGADO = "ENTREGADO"
+    DESCARTADO = "DESCARTADO"  # agotó los reintentos (dead-letter)
+    REBOTADO = "REBOTADO"  # el proveedor lo aceptó pero el servidor destino lo rechazó (rebote duro)
+
+class EstadoTrabajo(str, enum.Enum):
+    PROGRAMADO = "PROGRAMADO"  # espera su no_antes_de o su ventana de ejecución
+    EN_CURSO = "EN_CURSO"
+    PAUSADO = "PAUSADO"  # salió de su ventana; se retoma desde el checkpoint en la próxima
+    COMPLETADO = "COMPLETADO"
+    ERROR = "ERROR"
+
+class EstadoReintento(str, enum.Enum):
+    PROGRAMADO = "PROGRAMADO"
+    EN_PROCESO = "EN_PROCESO"
+    COMPLETADO = "COMPLETADO"
+    DESCARTADO = "DESCARTADO"  # dead-letter: no se vuelve a intentar salvo pedido explícito
+
+class ModoEntrega(str, enum.Enum):
+    ADJUNTO = "ADJUNTO"  # PDF adjunto en el correo
+    ENLACE = "ENLACE"    # enlace firmado de descarga
+
+class MotivoSupresion(str, enum.Enum):
+    REBOTE = "REBOTE"  # rebote duro informado por el proveedor
+    MANUAL = "MANUAL"
+
+class EstadoPrerender(str, enum.Enum):
+    PENDIENTE = "PENDIENTE"  # pedido (o vuelto a pedir): lo toma el hilo de pregeneración
+    LISTO = "LISTO"
+    ERROR = "ERROR"
 
 class Plantilla(Base):
     """Plantillas de certificados"""
@@ -37,11 +65,49 @@ class PlantillaEmail(Base):
     descripcion = Column(String(255), nullable=True)
     asunto = Column(String(255), nullable=False)
     contenido_html = Column(Text, nullable=False)  # HTML del email
+    contenido_html_procesado = Column(Text, nullable=True)  # CSS en línea y minificado, lo que se envía (html_email.py)
     variables_disponibles = Column(Text, nullable=True)  # JSON con variables como {NOMBRE}, {APELLIDO}, etc.
     is_active = Column(Boolean, default=True)
     fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
     fecha_actualizacion = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+class CertificadoGenerado(Base):
+    """Certificados PDF generados y almacenados para descarga"""
+    __tablename__ = "certificados_generados"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    clave = Column(String(64), nullable=False, index=True)  # hash de plantilla + versión + variables
+    plantilla_certificado_id = Column(UUID(as_uuid=True), nullable=False)  # FK a plantillas
+    destinatario_email = Column(String(255), nullable=True)
+    sha256 = Column(String(64), nullable=False)  # hash del contenido, usado como ETag
+    tamano = Column(Integer, nullable=False)
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+
+class CertificadoInscripcion(Base):
+    """
+    Certificado pregenerado de una inscripción completada (ver prerender.py)
+    Es también la cola de pregeneración: pedirlo de nuevo solo vuelve la fila a PENDIENTE
+    y el hilo no regenera si la clave (plantilla, versión y variables) no cambió
+    """
+    __tablename__ = "certificados_inscripcion"
+
+    inscripcion_id = Column(UUID(as_uuid=True), primary_key=True)  # FK a inscripciones
+    estudiante_id = Column(UUID(as_uuid=True), nullable=False)
+    curso_id = Column(UUID(as_uuid=True), nullable=False)
+    plantilla_certificado_id = Column(UUID(as_uuid=True), nullable=True, index=True)  # la del curso si no se indicó otra
+    estado = Column(Enum(EstadoPrerender), nullable=False, default=EstadoPrerender.PENDIENTE)
+    certificado_id = Column(UUID(as_uuid=True), nullable=True)  # FK a certificados_generados
+    clave = Column(String(64), nullable=True)  # clave_certificado del último generado
+    version_plantilla = Column(String(100), nullable=True)  # identificador_version con que se generó
+    solicitudes = Column(Integer, nullable=False, default=1)  # pedidos recibidos (los repetidos se combinan)
+    ultimo_error = Column(Text, nullable=True)
+    fecha_solicitud = Column(DateTime(timezone=True), server_default=func.now())
+    fecha_generado = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_certificados_inscripcion_pendientes", "fecha_solicitud", postgresql_where=text("estado = 'PENDIENTE'")),
+    )
+
 class Usuario(Base):
     """Modelo de usuario para el servicio de certificados (referencia)"""
     __tablename__ = "usuarios"
@@ -58,18 +124,191 @@ class Usuario(Base):
     def nombre_completo(self):
         return f"{self.nombre} {self.apellido}"
 
+class Curso(Base):
+    """Modelo de curso de cursos-service (referencia, misma definición)"""
+    __tablename__ = "cursos"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    nombre = Column(String(200), nullable=False)
+    descripcion = Column(Text)
+    duracion = Column(Integer)  # horas
+    fecha_inicio = Column(Date)
+    fecha_fin = Column(Date)
+    instructor_id = Column(UUID(as_uuid=True), nullable=False)  # FK a usuarios
+    plantilla_id = Column(UUID(as_uuid=True))  # FK a plantillas (opcional)
+    is_active = Column(Boolean, default=True)
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+
+class Inscripcion(Base):
+    """Modelo de inscripción de cursos-service (referencia, misma definición)"""
+    __tablename__ = "inscripciones"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    curso_id = Column(UUID(as_uuid=True), nullable=False)  # FK a cursos
+    estudiante_id = Column(UUID(as_uuid=True), nullable=False)  # FK a usuarios
+    fecha_inscripcion = Column(DateTime(timezone=True), server_default=func.now())
+    completado = Column(Boolean, default=False)
+    is_active = Column(Boolean, default=True)
+
+class EventoSalida(Base):
+    """
+    Outbox de cursos-service (referencia, misma definición)
+    Los eventos se escriben en la misma transacción que el cambio; este servicio los consume
+    (ver outbox.py) y completa fecha_procesado y resultado
+    """
+    __tablename__ = "eventos_salida"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    tipo = Column(String(50), nullable=False)  # p. ej. CURSO_GRADUADO
+    agregado_id = Column(UUID(as_uuid=True), nullable=False)  # entidad que cambió (curso, inscripción)
+    payload = Column(JSONB, nullable=False)
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+    fecha_procesado = Column(DateTime(timezone=True), nullable=True)
+    intentos = Column(Integer, nullable=False, default=0)
+    ultimo_error = Column(Text, nullable=True)
+    resultado = Column(JSONB, nullable=True)  # lo que hizo el consumidor (p. ej. el trabajo de envío creado)
+
+    __table_args__ = (
+        # Solo los pendientes: es lo único que consulta el consumidor
+        Index("ix_eventos_salida_pendientes", "fecha_creacion", postgresql_where=text("fecha_procesado IS NULL")),
+    )
+
 class LogEmail(Base):
-    """Log de todos los correos enviados"""
+    """
+    Log de todos los correos enviados
+    Particionada por mes sobre fecha_envio (ver particiones.py): la clave primaria incluye
+    fecha_envio y la unicidad de clave_idempotencia vive en claves_email
+    """
     __tablename__ = "logs_email"
+    # Paginación por cursor sobre (fecha_envio, id): cada vista filtrada tiene su índice compuesto
+    # (Postgres los recorre hacia atrás para ORDER BY fecha_envio DESC, id DESC)
+    __table_args__ = (
+        Index("ix_logs_email_fecha_id", "fecha_envio", "id"),
+        Index("ix_logs_email_estado_fecha_id", "estado", "fecha_envio", "id"),
+        Index("ix_logs_email_destinatario_fecha_id", "destinatario_email", "fecha_envio", "id"),
+        Index("ix_logs_email_trabajo_fecha_id", "trabajo_id", "fecha_envio", "id"),
+        Index("ix_logs_email_plantilla_fecha_id", "plantilla_email_id", "fecha_envio", "id"),
+        # Consultas por contenido de metadatos (@>) y "envíos más lentos" por plantilla
+        Index("ix_logs_email_metadatos", "metadatos", postgresql_using="gin",
+              postgresql_ops={"metadatos": "jsonb_path_ops"}),
+        Index("ix_logs_email_plantilla_latencia", "plantilla_email_id", "latencia_envio_ms"),
+        Index("ix_logs_email_certificado_render", "plantilla_certificado_id", "tiempo_render_ms"),
+        Index("ix_logs_email_proveedor_message_id", "proveedor_message_id"),
+        {"postgresql_partition_by": "RANGE (fecha_envio)"},
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    destinatario_email = Column(String(255), nullable=False, index=True)
+    destinatario_email = Column(String(255), nullable=False)
     destinatario_nombre = Column(String(255), nullable=True)
     asunto = Column(String(255), nullable=False)
     plantilla_email_id = Column(UUID(as_uuid=True), nullable=True)  # FK a plantillas_email
     plantilla_certificado_id = Column(UUID(as_uuid=True), nullable=True)  # FK a plantillas (certificados)
     estado = Column(Enum(EstadoEmail), nullable=False, default=EstadoEmail.PENDIENTE)
     mensaje_error = Column(Text, nullable=True)
-    fecha_envio = Column(DateTime(timezone=True), server_default=func.now())
+    fecha_envio = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())  # clave de partición
     fecha_entrega = Column(DateTime(timezone=True), nullable=True)
-    metadatos = Column(Text, nullable=True)  # JSON con info adicional del envío
\ No newline at end of file
+    metadatos = Column(JSONB, nullable=True)  # info adicional del envío
+    trabajo_id = Column(UUID(as_uuid=True), nullable=True)  # FK a trabajos_envio
+    intentos = Column(Integer, default=1)
+    tiempo_render_ms = Column(Integer, nullable=True)  # plantilla de email + certificado
+    latencia_envio_ms = Column(Integer, nullable=True)  # respuesta del proveedor (sin la espera de turno)
+    tamano_adjunto = Column(Integer, nullable=True)  # bytes del PDF adjunto
+    proveedor_message_id = Column(String(255), nullable=True)  # id del proveedor, clave de sus eventos (webhook)
+    fecha_apertura = Column(DateTime(timezone=True), nullable=True)  # primera apertura informada por el proveedor
+    clave_idempotencia = Column(String(64), nullable=True)  # trabajo + destinatario + versiones (única en claves_email)
+
+class ClaveEmail(Base):
+    """
+    Claves de idempotencia de los correos
+    Una tabla particionada no admite un índice único que no incluya la clave de partición,
+    así que la unicidad se garantiza aquí; fecha_envio permite ir al log con poda de particiones
+    """
+    __tablename__ = "claves_email"
+
+    clave = Column(String(64), primary_key=True)
+    log_id = Column(UUID(as_uuid=True), nullable=False)
+    fecha_envio = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class TrabajoEnvio(Base):
+    """Envío masivo: agrupa los logs de una misma ejecución"""
+    __tablename__ = "trabajos_envio"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    clave_idempotencia = Column(String(64), nullable=True, unique=True, index=True)  # Idempotency-Key o hash del pedido
+    plantilla_email_id = Column(UUID(as_uuid=True), nullable=True)  # FK a plantillas_email
+    plantilla_certificado_id = Column(UUID(as_uuid=True), nullable=True)  # FK a plantillas
+    parametros = Column(Text, nullable=True)  # JSON con el pedido, necesario para reanudar
+    estado = Column(Enum(EstadoTrabajo), nullable=False, default=EstadoTrabajo.EN_CURSO)
+    total_destinatarios = Column(Integer, default=0)  # mientras está EN_CURSO: procesados hasta el checkpoint
+    enviados_exitosos = Column(Integer, default=0)
+    errores = Column(Integer, default=0)
+    destinatarios_estimados = Column(Integer, nullable=True)  # total contado al empezar, para progreso y ETA
+    ultimo_destinatario_id = Column(UUID(as_uuid=True), nullable=True)  # checkpoint: los destinatarios van ordenados por id
+    fecha_checkpoint = Column(DateTime(timezone=True), nullable=True)
+    interrupciones = Column(Integer, default=0)  # fallos seguidos del ejecutor sin avanzar el checkpoint
+    ultimo_error = Column(Text, nullable=True)  # motivo de la última interrupción
+    no_antes_de = Column(DateTime(timezone=True), nullable=True)  # no arranca antes de esta fecha
+    ventana_inicio = Column(String(5), nullable=True)  # "HH:MM" en TRABAJOS_ZONA_HORARIA
+    ventana_fin = Column(String(5), nullable=True)  # si es menor que el inicio, la ventana cruza la medianoche
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+    fecha_fin = Column(DateTime(timezone=True), nullable=True)
+
+class EstadisticaEmailDiaria(Base):
+    """Cantidad de logs_email por día (UTC) y estado; la mantienen triggers (ver migraciones.py)"""
+    __tablename__ = "estadisticas_email_diarias"
+
+    fecha = Column(Date, primary_key=True)
+    estado = Column(Enum(EstadoEmail), primary_key=True)
+    cantidad = Column(BigInteger, nullable=False, default=0)
+
+class EstadisticaEmailHoraria(Base):
+    """
+    Cantidad de logs_email por hora (UTC), estado y plantillas; la mantienen los mismos triggers
+    Las plantillas nulas se guardan como migraciones.SIN_PLANTILLA (son parte de la clave)
+    """
+    __tablename__ = "estadisticas_email_horarias"
+
+    hora = Column(DateTime, primary_key=True)  # inicio de la hora, UTC sin zona
+    estado = Column(Enum(EstadoEmail), primary_key=True)
+    plantilla_email_id = Column(UUID(as_uuid=True), primary_key=True)
+    plantilla_certificado_id = Column(UUID(as_uuid=True), primary_key=True)
+    cantidad = Column(BigInteger, nullable=False, default=0)
+
+class SupresionEmail(Base):
+    """
+    Direcciones a las que no se envían correos masivos (rebotes duros y altas manuales)
+    Se cargan en memoria (ver supresiones.py); quitar una dirección la desactiva en lugar de
+    borrarla para que el refresco incremental por fecha_actualizacion vea el cambio
+    """
+    __tablename__ = "supresiones_email"
+
+    email = Column(String(255), primary_key=True)  # en minúsculas
+    motivo = Column(Enum(MotivoSupresion), nullable=False, default=MotivoSupresion.MANUAL)
+    detalle = Column(Text, nullable=True)  # respuesta del servidor destino o nota de quien la agregó
+    is_active = Column(Boolean, nullable=False, default=True)
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+    fecha_actualizacion = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
+class ReintentoEmail(Base):
+    """Cola de reintentos y dead-letter de correos fallidos"""
+    __tablename__ = "reintentos_email"
+    __table_args__ = (
+        Index("ix_reintentos_email_estado_proximo", "estado", "proximo_intento"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    log_email_id = Column(UUID(as_uuid=True), nullable=False, index=True)  # FK a logs_email
+    trabajo_id = Column(UUID(as_uuid=True), nullable=True, index=True)  # FK a trabajos_envio
+    destinatario_email = Column(String(255), nullable=False)
+    destinatario_nombre = Column(String(255), nullable=True)
+    asunto = Column(String(255), nullable=False)
+    contenido_html = Column(Text, nullable=False)  # ya renderizado: el reintento no vuelve a procesar la plantilla
+    plantilla_certificado_id = Column(UUID(as_uuid=True), nullable=True)
+    variables = Column(Text, nullable=True)  # JSON, necesarias para regenerar el certificado
+    modo_entrega = Column(Enum(ModoEntrega), nullable=False, default=ModoEntrega.ADJUNTO)
+    estado = Column(Enum(EstadoReintento), nullable=False, default=EstadoReintento.PROGRAMADO)
+    intentos = Column(Integer, default=1)
+    proximo_intento = Column(DateTime(timezone=True), nullable=True)
+    ultimo_error = Column(Text, nullable=True)
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+    fecha_actualizacion = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
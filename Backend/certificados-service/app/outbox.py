@@ -0,0 +1,187 @@
+# app/outbox.py - CERTIFICADOS SERVICE
+import os
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import EventoSalida, EstadoTrabajo, ModoEntrega, Curso, Inscripcion
+from app.trabajos import lanzar_trabajo
+from app.prerender import solicitar_prerender, pregenerador_certificados
+
+# Cada cuánto se buscan eventos nuevos de cursos-service
+OUTBOX_INTERVALO_SEG = float(os.getenv("OUTBOX_INTERVALO_SEG", "1"))
+# Intentos por evento; después queda sin procesar, con su ultimo_error, para revisarlo a mano
+OUTBOX_MAX_INTENTOS = int(os.getenv("OUTBOX_MAX_INTENTOS", "5"))
+# Espera antes de reintentar un evento que falló (se duplica en cada intento)
+OUTBOX_ESPERA_SEG = float(os.getenv("OUTBOX_ESPERA_SEG", "10"))
+
+
+# Un manejador recibe la sesión (con el evento bloqueado) y devuelve (resultado, al_confirmar):
+# al_confirmar, si no es None, se llama después de confirmar (p. ej. para lanzar un trabajo)
+Manejador = Callable[[Session, EventoSalida], Tuple[Dict, Optional[Callable[[], None]]]]
+
+
+def manejar_inscripcion_completada(db: Session, evento: EventoSalida):
+    """INSCRIPCION_COMPLETADA: pregenerar el certificado de la inscripción"""
+    solicitadas = solicitar_prerender(db, Inscripcion.id == evento.payload["inscripcion_id"])
+    return {"prerender": solicitadas}, pregenerador_certificados.despertar
+
+
+def manejar_curso_graduado(db: Session, evento: EventoSalida):
+    """
+    CURSO_GRADUADO: pregenerar los certificados y hacer el envío masivo a los estudiantes
+    que se completaron con la graduación
+    La Idempotency-Key es el id del evento: procesarlo otra vez encuentra el mismo trabajo
+    """
+    from app.email_service import EmailService
+
+    datos = evento.payload
+    estudiantes_ids = datos.get("estudiantes_ids") or []
+    solicitadas = solicitar_prerender(db, and_(
+        Inscripcion.curso_id == datos["curso_id"],
+        Inscripcion.estudiante_id.in_(estudiantes_ids)
+    ), datos.get("plantilla_certificado_id"))
+    if not datos.get("plantilla_email_id"):
+        # Graduación sin correo: solo los certificados
+        return {"prerender": solicitadas, "trabajo_id": None}, pregenerador_certificados.despertar
+
+    # Los destinatarios van por id (solo los recién completados): el curso llega como variable
+    curso = db.query(Curso).filter(Curso.id == datos["curso_id"]).first()
+    variables_globales = {"CURSO": curso.nombre if curso else "", **(datos.get("variables_globales") or {})}
+
+    trabajo, pendiente = EmailService(db).registrar_trabajo_masivo(
+        plantilla_email_id=datos["plantilla_email_id"],
+        destinatarios_ids=estudiantes_ids,
+        plantilla_certificado_id=datos.get("plantilla_certificado_id"),
+        variables_globales=variables_globales,
+        # Sin pausas: el ritmo lo marca control_envio, como en las campañas
+        configuracion_lotes={"pausa_lotes": 0, "pausa_individual": 0},
+        modo_entrega=ModoEntrega(datos.get("modo_entrega") or ModoEntrega.ADJUNTO.value),
+        idempotency_key=f"evento-salida:{evento.id}"
+    )
+    trabajo_id, clave = trabajo.id, trabajo.clave_idempotencia
+    lanzar = pendiente and trabajo.estado == EstadoTrabajo.EN_CURSO
+
+    def al_confirmar():
+        # El trabajo y la pregeneración corren a la vez: el primero que llega a un
+        # estudiante guarda su certificado y el otro lo encuentra por su clave
+        pregenerador_certificados.despertar()
+        if lanzar:
+            lanzar_trabajo(trabajo_id, clave)
+
+    return {"prerender": solicitadas, "trabajo_id": str(trabajo_id)}, al_confirmar
+
+
+# Manejador por tipo de evento; los tipos que no están aquí no se tocan
+MANEJADORES: Dict[str, Manejador] = {
+    "CURSO_GRADUADO": manejar_curso_graduado,
+    "INSCRIPCION_COMPLETADA": manejar_inscripcion_completada,
+}
+
+
+class ConsumidorOutbox:
+    """
+    Hilo que consume eventos_salida, el outbox de cursos-service
+
+    Cada evento se toma con SELECT ... FOR UPDATE SKIP LOCKED: varios procesos pueden
+    consumir a la vez sin tomar el mismo evento ni esperarse entre sí. fecha_procesado se
+    marca antes de llamar al manejador, así se confirma junto con lo que este registre.
+    Si falla se cuenta el intento y se reintenta con espera creciente hasta OUTBOX_MAX_INTENTOS.
+    Los manejadores deben ser idempotentes: si el lock se suelta con una confirmación
+    intermedia, otro proceso puede volver a tomar el mismo evento.
+    """
+
+    def __init__(self, session_factory=SessionLocal, intervalo: float = OUTBOX_INTERVALO_SEG):
+        self.session_factory = session_factory
+        self.intervalo = intervalo
+        # evento_id -> instante (monotonic) antes del cual no se reintenta
+        self._esperas: Dict = {}
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="consumidor-outbox", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._hilo = None
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                self.procesar_pendientes()
+            except Exception as e:
+                print(f"❌ Outbox: error buscando eventos de cursos-service: {e}")
+            self._detener.wait(timeout=self.intervalo)
+
+    def procesar_pendientes(self) -> int:
+        """Procesa los eventos pendientes (cada uno a lo sumo una vez por vuelta)"""
+        ahora = time.monotonic()
+        self._esperas = {evento_id: hasta for evento_id, hasta in self._esperas.items() if hasta > ahora}
+        vistos: Set = set(self._esperas)
+        procesados = 0
+        while not self._detener.is_set():
+            evento_id = self.procesar_siguiente(vistos)
+            if evento_id is None:
+                break
+            vistos.add(evento_id)
+            procesados += 1
+        return procesados
+
+    def procesar_siguiente(self, excluir: Optional[Set] = None):
+        """Toma y procesa un evento pendiente; devuelve su id o None si no quedaba ninguno libre"""
+        db = self.session_factory()
+        try:
+            consulta = db.query(EventoSalida).filter(
+                EventoSalida.fecha_procesado.is_(None),
+                EventoSalida.tipo.in_(list(MANEJADORES)),
+                EventoSalida.intentos < OUTBOX_MAX_INTENTOS
+            )
+            if excluir:
+                consulta = consulta.filter(EventoSalida.id.notin_(excluir))
+            evento = consulta.order_by(EventoSalida.fecha_creacion).limit(1).with_for_update(
+                skip_locked=True
+            ).first()
+            if evento is None:
+                return None
+
+            evento_id, tipo, intentos = evento.id, evento.tipo, evento.intentos
+            try:
+                evento.fecha_procesado = datetime.now(timezone.utc)
+                resultado, al_confirmar = MANEJADORES[tipo](db, evento)
+                evento.resultado = resultado
+                evento.ultimo_error = None
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                db.query(EventoSalida).filter(EventoSalida.id == evento_id).update({
+                    "intentos": EventoSalida.intentos + 1,
+                    "ultimo_error": str(e)[:1000]
+                }, synchronize_session=False)
+                db.commit()
+                self._esperas[evento_id] = time.monotonic() + OUTBOX_ESPERA_SEG * 2 ** intentos
+                if intentos + 1 >= OUTBOX_MAX_INTENTOS:
+                    print(f"☠️ Outbox: el evento {tipo} {evento_id} agotó sus intentos: {e}")
+                else:
+                    print(f"❌ Outbox: el evento {tipo} {evento_id} falló, se reintentará: {e}")
+                return evento_id
+
+            print(f"📨 Outbox: evento {tipo} {evento_id} procesado: {resultado}")
+            if al_confirmar is not None:
+                al_confirmar()
+            return evento_id
+        finally:
+            db.close()
+
+
+# Instancia compartida por todo el servicio
+consumidor_outbox = ConsumidorOutbox()
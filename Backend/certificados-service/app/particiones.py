@@ -0,0 +1,185 @@
+# app/particiones.py - CERTIFICADOS SERVICE
+import os
+import re
+import gzip
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.almacenamiento import ALMACENAMIENTO_DIR
+
+# logs_email se particiona por mes; se mantienen creados los próximos meses
+LOGS_PARTICIONES_ADELANTE = int(os.getenv("LOGS_PARTICIONES_ADELANTE", "3"))
+# Meses completos que quedan en la base; los anteriores se exportan y se eliminan (0 = nunca)
+LOGS_RETENCION_MESES = int(os.getenv("LOGS_RETENCION_MESES", "12"))
+# Días tras el cierre de un mes antes de congelarlo (VACUUM FREEZE), para que terminen sus reintentos
+LOGS_CONGELAR_DIAS = int(os.getenv("LOGS_CONGELAR_DIAS", "7"))
+LOGS_MANTENIMIENTO_INTERVALO_SEG = float(os.getenv("LOGS_MANTENIMIENTO_INTERVALO_SEG", "21600"))
+# Espera máxima por el lock de logs_email al separar una partición (se reintenta en el siguiente ciclo)
+LOGS_LOCK_TIMEOUT = os.getenv("LOGS_LOCK_TIMEOUT", "5s")
+ARCHIVO_LOGS_DIR = os.path.join(ALMACENAMIENTO_DIR, "archivo-logs")
+
+PATRON_PARTICION = re.compile(r"^logs_email_(\d{4})_(\d{2})$")
+
+
+def _sumar_meses(mes: date, cantidad: int) -> date:
+    total = mes.year * 12 + mes.month - 1 + cantidad
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _mes_actual(ahora: Optional[datetime] = None) -> date:
+    ahora = (ahora or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    return date(ahora.year, ahora.month, 1)
+
+
+def crear_particiones(meses_adelante: int = LOGS_PARTICIONES_ADELANTE) -> int:
+    """Crea las particiones que falten desde el mes actual; devuelve cuántas creó"""
+    mes = _mes_actual()
+    with engine.begin() as conn:
+        return conn.execute(
+            text("SELECT logs_email_crear_particiones(:desde, :hasta)"),
+            {"desde": mes, "hasta": _sumar_meses(mes, meses_adelante)}
+        ).scalar()
+
+
+def particiones_logs() -> List[Tuple[str, date, bool]]:
+    """(nombre, mes, adjunta) de cada tabla logs_email_AAAA_MM, adjunta o ya separada"""
+    with engine.connect() as conn:
+        filas = conn.execute(text("""
+            SELECT c.relname, EXISTS (
+                SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid AND i.inhparent = 'logs_email'::regclass
+            )
+            FROM pg_class c
+            WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+              AND c.relname LIKE 'logs\\_email\\_%'
+        """)).all()
+
+    particiones = []
+    for nombre, adjunta in filas:
+        coincidencia = PATRON_PARTICION.match(nombre)
+        if coincidencia:
+            particiones.append((nombre, date(int(coincidencia[1]), int(coincidencia[2]), 1), adjunta))
+    return sorted(particiones, key=lambda p: p[1])
+
+
+def exportar_particion(nombre: str) -> str:
+    """
+    Copia una partición a ARCHIVO_LOGS_DIR/<nombre>.csv.gz (COPY en streaming, sin cargarla en memoria)
+    Escribe a un temporal y lo renombra, así un archivo con el nombre final siempre está completo
+    """
+    os.makedirs(ARCHIVO_LOGS_DIR, exist_ok=True)
+    destino = os.path.join(ARCHIVO_LOGS_DIR, f"{nombre}.csv.gz")
+    temporal = destino + ".tmp"
+
+    conexion = engine.raw_connection()
+    try:
+        with conexion.cursor() as cursor, gzip.open(temporal, "wb") as archivo:
+            cursor.copy_expert(f'COPY "{nombre}" TO STDOUT WITH (FORMAT csv, HEADER)', archivo)
+        conexion.commit()
+    finally:
+        conexion.close()
+
+    os.replace(temporal, destino)
+    return destino
+
+
+def archivar_particion(nombre: str, mes: date, adjunta: bool) -> str:
+    """
+    Separa la partición de logs_email, la exporta y la elimina junto con sus claves de idempotencia
+    Separarla no dispara los triggers de DELETE, así que las estadísticas conservan esos meses.
+    Si algo falla a mitad, el siguiente ciclo la retoma (ya separada) desde la exportación.
+    """
+    if adjunta:
+        with engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL lock_timeout = '{LOGS_LOCK_TIMEOUT}'"))
+            conn.execute(text(f'ALTER TABLE logs_email DETACH PARTITION "{nombre}"'))
+
+    destino = exportar_particion(nombre)
+
+    inicio = datetime(mes.year, mes.month, 1, tzinfo=timezone.utc)
+    fin = datetime.combine(_sumar_meses(mes, 1), datetime.min.time(), tzinfo=timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(
+            text("DELETE FROM claves_email WHERE fecha_envio >= :inicio AND fecha_envio < :fin"),
+            {"inicio": inicio, "fin": fin}
+        )
+        conn.execute(text(f'DROP TABLE "{nombre}"'))
+    return destino
+
+
+def congelar_particion(nombre: str):
+    """
+    VACUUM FREEZE de un mes cerrado: después autovacuum casi no vuelve a tocarlo
+    y el trabajo de mantenimiento se concentra en el mes en uso
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f'VACUUM (FREEZE, ANALYZE) "{nombre}"'))
+
+
+class MantenimientoLogs:
+    """
+    Hilo que mantiene las particiones de logs_email
+    - crea por adelantado las particiones de los próximos meses
+    - congela los meses cerrados hace más de LOGS_CONGELAR_DIAS
+    - exporta a .csv.gz y elimina los meses fuera de LOGS_RETENCION_MESES
+    """
+
+    def __init__(self, intervalo: float = LOGS_MANTENIMIENTO_INTERVALO_SEG):
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="mantenimiento-logs", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._hilo = None
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                self.ejecutar()
+            except Exception as e:
+                print(f"❌ Mantenimiento de logs: {e}")
+            self._detener.wait(timeout=self.intervalo)
+
+    def ejecutar(self, ahora: Optional[datetime] = None):
+        ahora = ahora or datetime.now(timezone.utc)
+        creadas = crear_particiones()
+        if creadas:
+            print(f"🗂️ {creadas} particiones nuevas de logs_email")
+
+        mes_actual = _mes_actual(ahora)
+        limite_retencion = _sumar_meses(mes_actual, -LOGS_RETENCION_MESES) if LOGS_RETENCION_MESES > 0 else None
+        congelables = self._sin_congelar()
+
+        for nombre, mes, adjunta in particiones_logs():
+            if self._detener.is_set():
+                return
+            if limite_retencion is not None and mes < limite_retencion:
+                destino = archivar_particion(nombre, mes, adjunta)
+                print(f"📦 Partición {nombre} archivada en {destino}")
+            elif adjunta and nombre in congelables and \
+                    ahora - timedelta(days=LOGS_CONGELAR_DIAS) >= datetime.combine(
+                        _sumar_meses(mes, 1), datetime.min.time(), tzinfo=timezone.utc):
+                congelar_particion(nombre)
+                print(f"🧊 Partición {nombre} congelada")
+
+    def _sin_congelar(self) -> set:
+        """Particiones a las que nunca se les corrió un VACUUM manual"""
+        with engine.connect() as conn:
+            return set(conn.execute(text(
+                "SELECT relname FROM pg_stat_user_tables WHERE relname LIKE 'logs\\_email\\_%' AND last_vacuum IS NULL"
+            )).scalars())
+
+
+# Instancia compartida por todo el servicio
+mantenimiento_logs = MantenimientoLogs()
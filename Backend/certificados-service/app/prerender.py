@@ -0,0 +1,229 @@
+# app/prerender.py - CERTIFICADOS SERVICE
+import os
+import uuid
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import cast, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert, UUID
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.log_writer import log_writer
+from app.models import (
+    CertificadoInscripcion, EstadoPrerender, Inscripcion, Curso, Usuario, Plantilla
+)
+from app.almacenamiento import clave_certificado, buscar_certificado, guardar_certificado, ruta_certificado
+from app.idempotencia import identificador_version
+
+# Inscripciones que toma cada transacción del hilo de pregeneración
+PRERENDER_LOTE = int(os.getenv("PRERENDER_LOTE", "20"))
+# Cada cuánto se revisa la cola aunque nadie avise (pedidos de otros procesos)
+PRERENDER_INTERVALO_SEG = float(os.getenv("PRERENDER_INTERVALO_SEG", "30"))
+
+
+def solicitar_prerender(db: Session, condicion, plantilla_certificado_id=None) -> int:
+    """
+    Pide la pregeneración de las inscripciones completadas que cumplen `condicion`
+    Un solo INSERT ... SELECT; una inscripción que ya estaba en la cola (o generada) vuelve a
+    PENDIENTE y suma la solicitud, así los pedidos repetidos se combinan en una fila.
+    Sin plantilla_certificado_id se usa la del curso; sin ninguna no hay nada que generar.
+    Usa la sesión del llamador, que confirma la transacción.
+    """
+    tabla = CertificadoInscripcion.__table__
+    plantilla = Curso.plantilla_id if plantilla_certificado_id is None else literal(
+        uuid.UUID(str(plantilla_certificado_id)), UUID(as_uuid=True)
+    )
+    filas = select(
+        Inscripcion.id, Inscripcion.estudiante_id, Inscripcion.curso_id, plantilla,
+        cast(literal(EstadoPrerender.PENDIENTE.value), tabla.c.estado.type), literal(1)
+    ).join(
+        Curso, Curso.id == Inscripcion.curso_id
+    ).where(
+        condicion,
+        Inscripcion.completado == True,
+        Inscripcion.is_active == True,
+        plantilla.isnot(None)
+    )
+    sentencia = insert(tabla).from_select(
+        ["inscripcion_id", "estudiante_id", "curso_id", "plantilla_certificado_id", "estado", "solicitudes"],
+        filas
+    )
+    resultado = db.execute(sentencia.on_conflict_do_update(
+        index_elements=[tabla.c.inscripcion_id],
+        set_={
+            "plantilla_certificado_id": sentencia.excluded.plantilla_certificado_id,
+            "estado": sentencia.excluded.estado,
+            "solicitudes": tabla.c.solicitudes + 1,
+            "ultimo_error": None,
+            "fecha_solicitud": func.now()
+        }
+    ))
+    return resultado.rowcount
+
+
+def solicitar_por_plantilla(db: Session, plantilla_certificado_id) -> int:
+    """
+    Vuelve a la cola los certificados de una plantilla (p. ej. después de editarla)
+    El hilo solo regenera los que cambian de clave; usa la sesión del llamador
+    """
+    resultado = db.execute(
+        update(CertificadoInscripcion.__table__).where(
+            CertificadoInscripcion.plantilla_certificado_id == plantilla_certificado_id,
+            CertificadoInscripcion.estado != EstadoPrerender.PENDIENTE
+        ).values(
+            estado=EstadoPrerender.PENDIENTE,
+            solicitudes=CertificadoInscripcion.solicitudes + 1,
+            fecha_solicitud=func.now()
+        )
+    )
+    return resultado.rowcount
+
+
+class PregeneradorCertificados:
+    """
+    Hilo que genera de antemano los certificados de las inscripciones completadas
+
+    La cola es la tabla certificados_inscripcion (sobrevive a reinicios): las filas PENDIENTE se
+    toman en lotes con FOR UPDATE SKIP LOCKED. Antes de generar se calcula la clave del
+    certificado (plantilla, versión y variables); si es la del último generado y el archivo sigue
+    en disco, o si ya hay uno igual guardado (p. ej. de un envío en modo ENLACE), no se genera.
+    Así los envíos y descargas posteriores solo leen el PDF guardado.
+    """
+
+    def __init__(self, session_factory=SessionLocal, intervalo: float = PRERENDER_INTERVALO_SEG,
+                 lote: int = PRERENDER_LOTE):
+        self.session_factory = session_factory
+        self.intervalo = intervalo
+        self.lote = lote
+        self._contadores = {"generados": 0, "reutilizados": 0, "sin_cambios": 0, "errores": 0}
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    # ==================== API PÚBLICA ====================
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="pregenerador-certificados", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._despertar.set()
+        self._hilo = None
+
+    def despertar(self):
+        """Avisa que hay pedidos nuevos (llamar después de confirmar la transacción que los creó)"""
+        self._despertar.set()
+
+    def procesar_pendientes(self) -> int:
+        """Procesa la cola por lotes hasta vaciarla; devuelve cuántas inscripciones tomó"""
+        total = 0
+        while not self._detener.is_set():
+            procesadas = self.procesar_lote()
+            total += procesadas
+            if procesadas < self.lote:
+                break
+        return total
+
+    def procesar_lote(self) -> int:
+        from app.email_service import EmailService
+
+        db = self.session_factory()
+        try:
+            filas = db.query(CertificadoInscripcion).filter(
+                CertificadoInscripcion.estado == EstadoPrerender.PENDIENTE
+            ).order_by(CertificadoInscripcion.fecha_solicitud).limit(self.lote).with_for_update(
+                skip_locked=True
+            ).all()
+            if not filas:
+                return 0
+
+            # Estudiantes, cursos y plantillas de todo el lote en una consulta por tabla
+            usuarios = {u.id: u for u in db.query(Usuario).filter(
+                Usuario.id.in_({fila.estudiante_id for fila in filas})
+            )}
+            cursos = {c.id: c for c in db.query(Curso).filter(
+                Curso.id.in_({fila.curso_id for fila in filas})
+            )}
+            plantillas = {p.id: p for p in db.query(Plantilla).filter(
+                Plantilla.id.in_({fila.plantilla_certificado_id for fila in filas})
+            )}
+
+            servicio = EmailService(db)
+            for fila in filas:
+                try:
+                    resultado = self._generar(
+                        servicio, fila, usuarios.get(fila.estudiante_id),
+                        cursos.get(fila.curso_id), plantillas.get(fila.plantilla_certificado_id)
+                    )
+                except Exception as e:
+                    fila.estado = EstadoPrerender.ERROR
+                    fila.ultimo_error = str(e)[:1000]
+                    resultado = "errores"
+                    print(f"❌ Pregeneración: inscripción {fila.inscripcion_id}: {e}")
+                with self._lock:
+                    self._contadores[resultado] += 1
+
+            # Los registros de certificados_generados van por el log_writer: quedan escritos antes de confirmar
+            log_writer.flush()
+            db.commit()
+            return len(filas)
+        finally:
+            db.close()
+
+    def metricas(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._contadores)
+
+    # ==================== INTERNOS ====================
+
+    def _generar(self, servicio, fila: CertificadoInscripcion, usuario: Optional[Usuario],
+                 curso: Optional[Curso], plantilla: Optional[Plantilla]) -> str:
+        """Deja la fila LISTO; devuelve qué hizo (generados, reutilizados o sin_cambios)"""
+        from app.email_service import variables_destinatario
+
+        if usuario is None:
+            raise ValueError("Estudiante no encontrado")
+        if plantilla is None:
+            raise ValueError("Plantilla de certificado no encontrada")
+
+        variables = variables_destinatario(usuario, curso.nombre if curso else None)
+        clave = clave_certificado(plantilla, variables)
+        if fila.clave == clave and fila.certificado_id and os.path.exists(ruta_certificado(fila.certificado_id)):
+            # Misma versión de plantilla y mismos datos: el PDF guardado sigue valiendo
+            resultado = "sin_cambios"
+        else:
+            certificado = buscar_certificado(servicio.db, plantilla, variables)
+            if certificado:
+                resultado = "reutilizados"
+            else:
+                pdf_bytes = servicio.generar_pdf_certificado(plantilla, variables)
+                certificado = guardar_certificado(plantilla, variables, pdf_bytes, usuario.email)
+                resultado = "generados"
+            fila.certificado_id = certificado["id"]
+            fila.clave = clave
+            fila.fecha_generado = datetime.now(timezone.utc)
+
+        fila.version_plantilla = identificador_version(plantilla)
+        fila.estado = EstadoPrerender.LISTO
+        fila.ultimo_error = None
+        return resultado
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                self.procesar_pendientes()
+            except Exception as e:
+                print(f"❌ Pregeneración: error procesando la cola de certificados: {e}")
+            self._despertar.wait(timeout=self.intervalo)
+            self._despertar.clear()
+
+
+# Instancia compartida por todo el servicio
+pregenerador_certificados = PregeneradorCertificados()
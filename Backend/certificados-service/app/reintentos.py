@@ -0,0 +1,255 @@
+# app/reintentos.py - CERTIFICADOS SERVICE
+import os
+import json
+import uuid
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from app.database import SessionLocal
+from app.log_writer import log_writer
+from app.control_envio import control_envio, Prioridad
+from app.models import LogEmail, EstadoEmail, ReintentoEmail, EstadoReintento
+
+# Política de reintentos
+EMAIL_REINTENTOS_MAX = int(os.getenv("EMAIL_REINTENTOS_MAX", "5"))
+EMAIL_REINTENTO_BASE_SEG = float(os.getenv("EMAIL_REINTENTO_BASE_SEG", "30"))
+EMAIL_REINTENTO_MAX_SEG = float(os.getenv("EMAIL_REINTENTO_MAX_SEG", "3600"))
+EMAIL_REINTENTO_INTERVALO_SEG = float(os.getenv("EMAIL_REINTENTO_INTERVALO_SEG", "10"))
+EMAIL_REINTENTO_LOTE = int(os.getenv("EMAIL_REINTENTO_LOTE", "20"))
+
+
+def calcular_backoff(intento: Optional[int], retry_after: Optional[float] = None) -> float:
+    """
+    Espera antes del siguiente intento: exponencial con jitter
+    base * 2^(intento-1), acotado a EMAIL_REINTENTO_MAX_SEG y elegido al azar
+    entre la mitad y el total para no sincronizar reintentos.
+    Si el proveedor indicó Retry-After se respeta como mínimo.
+    """
+    intento = max(intento or 1, 1)
+    espera = min(EMAIL_REINTENTO_MAX_SEG, EMAIL_REINTENTO_BASE_SEG * (2 ** (intento - 1)))
+    espera = random.uniform(espera / 2, espera)
+    if retry_after:
+        espera = max(espera, retry_after)
+    return espera
+
+
+def programar_reintento(log_data: Dict, contenido_html: str, envio_data, resultado) -> EstadoEmail:
+    """
+    Registra un correo fallido en la cola de reintentos
+    Los fallos transitorios quedan PROGRAMADOS; el resto va directo a dead-letter.
+    Sin resultado (excepción antes de hablar con el proveedor) se reintenta con el backoff normal.
+    Devuelve el estado que debe tener el log.
+    """
+    intentos = log_data.get("intentos") or 1
+    reintentable = (resultado is None or resultado.reintentable) and intentos < EMAIL_REINTENTOS_MAX
+    retry_after = resultado.retry_after if resultado is not None else None
+
+    ahora = datetime.now(timezone.utc)
+    log_writer.registrar(ReintentoEmail, {
+        "id": uuid.uuid4(),
+        "log_email_id": log_data["id"],
+        "trabajo_id": log_data.get("trabajo_id"),
+        "destinatario_email": envio_data.destinatario_email,
+        "destinatario_nombre": envio_data.destinatario_nombre,
+        "asunto": envio_data.asunto,
+        "contenido_html": contenido_html,
+        "plantilla_certificado_id": envio_data.plantilla_certificado_id,
+        "variables": json.dumps(envio_data.variables) if envio_data.variables else None,
+        "modo_entrega": envio_data.modo_entrega,
+        "estado": EstadoReintento.PROGRAMADO if reintentable else EstadoReintento.DESCARTADO,
+        "intentos": intentos,
+        "proximo_intento": ahora + timedelta(seconds=calcular_backoff(intentos, retry_after))
+        if reintentable else None,
+        "ultimo_error": log_data.get("mensaje_error"),
+        "fecha_creacion": ahora,
+        "fecha_actualizacion": ahora
+    })
+    programador_reintentos.despertar()
+
+    return EstadoEmail.ERROR if reintentable else EstadoEmail.DESCARTADO
+
+
+def reintentar_fallidos_trabajo(db, trabajo_id) -> int:
+    """
+    Vuelve a programar, para ya, los correos fallidos de un trabajo
+    Solo toca a los destinatarios fallidos; cada pedido manual concede al menos un intento más.
+    Sus logs vuelven a PENDIENTE hasta que el reintento los resuelva.
+    """
+    # Lo que aún esté en el buffer tiene que estar en la BD antes del UPDATE
+    log_writer.flush()
+
+    filtro = (
+        ReintentoEmail.trabajo_id == trabajo_id,
+        ReintentoEmail.estado.in_([EstadoReintento.DESCARTADO, EstadoReintento.PROGRAMADO])
+    )
+    logs_ids = db.query(ReintentoEmail.log_email_id).filter(*filtro).scalar_subquery()
+    db.query(LogEmail).filter(
+        LogEmail.id.in_(logs_ids),
+        LogEmail.estado.in_([EstadoEmail.ERROR, EstadoEmail.DESCARTADO])
+    ).update({"estado": EstadoEmail.PENDIENTE}, synchronize_session=False)
+    actualizados = db.query(ReintentoEmail).filter(*filtro).update({
+        "estado": EstadoReintento.PROGRAMADO,
+        "proximo_intento": datetime.now(timezone.utc)
+    }, synchronize_session=False)
+    db.commit()
+
+    programador_reintentos.despertar()
+    return actualizados
+
+
+class ProgramadorReintentos:
+    """
+    Hilo que procesa la cola de reintentos
+    Toma los reintentos vencidos con FOR UPDATE SKIP LOCKED, los marca EN_PROCESO
+    y reenvía solo ese correo, sin volver a renderizar la plantilla.
+    """
+
+    def __init__(self, session_factory=SessionLocal, intervalo: float = EMAIL_REINTENTO_INTERVALO_SEG,
+                 lote: int = EMAIL_REINTENTO_LOTE):
+        self.session_factory = session_factory
+        self.intervalo = intervalo
+        self.lote = lote
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self):
+        """Arranca el hilo; los reintentos que quedaron EN_PROCESO vuelven a la cola"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+
+        db = self.session_factory()
+        try:
+            db.query(ReintentoEmail).filter(
+                ReintentoEmail.estado == EstadoReintento.EN_PROCESO
+            ).update({"estado": EstadoReintento.PROGRAMADO}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="reintentos-email", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=60)
+        self._hilo = None
+
+    def despertar(self):
+        self._despertar.set()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                procesados = self.procesar_pendientes()
+            except Exception as e:
+                print(f"❌ Reintentos: error procesando la cola: {e}")
+                procesados = 0
+
+            if procesados == 0:
+                self._despertar.wait(timeout=self.intervalo)
+                self._despertar.clear()
+
+    def procesar_pendientes(self) -> int:
+        """Procesa un lote de reintentos vencidos y devuelve cuántos tomó"""
+        # Con el circuito abierto no se toma nada: gastaría intentos contra un proveedor caído
+        if not control_envio.disponible():
+            return 0
+
+        db = self.session_factory()
+        try:
+            pendientes = db.query(ReintentoEmail).filter(
+                ReintentoEmail.estado == EstadoReintento.PROGRAMADO,
+                ReintentoEmail.proximo_intento <= datetime.now(timezone.utc)
+            ).order_by(ReintentoEmail.proximo_intento).limit(self.lote).with_for_update(skip_locked=True).all()
+
+            for reintento in pendientes:
+                reintento.estado = EstadoReintento.EN_PROCESO
+            db.commit()
+
+            for reintento in pendientes:
+                if self._detener.is_set():
+                    reintento.estado = EstadoReintento.PROGRAMADO
+                    db.commit()
+                    continue
+                self._procesar(db, reintento)
+                db.commit()
+
+            return len(pendientes)
+        finally:
+            db.close()
+
+    def _procesar(self, db, reintento: ReintentoEmail):
+        """Reenvía un correo y decide si queda completado, reprogramado o en dead-letter"""
+        from app.email_service import EmailService, ResultadoEnvio, METRICAS_ENTREGA
+        from app.supresiones import indice_supresiones
+
+        # La dirección pudo rebotar (o agregarse a mano) mientras el correo esperaba su turno
+        indice_supresiones.refrescar()
+        if indice_supresiones.contiene(reintento.destinatario_email):
+            print(f"🚫 Reintento descartado: {reintento.destinatario_email} está en la lista de supresión")
+            reintento.estado = EstadoReintento.DESCARTADO
+            reintento.proximo_intento = None
+            reintento.ultimo_error = "Destinatario en la lista de supresión"
+            log_writer.actualizar(
+                LogEmail, reintento.log_email_id,
+                estado=EstadoEmail.DESCARTADO, mensaje_error=reintento.ultimo_error
+            )
+            return
+
+        intento = (reintento.intentos or 1) + 1
+        print(f"🔁 Reintento {intento} para {reintento.destinatario_email}")
+
+        metricas = {}
+        try:
+            resultado, entrega = EmailService(db).entregar_email(
+                destinatario_email=reintento.destinatario_email,
+                asunto=reintento.asunto,
+                contenido_html=reintento.contenido_html,
+                plantilla_certificado_id=reintento.plantilla_certificado_id,
+                variables=json.loads(reintento.variables) if reintento.variables else None,
+                modo_entrega=reintento.modo_entrega,
+                prioridad=Prioridad.REINTENTO
+            )
+            # El log queda con las métricas del último intento
+            metricas = {metrica: entrega[metrica] for metrica in METRICAS_ENTREGA}
+        except Exception as e:
+            # Igual que en el primer envío: un error interno se reintenta con el backoff normal
+            resultado = ResultadoEnvio(False, f"Error interno: {str(e)}", reintentable=True)
+
+        reintento.intentos = intento
+        reintento.ultimo_error = None if resultado.exito else resultado.mensaje
+
+        if resultado.exito:
+            reintento.estado = EstadoReintento.COMPLETADO
+            reintento.proximo_intento = None
+            log_writer.actualizar(
+                LogEmail, reintento.log_email_id,
+                estado=EstadoEmail.ENVIADO, fecha_entrega=datetime.utcnow(),
+                mensaje_error=None, intentos=intento, proveedor_message_id=resultado.message_id, **metricas
+            )
+        elif resultado.reintentable and intento < EMAIL_REINTENTOS_MAX:
+            reintento.estado = EstadoReintento.PROGRAMADO
+            reintento.proximo_intento = datetime.now(timezone.utc) + timedelta(
+                seconds=calcular_backoff(intento, resultado.retry_after)
+            )
+            log_writer.actualizar(
+                LogEmail, reintento.log_email_id,
+                estado=EstadoEmail.ERROR, mensaje_error=resultado.mensaje, intentos=intento, **metricas
+            )
+        else:
+            reintento.estado = EstadoReintento.DESCARTADO
+            reintento.proximo_intento = None
+            log_writer.actualizar(
+                LogEmail, reintento.log_email_id,
+                estado=EstadoEmail.DESCARTADO, mensaje_error=resultado.mensaje, intentos=intento, **metricas
+            )
+
+
+# Instancia compartida por todo el servicio
+programador_reintentos = ProgramadorReintentos()
@@ -1,23 +1,37 @@
 # app/routes.py - CERTIFICADOS SERVICE
 import os
+import re
 import uuid
 import json
-from typing import List, Dict
-from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File
-from sqlalchemy.orm import Session
+import hashlib
+import asyncio
+from datetime import datetime
+from typing import List, Dict, Optional
+from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Request, Header
+from fastapi.responses import Response, StreamingResponse, FileResponse
+from sqlalchemy.orm import Session, defer
 from sqlalchemy.exc import IntegrityError
 
-from app.database import get_db
-from app.models import Plantilla, PlantillaEmail
+from app.database import get_db, SessionLocal
+from app.models import Plantilla, PlantillaEmail, CertificadoInscripcion, CertificadoGenerado, EstadoPrerender
 from app.schemas import (
     PlantillaCreate, PlantillaUpdate, PlantillaResponse,
-    PlantillaEmailCreate, PlantillaEmailUpdate, PlantillaEmailResponse,
-    EnvioEmailIndividual, EnvioMasivoRequest, EnvioMasivoResponse,
-    EstadisticasEmail, LogEmailResponse,
+    PlantillaEmailCreate, PlantillaEmailUpdate, PlantillaEmailResponse, PlantillaEmailResumen,
+    EnvioEmailIndividual, EnvioMasivoRequest, EnvioMasivoResponse, CampanaEnvioRequest,
+    EstadisticasEmail, SeriesEmailResponse, LogEmailResponse, TrabajoEnvioResponse,
+    SupresionEmailCreate, SupresionEmailResponse, CertificadoInscripcionResponse,
     extraer_variables_plantilla
 )
-from app.dependencies import require_auth
+from app.dependencies import require_auth, require_auth_stream
+from app.auth import verify_token
+from app.almacenamiento import (
+    ruta_certificado, parsear_rango, leer_archivo, ruta_recurso_email, TIPOS_RECURSO, enlace_descarga
+)
 from app.email_service import EmailService
+from app.template_engine import compilar_plantilla_email, invalidar_plantilla
+from app.idempotencia import identificador_version
+from app.html_email import preprocesar_html
+from app.prerender import solicitar_por_plantilla, pregenerador_certificados
 
 router = APIRouter()
 
@@ -176,8 +190,11 @@ def update_template(
     if data.is_active is not None:
         plantilla.is_active = data.is_active
 
+    # Los certificados pregenerados con esta plantilla vuelven a la cola (solo cambian si cambió su clave)
+    solicitar_por_plantilla(db, plantilla.id)
     db.commit()
     db.refresh(plantilla)
+    pregenerador_certificados.despertar()
     
     return PlantillaResponse(
         id=plantilla.id,
@@ -209,7 +226,18 @@ def delete_template(
 
 # ===================== PLANTILLAS DE EMAIL =====================
 
-@router.get("/plantillas-email", response_model=List[PlantillaEmailResponse])
+def _plantilla_email_respuesta(plantilla: PlantillaEmail, compilada=None) -> PlantillaEmailResponse:
+    """Respuesta con las variables ya guardadas (se extraen al crear o editar, no en cada lectura)"""
+    respuesta = PlantillaEmailResponse.model_validate(plantilla)
+    if compilada is not None:
+        respuesta.variables_desconocidas = compilada.variables_desconocidas()
+    return respuesta
+
+def _etag_plantilla_email(plantilla: PlantillaEmail) -> str:
+    """Cambia con cada edición: fecha_actualizacion se renueva en cada UPDATE"""
+    return f'"{hashlib.sha256(identificador_version(plantilla).encode()).hexdigest()[:32]}"'
+
+@router.get("/plantillas-email", response_model=List[PlantillaEmailResumen])
 def get_plantillas_email(
     skip: int = 0,
     limit: int = 100,
@@ -217,35 +245,16 @@ def get_plantillas_email(
     db: Session = Depends(get_db),
     user_info: dict = Depends(require_auth)
 ):
-    """Listar plantillas de email"""
+    """Listar plantillas de email (sin el HTML: se pide con GET /plantillas-email/{id})"""
     
-    query = db.query(PlantillaEmail)
+    query = db.query(PlantillaEmail).options(
+        defer(PlantillaEmail.contenido_html), defer(PlantillaEmail.contenido_html_procesado)
+    )
     
     if activas is not None:
         query = query.filter(PlantillaEmail.is_active == activas)
     
-    plantillas = query.order_by(PlantillaEmail.fecha_creacion.desc()).offset(skip).limit(limit).all()
-    
-    result = []
-    for plantilla in plantillas:
-        # Extraer variables del contenido HTML
-        variables = extraer_variables_plantilla(plantilla.contenido_html) if plantilla.contenido_html else []
-        
-        # Crear el diccionario manualmente para evitar problemas con from_orm
-        plantilla_dict = {
-            "id": plantilla.id,
-            "nombre": plantilla.nombre,
-            "descripcion": plantilla.descripcion,
-            "asunto": plantilla.asunto,
-            "contenido_html": plantilla.contenido_html,
-            "variables_disponibles": variables,
-            "is_active": plantilla.is_active,
-            "fecha_creacion": plantilla.fecha_creacion,
-            "fecha_actualizacion": plantilla.fecha_actualizacion
-        }
-        result.append(plantilla_dict)
-    
-    return result
+    return query.order_by(PlantillaEmail.fecha_creacion.desc()).offset(skip).limit(limit).all()
 
 @router.post("/plantillas-email", response_model=PlantillaEmailResponse, status_code=status.HTTP_201_CREATED)
 def create_plantilla_email(
@@ -264,6 +273,8 @@ def create_plantilla_email(
             descripcion=plantilla.descripcion,
             asunto=plantilla.asunto,
             contenido_html=plantilla.contenido_html,
+            # Lo que se envía: CSS en línea, minificado, imágenes base64 extraídas
+            contenido_html_procesado=preprocesar_html(plantilla.contenido_html),
             is_active=plantilla.is_active,
             variables_disponibles=json.dumps(variables) if variables else None
         )
@@ -272,20 +283,10 @@ def create_plantilla_email(
         db.commit()
         db.refresh(db_plantilla)
         
-        # Preparar respuesta
-        plantilla_response = {
-            "id": db_plantilla.id,
-            "nombre": db_plantilla.nombre,
-            "descripcion": db_plantilla.descripcion,
-            "asunto": db_plantilla.asunto,
-            "contenido_html": db_plantilla.contenido_html,
-            "variables_disponibles": variables,
-            "is_active": db_plantilla.is_active,
-            "fecha_creacion": db_plantilla.fecha_creacion,
-            "fecha_actualizacion": db_plantilla.fecha_actualizacion
-        }
+        # Compilar la plantilla una sola vez al guardarla
+        compilada = compilar_plantilla_email(db_plantilla)
         
-        return plantilla_response
+        return _plantilla_email_respuesta(db_plantilla, compilada)
         
     except IntegrityError:
         db.rollback()
@@ -294,32 +295,35 @@ def create_plantilla_email(
 @router.get("/plantillas-email/{plantilla_id}", response_model=PlantillaEmailResponse)
 def get_plantilla_email(
     plantilla_id: str,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     user_info: dict = Depends(require_auth)
 ):
-    """Obtener plantilla de email por ID"""
+    """
+    Obtener plantilla de email por ID, con su HTML
+    Responde con ETag; con If-None-Match vigente devuelve 304 sin leer el HTML
+    """
     
-    plantilla = db.query(PlantillaEmail).filter(PlantillaEmail.id == plantilla_id).first()
+    plantilla = db.query(PlantillaEmail).options(
+        defer(PlantillaEmail.contenido_html), defer(PlantillaEmail.contenido_html_procesado)
+    ).filter(PlantillaEmail.id == plantilla_id).first()
     if not plantilla:
         raise HTTPException(status_code=404, detail="Plantilla de email no encontrada")
     
-    # Extraer variables del contenido HTML
-    variables = extraer_variables_plantilla(plantilla.contenido_html) if plantilla.contenido_html else []
-    
-    # Crear el diccionario manualmente para evitar problemas con from_orm
-    plantilla_response = {
-        "id": plantilla.id,
-        "nombre": plantilla.nombre,
-        "descripcion": plantilla.descripcion,
-        "asunto": plantilla.asunto,
-        "contenido_html": plantilla.contenido_html,
-        "variables_disponibles": variables,
-        "is_active": plantilla.is_active,
-        "fecha_creacion": plantilla.fecha_creacion,
-        "fecha_actualizacion": plantilla.fecha_actualizacion
-    }
+    etag = _etag_plantilla_email(plantilla)
+    # private, no-cache: el navegador la guarda pero revalida en cada uso (puede editarse)
+    cabeceras = {"ETag": etag, "Cache-Control": "private, no-cache"}
     
-    return plantilla_response
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [
+        e.strip().removeprefix("W/") for e in if_none_match.split(",")
+    ]):
+        return Response(status_code=304, headers=cabeceras)
+    
+    response.headers.update(cabeceras)
+    # Acceder a contenido_html lo carga (estaba diferido)
+    return _plantilla_email_respuesta(plantilla)
 
 @router.put("/plantillas-email/{plantilla_id}", response_model=PlantillaEmailResponse)
 def update_plantilla_email(
@@ -336,39 +340,23 @@ def update_plantilla_email(
     
     update_data = plantilla_update.dict(exclude_unset=True)
     
-    # Si se actualiza el contenido, extraer nuevas variables
-    if "contenido_html" in update_data:
-        variables = extraer_variables_plantilla(update_data["contenido_html"])
-        update_data["variables_disponibles"] = json.dumps(variables) if variables else None
-    
     # Actualizar campos
     for field, value in update_data.items():
-        if field != "variables_disponibles":  # Este lo manejamos especialmente
-            setattr(plantilla, field, value)
+        setattr(plantilla, field, value)
     
-    # Manejar variables_disponibles
+    # Si se actualiza el contenido, se guardan sus variables (las lecturas no vuelven a extraerlas)
     if "contenido_html" in update_data:
         variables = extraer_variables_plantilla(update_data["contenido_html"])
         plantilla.variables_disponibles = json.dumps(variables) if variables else None
+        plantilla.contenido_html_procesado = preprocesar_html(update_data["contenido_html"])
     
     db.commit()
     db.refresh(plantilla)
     
-    # Preparar respuesta
-    variables = extraer_variables_plantilla(plantilla.contenido_html) if plantilla.contenido_html else []
-    plantilla_response = {
-        "id": plantilla.id,
-        "nombre": plantilla.nombre,
-        "descripcion": plantilla.descripcion,
-        "asunto": plantilla.asunto,
-        "contenido_html": plantilla.contenido_html,
-        "variables_disponibles": variables,
-        "is_active": plantilla.is_active,
-        "fecha_creacion": plantilla.fecha_creacion,
-        "fecha_actualizacion": plantilla.fecha_actualizacion
-    }
+    # Recompilar con la nueva versión
+    compilada = compilar_plantilla_email(plantilla)
     
-    return plantilla_response
+    return _plantilla_email_respuesta(plantilla, compilada)
 
 @router.delete("/plantillas-email/{plantilla_id}")
 def delete_plantilla_email(
@@ -384,6 +372,7 @@ def delete_plantilla_email(
     
     db.delete(plantilla)
     db.commit()
+    invalidar_plantilla(plantilla_id)
     
     return {"message": "Plantilla de email eliminada correctamente"}
 
@@ -392,14 +381,15 @@ def delete_plantilla_email(
 @router.post("/enviar-individual", response_model=LogEmailResponse)
 def enviar_email_individual(
     envio_data: EnvioEmailIndividual,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db),
     user_info: dict = Depends(require_auth)
 ):
-    """Enviar email individual"""
+    """Enviar email individual (un pedido repetido devuelve el log existente)"""
     
     email_service = EmailService(db)
     try:
-        resultado = email_service.enviar_email_individual(envio_data)
+        resultado = email_service.enviar_email_idempotente(envio_data, idempotency_key)
         return resultado
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error enviando email: {str(e)}")
@@ -407,39 +397,260 @@ def enviar_email_individual(
 @router.post("/enviar-masivo", response_model=EnvioMasivoResponse)
 def enviar_email_masivo(
     envio_data: EnvioMasivoRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db),
     user_info: dict = Depends(require_auth)
 ):
-    """Enviar emails masivos por lotes"""
+    """Enviar emails masivos por lotes (un pedido repetido devuelve el resultado existente)"""
+    
+    if envio_data.programado:
+        raise HTTPException(status_code=400, detail="Los envíos programados se crean con POST /trabajos-envio")
     
     email_service = EmailService(db)
     
     try:
-        # Validar que se proporcione curso_id o destinatarios_ids
-        if not envio_data.curso_id and not envio_data.destinatarios_ids:
-            raise HTTPException(status_code=400, detail="Debe proporcionar curso_id o destinatarios_ids")
-        
-        # Si se proporciona curso_id, obtener destinatarios del curso
-        destinatarios_ids = envio_data.destinatarios_ids
-        if envio_data.curso_id:
-            # Aquí necesitarías hacer una consulta a la base de datos para obtener
-            # los estudiantes inscritos en el curso. Por ahora usamos los IDs proporcionados
-            if not destinatarios_ids:
-                raise HTTPException(status_code=400, detail="Para envío por curso, debe proporcionar destinatarios_ids")
-        
-        resultado = email_service.enviar_email_masivo_lotes(
-            plantilla_email_id=str(envio_data.plantilla_email_id),
-            destinatarios_ids=[str(id) for id in destinatarios_ids],
-            plantilla_certificado_id=str(envio_data.plantilla_certificado_id) if envio_data.plantilla_certificado_id else None,
-            variables_globales=envio_data.variables_globales,
-            configuracion_lotes=envio_data.configuracion_lotes
-        )
+        # Los estudiantes de los cursos se resuelven en el servidor
+        resultado = email_service.enviar_email_masivo_lotes(**_parametros_envio_masivo(envio_data, idempotency_key))
         
         return EnvioMasivoResponse(**resultado)
         
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error enviando emails masivos: {str(e)}")
 
+def _parametros_envio_masivo(envio_data: EnvioMasivoRequest, idempotency_key: Optional[str]) -> Dict:
+    """Parámetros de EmailService para un envío masivo; curso_id se suma a cursos_ids"""
+    cursos_ids = list(envio_data.cursos_ids or [])
+    if envio_data.curso_id:
+        cursos_ids.append(envio_data.curso_id)
+    
+    # Validar que se proporcione algún curso o destinatarios_ids
+    if not cursos_ids and not envio_data.destinatarios_ids:
+        raise HTTPException(status_code=400, detail="Debe proporcionar curso_id, cursos_ids o destinatarios_ids")
+    
+    return {
+        "plantilla_email_id": str(envio_data.plantilla_email_id),
+        "destinatarios_ids": [str(id) for id in envio_data.destinatarios_ids or []],
+        "plantilla_certificado_id": str(envio_data.plantilla_certificado_id) if envio_data.plantilla_certificado_id else None,
+        "variables_globales": envio_data.variables_globales,
+        "configuracion_lotes": envio_data.configuracion_lotes,
+        "cursos_ids": [str(id) for id in cursos_ids],
+        "modo_entrega": envio_data.modo_entrega,
+        "idempotency_key": idempotency_key
+    }
+
+# ===================== TRABAJOS DE ENVÍO =====================
+
+@router.post("/trabajos-envio", response_model=TrabajoEnvioResponse, status_code=status.HTTP_202_ACCEPTED)
+def crear_trabajo_envio(
+    envio_data: EnvioMasivoRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """
+    Iniciar un envío masivo en segundo plano; el progreso se sigue en /trabajos-envio/{id}/eventos
+    Con no_antes_de o ventana_inicio/ventana_fin queda PROGRAMADO y arranca solo cuando corresponda
+    """
+    
+    from app.models import EstadoTrabajo
+    from app.trabajos import lanzar_trabajo
+    
+    email_service = EmailService(db)
+    try:
+        trabajo, pendiente = email_service.registrar_trabajo_masivo(
+            **_parametros_envio_masivo(envio_data, idempotency_key),
+            no_antes_de=envio_data.no_antes_de,
+            ventana_inicio=envio_data.ventana_inicio,
+            ventana_fin=envio_data.ventana_fin
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error creando el envío masivo: {str(e)}")
+    
+    if pendiente and trabajo.estado == EstadoTrabajo.EN_CURSO:
+        lanzar_trabajo(trabajo.id, trabajo.clave_idempotencia)
+    
+    return TrabajoEnvioResponse.from_orm(trabajo)
+
+@router.post("/campanas-envio", response_model=TrabajoEnvioResponse, status_code=status.HTTP_202_ACCEPTED)
+def crear_campana_envio(
+    campana_data: CampanaEnvioRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """
+    Campaña de varios cursos, cada uno con sus plantillas, en un solo trabajo de envío
+    Cada estudiante recibe un correo (el del primer grupo en que está inscrito); el trabajo
+    se sigue igual que los demás en /trabajos-envio/{id} y /trabajos-envio/{id}/eventos
+    """
+    
+    from app.models import EstadoTrabajo
+    from app.trabajos import lanzar_trabajo
+    
+    email_service = EmailService(db)
+    try:
+        trabajo, pendiente = email_service.registrar_campana(
+            grupos=[
+                {
+                    "curso_id": str(grupo.curso_id),
+                    "plantilla_email_id": str(grupo.plantilla_email_id),
+                    "plantilla_certificado_id": str(grupo.plantilla_certificado_id) if grupo.plantilla_certificado_id else None,
+                    "variables_globales": grupo.variables_globales
+                }
+                for grupo in campana_data.grupos
+            ],
+            configuracion_lotes=campana_data.configuracion_lotes,
+            modo_entrega=campana_data.modo_entrega,
+            idempotency_key=idempotency_key,
+            no_antes_de=campana_data.no_antes_de,
+            ventana_inicio=campana_data.ventana_inicio,
+            ventana_fin=campana_data.ventana_fin
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error creando la campaña: {str(e)}")
+    
+    if pendiente and trabajo.estado == EstadoTrabajo.EN_CURSO:
+        lanzar_trabajo(trabajo.id, trabajo.clave_idempotencia)
+    
+    return TrabajoEnvioResponse.from_orm(trabajo)
+
+@router.get("/trabajos-envio/{trabajo_id}", response_model=TrabajoEnvioResponse)
+def obtener_trabajo_envio(
+    trabajo_id: str,
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """Estado de un trabajo de envío (contadores hasta el último checkpoint)"""
+    
+    from app.models import TrabajoEnvio
+    
+    try:
+        trabajo_uuid = uuid.UUID(trabajo_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ID de trabajo inválido")
+    
+    trabajo = db.query(TrabajoEnvio).filter(TrabajoEnvio.id == trabajo_uuid).first()
+    if not trabajo:
+        raise HTTPException(status_code=404, detail="Trabajo de envío no encontrado")
+    
+    return TrabajoEnvioResponse.from_orm(trabajo)
+
+@router.get("/trabajos-envio/{trabajo_id}/eventos")
+def eventos_trabajo_envio(
+    trabajo_id: str,
+    request: Request,
+    user_info: dict = Depends(require_auth_stream)
+):
+    """
+    Progreso en vivo de un trabajo (Server-Sent Events)
+    Eventos: estado, inicio, destinatario, pausado, interrumpido, error_trabajo, fin.
+    Un trabajo programado o pausado mantiene el stream abierto hasta que termine.
+    Con Last-Event-ID se reenvían los eventos posteriores que sigan en memoria.
+    """
+    
+    from app.models import TrabajoEnvio, EstadoTrabajo
+    from app.eventos import bus_eventos, parsear_last_event_id
+    
+    try:
+        trabajo_uuid = uuid.UUID(trabajo_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ID de trabajo inválido")
+    
+    # Única lectura de la BD: la foto inicial; lo demás llega por el bus de eventos.
+    # Sesión propia y cerrada antes de responder: con Depends(get_db) la conexión quedaría
+    # tomada del pool mientras el stream siga abierto
+    db = SessionLocal()
+    try:
+        trabajo = db.query(TrabajoEnvio).filter(TrabajoEnvio.id == trabajo_uuid).first()
+        if not trabajo:
+            raise HTTPException(status_code=404, detail="Trabajo de envío no encontrado")
+        
+        estado_inicial = json.loads(TrabajoEnvioResponse.from_orm(trabajo).json())
+        terminado = trabajo.estado in (EstadoTrabajo.COMPLETADO, EstadoTrabajo.ERROR)
+    finally:
+        db.close()
+    desde = parsear_last_event_id(request.headers.get("last-event-id"))
+    
+    async def generar():
+        cola, previos = bus_eventos.suscribir(trabajo_uuid, desde)
+        try:
+            yield f"event: estado\ndata: {json.dumps(estado_inicial)}\n\n"
+            for evento in previos:
+                yield evento.formato_sse()
+                if evento.tipo in ("fin", "error_trabajo"):
+                    return
+            if terminado:
+                return
+            
+            while not await request.is_disconnected():
+                try:
+                    evento = await asyncio.wait_for(cola.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comentario SSE: mantiene viva la conexión a través de proxies
+                    yield ": ping\n\n"
+                    continue
+                yield evento.formato_sse()
+                if evento.tipo in ("fin", "error_trabajo"):
+                    return
+        finally:
+            bus_eventos.desuscribir(trabajo_uuid, cola)
+    
+    return StreamingResponse(
+        generar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/trabajos-envio/{trabajo_id}/reintentar-fallidos")
+def reintentar_fallidos_trabajo(
+    trabajo_id: str,
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """Volver a encolar solo los destinatarios fallidos de un envío masivo"""
+    
+    from app.models import TrabajoEnvio
+    from app.reintentos import reintentar_fallidos_trabajo as reprogramar
+    
+    try:
+        trabajo_uuid = uuid.UUID(trabajo_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ID de trabajo inválido")
+    
+    trabajo = db.query(TrabajoEnvio).filter(TrabajoEnvio.id == trabajo_uuid).first()
+    if not trabajo:
+        raise HTTPException(status_code=404, detail="Trabajo de envío no encontrado")
+    
+    reprogramados = reprogramar(db, trabajo_uuid)
+    
+    return {
+        "trabajo_id": str(trabajo_uuid),
+        "reprogramados": reprogramados,
+        "message": f"{reprogramados} correos reprogramados para reintento"
+    }
+
+@router.get("/metricas-envio")
+def obtener_metricas_envio(
+    user_info: dict = Depends(require_auth)
+):
+    """
+    Tasa de envío actual, concurrencia y estado del circuit breaker del proveedor,
+    más el buffer de eventos de entrega del webhook, el índice de la lista de supresión
+    y los contadores de la pregeneración de certificados
+    """
+    
+    from app.control_envio import control_envio
+    from app.webhooks import buffer_eventos_entrega
+    from app.supresiones import indice_supresiones
+    return {
+        **control_envio.metricas(),
+        "eventos_entrega": buffer_eventos_entrega.metricas(),
+        "supresiones": indice_supresiones.metricas(),
+        "pregeneracion": pregenerador_certificados.metricas()
+    }
+
 @router.get("/estadisticas-email", response_model=EstadisticasEmail)
 def obtener_estadisticas_email(
     db: Session = Depends(get_db),
@@ -454,30 +665,302 @@ def obtener_estadisticas_email(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error obteniendo estadísticas: {str(e)}")
 
+@router.get("/estadisticas-email/series", response_model=SeriesEmailResponse)
+def obtener_series_email(
+    granularidad: str = "hora",
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    por: Optional[str] = None,
+    plantilla_email_id: Optional[uuid.UUID] = None,
+    plantilla_certificado_id: Optional[uuid.UUID] = None,
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """
+    Serie temporal de envíos por hora o por día (UTC)
+    `por` desglosa por estado, plantilla_email o plantilla_certificado
+    """
+    
+    email_service = EmailService(db)
+    try:
+        return email_service.obtener_series_email(
+            granularidad, desde, hasta, por, plantilla_email_id, plantilla_certificado_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.get("/logs-email", response_model=List[LogEmailResponse])
 def obtener_logs_email(
-    skip: int = 0,
+    response: Response,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    skip: int = 0,
     estado: str = None,
+    destinatario_email: Optional[str] = None,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    plantilla_email_id: Optional[uuid.UUID] = None,
+    plantilla_certificado_id: Optional[uuid.UUID] = None,
+    trabajo_id: Optional[uuid.UUID] = None,
+    metadatos: Optional[str] = None,
     db: Session = Depends(get_db),
     user_info: dict = Depends(require_auth)
 ):
-    """Obtener logs de envíos de email"""
-    
-    from app.models import LogEmail, EstadoEmail
+    """
+    Obtener logs de envíos de email, del más reciente al más antiguo
+    La página siguiente se pide con el cursor de la cabecera X-Siguiente-Cursor
+    (sin cabecera no hay más resultados). skip queda por compatibilidad.
+    metadatos: objeto JSON que los metadatos deben contener, p. ej. {"modo_entrega": "ENLACE"}
+    """
     
-    query = db.query(LogEmail)
+    from app.models import EstadoEmail
     
+    estado_enum = None
     if estado:
         try:
             estado_enum = EstadoEmail(estado)
-            query = query.filter(LogEmail.estado == estado_enum)
         except ValueError:
             raise HTTPException(status_code=400, detail="Estado inválido")
     
-    logs = query.order_by(LogEmail.fecha_envio.desc()).offset(skip).limit(limit).all()
+    filtro_metadatos = None
+    if metadatos:
+        try:
+            filtro_metadatos = json.loads(metadatos)
+        except ValueError:
+            filtro_metadatos = None
+        if not isinstance(filtro_metadatos, dict):
+            raise HTTPException(status_code=400, detail="metadatos debe ser un objeto JSON")
+    
+    email_service = EmailService(db)
+    try:
+        logs, siguiente = email_service.listar_logs(
+            limite=limit, cursor=cursor, skip=skip, estado=estado_enum,
+            destinatario_email=destinatario_email, desde=desde, hasta=hasta,
+            plantilla_email_id=plantilla_email_id, plantilla_certificado_id=plantilla_certificado_id,
+            trabajo_id=trabajo_id, metadatos=filtro_metadatos
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if siguiente:
+        response.headers["X-Siguiente-Cursor"] = siguiente
+    return logs
+
+@router.get("/logs-email/mas-lentos", response_model=List[LogEmailResponse])
+def obtener_logs_mas_lentos(
+    metrica: str = "latencia_envio_ms",
+    limit: int = 20,
+    plantilla_email_id: Optional[uuid.UUID] = None,
+    plantilla_certificado_id: Optional[uuid.UUID] = None,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """
+    Envíos más lentos por latencia del proveedor (latencia_envio_ms) o por tiempo de render
+    (tiempo_render_ms), p. ej. los de una plantilla de email
+    """
+    
+    email_service = EmailService(db)
+    try:
+        return email_service.logs_mas_lentos(
+            metrica, limit, plantilla_email_id, plantilla_certificado_id, desde, hasta
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ===================== LISTA DE SUPRESIÓN =====================
+
+@router.get("/supresiones-email", response_model=List[SupresionEmailResponse])
+def listar_supresiones_email(
+    buscar: Optional[str] = None,
+    motivo: Optional[str] = None,
+    limit: int = 100,
+    skip: int = 0,
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """Direcciones suprimidas (rebotes duros y altas manuales), las más recientes primero"""
+    
+    from app.models import SupresionEmail, MotivoSupresion
+    from app.supresiones import normalizar_email
+    
+    query = db.query(SupresionEmail).filter(SupresionEmail.is_active == True)
+    if buscar:
+        query = query.filter(SupresionEmail.email.startswith(normalizar_email(buscar), autoescape=True))
+    if motivo:
+        try:
+            query = query.filter(SupresionEmail.motivo == MotivoSupresion(motivo))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Motivo inválido")
+    
+    return query.order_by(SupresionEmail.fecha_actualizacion.desc()).offset(skip).limit(min(limit, 500)).all()
+
+@router.post("/supresiones-email", status_code=status.HTTP_201_CREATED)
+def agregar_supresiones_email(
+    datos: SupresionEmailCreate,
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """Agregar direcciones a la lista de supresión: los envíos masivos dejan de incluirlas"""
+    
+    from app.models import MotivoSupresion
+    from app.supresiones import suprimir, indice_supresiones
+    
+    agregadas = suprimir(db, datos.emails, MotivoSupresion.MANUAL, datos.detalle)
+    db.commit()
+    indice_supresiones.agregar(datos.emails)
+    
+    return {"agregadas": agregadas, "message": f"{agregadas} direcciones en la lista de supresión"}
+
+@router.delete("/supresiones-email/{email}")
+def quitar_supresion_email(
+    email: str,
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """Quitar una dirección de la lista de supresión"""
+    
+    from app.supresiones import quitar_supresion, indice_supresiones
+    
+    if not quitar_supresion(db, email):
+        raise HTTPException(status_code=404, detail="La dirección no está en la lista de supresión")
+    db.commit()
+    indice_supresiones.quitar(email)
     
-    return [LogEmailResponse.from_orm(log) for log in logs]
+    return {"message": "Dirección quitada de la lista de supresión"}
+
+# ===================== WEBHOOKS DEL PROVEEDOR =====================
+
+@router.post("/webhooks/smtp2go")
+async def recibir_eventos_smtp2go(request: Request, token: Optional[str] = None):
+    """
+    Eventos de entrega de SMTP2GO (delivered, bounce, open), uno o una lista por pedido
+    Solo se encolan y se responde enseguida; el buffer los aplica a logs_email por lotes.
+    Con el buffer lleno responde 503 para que el proveedor reintente más tarde.
+    Sin SMTP2GO_WEBHOOK_TOKEN configurado se rechaza todo: un rebote falso suprimiría direcciones reales.
+    """
+    
+    import hmac
+    from app.webhooks import SMTP2GO_WEBHOOK_TOKEN, buffer_eventos_entrega, normalizar_evento
+    
+    if not SMTP2GO_WEBHOOK_TOKEN:
+        raise HTTPException(status_code=503, detail="Webhook deshabilitado: falta SMTP2GO_WEBHOOK_TOKEN")
+    if not hmac.compare_digest(token or "", SMTP2GO_WEBHOOK_TOKEN):
+        raise HTTPException(status_code=403, detail="Token de webhook inválido")
+    
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            payload = await request.json()
+        else:
+            payload = dict(await request.form())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cuerpo de webhook inválido")
+    
+    recibidos = payload if isinstance(payload, list) else [payload]
+    eventos = [e for e in (normalizar_evento(p) for p in recibidos if isinstance(p, dict)) if e]
+    if eventos and not buffer_eventos_entrega.encolar(eventos):
+        raise HTTPException(status_code=503, detail="Demasiados eventos pendientes, reintente más tarde")
+    
+    return {"recibidos": len(recibidos), "aceptados": len(eventos)}
+
+# ===================== DESCARGA DE CERTIFICADOS =====================
+
+@router.get("/inscripciones/{inscripcion_id}/certificado", response_model=CertificadoInscripcionResponse)
+def obtener_certificado_inscripcion(
+    inscripcion_id: str,
+    db: Session = Depends(get_db),
+    user_info: dict = Depends(require_auth)
+):
+    """
+    Estado del certificado pregenerado de una inscripción
+    Si está listo incluye el enlace firmado de descarga (no se genera nada en la petición)
+    """
+    
+    fila = db.query(CertificadoInscripcion).filter(
+        CertificadoInscripcion.inscripcion_id == inscripcion_id
+    ).first()
+    if not fila:
+        raise HTTPException(status_code=404, detail="La inscripción no tiene certificado solicitado")
+    
+    respuesta = CertificadoInscripcionResponse.from_orm(fila)
+    if fila.estado == EstadoPrerender.LISTO and os.path.exists(ruta_certificado(fila.certificado_id)):
+        certificado = db.query(CertificadoGenerado).filter(CertificadoGenerado.id == fila.certificado_id).first()
+        if certificado:
+            respuesta.enlace_descarga = enlace_descarga({"id": certificado.id, "sha256": certificado.sha256})
+    return respuesta
+
+@router.get("/certificados/descargar/{token}")
+def descargar_certificado(token: str, request: Request):
+    """
+    Descargar un certificado con enlace firmado
+    No consulta la BD: el token trae el id y el hash del archivo
+    Soporta ETag (If-None-Match) y Range para descargas parciales
+    """
+    
+    payload = verify_token(token, token_type="descarga")
+    if payload is None or not payload.get("sub"):
+        raise HTTPException(status_code=403, detail="Enlace inválido o expirado")
+    
+    ruta = ruta_certificado(uuid.UUID(payload["sub"]))
+    if not os.path.exists(ruta):
+        raise HTTPException(status_code=404, detail="Certificado no encontrado")
+    
+    tamano = os.path.getsize(ruta)
+    etag = f'"{payload.get("h", "")}"'
+    cabeceras = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=86400",
+        "Content-Disposition": 'attachment; filename="certificado.pdf"'
+    }
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cabeceras)
+    
+    # If-Range: si el ETag no coincide se envía el archivo completo
+    rango_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        rango_header = None
+    
+    # Un Range mal formado se ignora (200 completo); 416 solo si es válido pero no satisfacible
+    try:
+        rango = parsear_rango(rango_header, tamano)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{tamano}"})
+    
+    if rango is None:
+        cabeceras["Content-Length"] = str(tamano)
+        return StreamingResponse(
+            leer_archivo(ruta, 0, tamano - 1), media_type="application/pdf", headers=cabeceras
+        )
+    
+    inicio, fin = rango
+    cabeceras["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+    cabeceras["Content-Length"] = str(fin - inicio + 1)
+    return StreamingResponse(
+        leer_archivo(ruta, inicio, fin), status_code=206, media_type="application/pdf", headers=cabeceras
+    )
+
+@router.get("/recursos-email/{nombre}")
+def obtener_recurso_email(nombre: str):
+    """
+    Imágenes extraídas de las plantillas de email (las abren los destinatarios, sin autenticación)
+    El nombre es el hash del contenido: nunca cambia, se cachea sin límite
+    """
+    
+    if not re.fullmatch(r"[0-9a-f]{64}\.(png|jpg|gif|webp)", nombre):
+        raise HTTPException(status_code=404, detail="Recurso no encontrado")
+    ruta = ruta_recurso_email(nombre)
+    if not os.path.exists(ruta):
+        raise HTTPException(status_code=404, detail="Recurso no encontrado")
+    
+    return FileResponse(ruta, media_type=TIPOS_RECURSO[nombre.rsplit(".", 1)[1]], headers={
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{nombre.split(".")[0]}"'
+    })
 
 # ===================== PRUEBAS Y UTILIDADES =====================
 
@@ -569,6 +1052,12 @@ def get_available_variables():
             "label": "Institución",
             "description": "Nombre de la institución",
             "example": "Centro de Desarrollo Profesional CDP"
+        },
+        {
+            "key": "ENLACE_CERTIFICADO",
+            "label": "Enlace del certificado",
+            "description": "Enlace de descarga del certificado (solo en modo de entrega ENLACE)",
+            "example": "http://localhost:8003/certificados/descargar/..."
         }
     ]
     
@@ -3,8 +3,9 @@ from pydantic import BaseModel, Field, validator
 from typing import Optional, List, Any, Dict
 from datetime import datetime
 from uuid import UUID
-from app.models import EstadoEmail
+from app.models import EstadoEmail, EstadoTrabajo, ModoEntrega, MotivoSupresion, EstadoPrerender
 import re
+import json
 
 # ==================== PLANTILLAS DE CERTIFICADOS ====================
 
@@ -58,20 +59,31 @@ class PlantillaEmailUpdate(BaseModel):
     contenido_html: Optional[str] = Field(None, min_length=50)
     is_active: Optional[bool] = None
 
-class PlantillaEmailResponse(BaseModel):
+class PlantillaEmailResumen(BaseModel):
+    """Plantilla sin su HTML, para listados (el HTML se pide con GET /plantillas-email/{id})"""
     id: UUID
     nombre: str
     descripcion: Optional[str]
     asunto: str
-    contenido_html: str
     variables_disponibles: Optional[List[str]] = None
     is_active: bool
     fecha_creacion: datetime
     fecha_actualizacion: datetime
 
+    @validator('variables_disponibles', pre=True)
+    def parse_variables(cls, v):
+        # En la BD se guardan como JSON al crear o editar la plantilla
+        if isinstance(v, str):
+            return json.loads(v)
+        return v or []
+
     class Config:
         from_attributes = True
 
+class PlantillaEmailResponse(PlantillaEmailResumen):
+    contenido_html: str
+    variables_desconocidas: Optional[List[str]] = None
+
 # ==================== LOG DE EMAIL ====================
 
 class LogEmailResponse(BaseModel):
@@ -86,6 +98,13 @@ class LogEmailResponse(BaseModel):
     fecha_envio: datetime
     fecha_entrega: Optional[datetime]
     metadatos: Optional[dict]
+    trabajo_id: Optional[UUID] = None
+    intentos: Optional[int] = None
+    tiempo_render_ms: Optional[int] = None
+    latencia_envio_ms: Optional[int] = None
+    tamano_adjunto: Optional[int] = None
+    proveedor_message_id: Optional[str] = None
+    fecha_apertura: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -99,23 +118,110 @@ class EnvioEmailIndividual(BaseModel):
     contenido_html: str = Field(..., min_length=50)
     plantilla_certificado_id: Optional[UUID] = None
     variables: Optional[Dict[str, str]] = None
+    modo_entrega: ModoEntrega = ModoEntrega.ADJUNTO
 
 
 class EnvioMasivoRequest(BaseModel):
     plantilla_email_id: UUID
     plantilla_certificado_id: Optional[UUID] = None
     curso_id: Optional[UUID] = None
+    cursos_ids: Optional[List[UUID]] = None
     destinatarios_ids: Optional[List[UUID]] = None
     variables_globales: Optional[Dict[str, str]] = None
     configuracion_lotes: Optional[Dict[str, int]] = None
+    modo_entrega: ModoEntrega = ModoEntrega.ADJUNTO
+    # Programación (solo POST /trabajos-envio): no arrancar antes de una fecha y/o
+    # ejecutar solo dentro de una ventana diaria, p. ej. 22:00-06:00
+    no_antes_de: Optional[datetime] = None
+    ventana_inicio: Optional[str] = Field(default=None, pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+    ventana_fin: Optional[str] = Field(default=None, pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+
+    @property
+    def programado(self) -> bool:
+        return bool(self.no_antes_de or self.ventana_inicio or self.ventana_fin)
+
+class GrupoCampana(BaseModel):
+    """Un curso de la campaña con sus plantillas"""
+    curso_id: UUID
+    plantilla_email_id: UUID
+    plantilla_certificado_id: Optional[UUID] = None
+    variables_globales: Optional[Dict[str, str]] = None
+
+class CampanaEnvioRequest(BaseModel):
+    # Un estudiante inscrito en varios cursos recibe un solo correo: el de su primer grupo
+    grupos: List[GrupoCampana] = Field(..., min_length=1, max_length=50)
+    configuracion_lotes: Optional[Dict[str, int]] = None
+    modo_entrega: ModoEntrega = ModoEntrega.ADJUNTO
+    no_antes_de: Optional[datetime] = None
+    ventana_inicio: Optional[str] = Field(default=None, pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+    ventana_fin: Optional[str] = Field(default=None, pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+
+    @validator('grupos')
+    def validar_grupos(cls, v):
+        cursos = [grupo.curso_id for grupo in v]
+        if len(set(cursos)) != len(cursos):
+            raise ValueError('Cada curso puede aparecer en un solo grupo de la campaña')
+        return v
 
 class EnvioMasivoResponse(BaseModel):
+    trabajo_id: Optional[UUID] = None
     total_destinatarios: int
     enviados_exitosos: int
     errores: int
     log_ids: List[UUID]
     errores_detalle: List[str]
     tiempo_total: Optional[float] = None
+    omitidos: int = 0  # destinatarios que ya tenían este envío (clave de idempotencia)
+    suprimidos: int = 0  # destinatarios en la lista de supresión (no se les envió)
+    repetido: bool = False  # True si el pedido ya existía y se devuelve su resultado
+
+class TrabajoEnvioResponse(BaseModel):
+    id: UUID
+    estado: EstadoTrabajo
+    plantilla_email_id: Optional[UUID]
+    plantilla_certificado_id: Optional[UUID]
+    destinatarios_estimados: Optional[int]
+    total_destinatarios: Optional[int]
+    enviados_exitosos: Optional[int]
+    errores: Optional[int]
+    fecha_creacion: Optional[datetime]
+    fecha_checkpoint: Optional[datetime]
+    fecha_fin: Optional[datetime]
+    interrupciones: Optional[int] = None
+    ultimo_error: Optional[str] = None
+    no_antes_de: Optional[datetime] = None
+    ventana_inicio: Optional[str] = None
+    ventana_fin: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class SupresionEmailCreate(BaseModel):
+    emails: List[str] = Field(..., min_length=1, max_length=1000)
+    detalle: Optional[str] = None
+
+class SupresionEmailResponse(BaseModel):
+    email: str
+    motivo: MotivoSupresion
+    detalle: Optional[str]
+    is_active: bool
+    fecha_creacion: Optional[datetime]
+    fecha_actualizacion: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+class CertificadoInscripcionResponse(BaseModel):
+    inscripcion_id: UUID
+    estado: EstadoPrerender
+    version_plantilla: Optional[str]
+    fecha_solicitud: Optional[datetime]
+    fecha_generado: Optional[datetime]
+    ultimo_error: Optional[str]
+    enlace_descarga: Optional[str] = None
+
+    class Config:
+        from_attributes = True
 
 class ConfiguracionLotes(BaseModel):
     lote_size: int = Field(default=10, ge=1, le=50)
@@ -130,6 +236,19 @@ class EstadisticasEmail(BaseModel):
     emails_hoy: int
     tasa_exito: float
 
+class PuntoSerieEmail(BaseModel):
+    inicio: datetime  # inicio del bucket (UTC)
+    clave: Optional[str] = None  # estado o id de plantilla si se pidió desglose; None = sin plantilla
+    cantidad: int
+
+class SeriesEmailResponse(BaseModel):
+    granularidad: str
+    desde: datetime
+    hasta: datetime
+    por: Optional[str] = None
+    total: int
+    puntos: List[PuntoSerieEmail]
+
 # ==================== UTILIDADES ====================
 
 def extraer_variables_plantilla(contenido_html: str) -> List[str]:
@@ -0,0 +1,156 @@
+# app/supresiones.py - CERTIFICADOS SERVICE
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select, func, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app.database import engine
+from app.models import SupresionEmail, MotivoSupresion
+
+# Como máximo cada cuántos segundos el índice en memoria consulta los cambios de la tabla
+SUPRESIONES_REFRESCO_SEG = float(os.getenv("SUPRESIONES_REFRESCO_SEG", "30"))
+# Cada refresco vuelve a leer este margen hacia atrás: cubre transacciones que confirmaron
+# después de empezar (su fecha_actualizacion es la de inicio) y relojes algo desfasados
+SUPRESIONES_SOLAPE_SEG = float(os.getenv("SUPRESIONES_SOLAPE_SEG", "60"))
+
+
+def normalizar_email(email: Optional[str]) -> str:
+    """Forma en que se guardan y se comparan las direcciones"""
+    return (email or "").strip().lower()
+
+
+def suprimir(conn, emails: Iterable[str], motivo: MotivoSupresion, detalle: Optional[str] = None) -> int:
+    """
+    Agrega (o reactiva) direcciones en supresiones_email con la conexión o sesión del llamador
+    Devuelve cuántas filas insertó o actualizó; el llamador confirma la transacción
+    """
+    filas = [
+        {"email": email, "motivo": motivo, "detalle": detalle, "is_active": True}
+        for email in sorted({normalizar_email(e) for e in emails} - {""})
+    ]
+    if not filas:
+        return 0
+    sentencia = insert(SupresionEmail.__table__).values(filas)
+    resultado = conn.execute(sentencia.on_conflict_do_update(
+        index_elements=[SupresionEmail.email],
+        set_={
+            "motivo": sentencia.excluded.motivo,
+            "detalle": sentencia.excluded.detalle,
+            "is_active": True,
+            "fecha_actualizacion": func.now()
+        }
+    ))
+    return resultado.rowcount
+
+
+def quitar_supresion(conn, email: str) -> bool:
+    """
+    Desactiva una dirección (no se borra: el refresco incremental de los otros procesos
+    solo ve filas con fecha_actualizacion nueva). False si no estaba suprimida
+    """
+    resultado = conn.execute(
+        update(SupresionEmail.__table__).where(
+            SupresionEmail.email == normalizar_email(email),
+            SupresionEmail.is_active == True
+        ).values(is_active=False, fecha_actualizacion=func.now())
+    )
+    return resultado.rowcount > 0
+
+
+class IndiceSupresiones:
+    """
+    Copia en memoria de las direcciones suprimidas, para filtrar destinatarios en O(1)
+
+    La primera consulta carga la tabla completa; después cada refrescar() lee solo las filas
+    con fecha_actualizacion posterior al último refresco (índice sobre esa columna), a lo sumo
+    cada SUPRESIONES_REFRESCO_SEG. Los cambios hechos por este proceso se aplican al instante.
+    Es un set exacto y no un filtro de Bloom: un falso positivo dejaría a un estudiante sin
+    su certificado sin que nadie lo note.
+    """
+
+    def __init__(self, intervalo: float = SUPRESIONES_REFRESCO_SEG):
+        self.intervalo = intervalo
+        self._emails = set()
+        # Instante (reloj de la BD) desde el que hay que pedir cambios; None = sin cargar
+        self._desde: Optional[datetime] = None
+        self._ultimo_refresco = 0.0
+        self._cargas = 0
+        self._refrescos = 0
+        self._lock = threading.Lock()
+        self._refresco_lock = threading.Lock()
+
+    # ==================== API PÚBLICA ====================
+
+    def refrescar(self, forzar: bool = False):
+        """Trae los cambios desde el último refresco (o carga todo la primera vez)"""
+        if not forzar and self._desde is not None and time.monotonic() - self._ultimo_refresco < self.intervalo:
+            return
+        with self._refresco_lock:
+            if not forzar and self._desde is not None and time.monotonic() - self._ultimo_refresco < self.intervalo:
+                return
+            if self._desde is None:
+                self._cargar()
+            else:
+                self._cambios()
+            self._ultimo_refresco = time.monotonic()
+
+    def contiene(self, email: Optional[str]) -> bool:
+        if self._desde is None:
+            self.refrescar()
+        return normalizar_email(email) in self._emails
+
+    def agregar(self, emails: Iterable[str]):
+        with self._lock:
+            self._emails.update(normalizar_email(e) for e in emails)
+
+    def quitar(self, email: str):
+        with self._lock:
+            self._emails.discard(normalizar_email(email))
+
+    def metricas(self) -> Dict:
+        return {
+            "direcciones": len(self._emails),
+            "cargas": self._cargas,
+            "refrescos": self._refrescos,
+            "desde": self._desde.isoformat() if self._desde else None
+        }
+
+    # ==================== INTERNOS ====================
+
+    def _cargar(self):
+        with engine.connect() as conn:
+            # now() es el inicio de la transacción: lo que confirme después lo ve el refresco
+            desde = conn.execute(select(func.now())).scalar()
+            emails = set(conn.execute(
+                select(SupresionEmail.email).where(SupresionEmail.is_active == True)
+            ).scalars())
+        with self._lock:
+            self._emails = emails
+            self._desde = desde
+            self._cargas += 1
+        print(f"🚫 Lista de supresión cargada: {len(emails)} direcciones")
+
+    def _cambios(self):
+        with engine.connect() as conn:
+            desde = conn.execute(select(func.now())).scalar()
+            filas = conn.execute(
+                select(SupresionEmail.email, SupresionEmail.is_active).where(
+                    SupresionEmail.fecha_actualizacion > self._desde - timedelta(seconds=SUPRESIONES_SOLAPE_SEG)
+                )
+            ).all()
+        with self._lock:
+            for email, activa in filas:
+                if activa:
+                    self._emails.add(email)
+                else:
+                    self._emails.discard(email)
+            self._desde = desde
+            self._refrescos += 1
+
+
+# Instancia compartida por todo el servicio
+indice_supresiones = IndiceSupresiones()
@@ -0,0 +1,156 @@
+# app/template_engine.py - CERTIFICADOS SERVICE
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+# Mismo formato de variable que extraer_variables_plantilla: {VARIABLE}
+PATRON_VARIABLE = re.compile(r'\{([A-Z_]+)\}')
+
+# Variables que el envío masivo siempre provee
+VARIABLES_BASE = {
+    "NOMBRE", "APELLIDO", "NOMBRE_COMPLETO", "EMAIL",
+    "CEDULA", "CURSO", "FECHA", "INSTITUCION"
+}
+
+# Variables que solo existen en ciertos modos de entrega
+VARIABLES_ENTREGA = {"ENLACE_CERTIFICADO"}
+
+TEMPLATE_CACHE_MAX = int(os.getenv("TEMPLATE_CACHE_MAX", "256"))
+
+
+class PlantillaCompilada:
+    """
+    Texto tokenizado una sola vez en segmentos estáticos y variables.
+    re.split con grupo de captura deja las variables en las posiciones impares.
+    """
+    __slots__ = ("segmentos", "posiciones", "variables")
+
+    def __init__(self, texto: str):
+        self.segmentos: List[str] = PATRON_VARIABLE.split(texto)
+        self.posiciones: List[Tuple[int, str]] = [
+            (i, self.segmentos[i]) for i in range(1, len(self.segmentos), 2)
+        ]
+        self.variables: Set[str] = {nombre for _, nombre in self.posiciones}
+
+    def renderizar(self, valores: Dict[str, str], estricto: bool = True) -> str:
+        """
+        Renderiza la plantilla con un único join.
+        En modo estricto una variable sin valor lanza KeyError; en modo
+        permisivo se deja el marcador tal cual (comportamiento histórico).
+        """
+        segmentos = list(self.segmentos)
+        if estricto:
+            for i, nombre in self.posiciones:
+                segmentos[i] = valores[nombre]
+        else:
+            for i, nombre in self.posiciones:
+                segmentos[i] = valores.get(nombre, "{" + nombre + "}")
+        return "".join(segmentos)
+
+
+class PlantillaEmailCompilada:
+    """Asunto y contenido HTML compilados de una PlantillaEmail"""
+    __slots__ = ("plantilla_id", "version", "asunto", "html", "variables")
+
+    def __init__(self, plantilla_id: str, version: str, asunto: str, contenido_html: str):
+        self.plantilla_id = plantilla_id
+        self.version = version
+        self.asunto = PlantillaCompilada(asunto)
+        self.html = PlantillaCompilada(contenido_html)
+        self.variables: Set[str] = self.asunto.variables | self.html.variables
+
+    def variables_desconocidas(self, conocidas: Optional[Set[str]] = None) -> List[str]:
+        """Variables de la plantilla que no se encuentran entre las conocidas"""
+        conocidas = (VARIABLES_BASE | VARIABLES_ENTREGA) if conocidas is None else conocidas
+        return sorted(self.variables - conocidas)
+
+    def validar(self, conocidas: Set[str]):
+        """Lanza ValueError si alguna variable quedaría sin valor al renderizar"""
+        faltantes = self.variables_desconocidas(conocidas)
+        if faltantes:
+            raise ValueError(
+                "La plantilla usa variables sin valor: " + ", ".join("{" + v + "}" for v in faltantes)
+            )
+
+    def renderizar(self, valores: Dict[str, str]) -> Tuple[str, str]:
+        """Devuelve (asunto, contenido_html) renderizados"""
+        return self.asunto.renderizar(valores), self.html.renderizar(valores)
+
+
+def normalizar_valores(variables: Dict) -> Dict[str, str]:
+    """Claves en mayúsculas y valores como texto, igual que procesar_variables"""
+    return {str(clave).upper(): str(valor) for clave, valor in variables.items()}
+
+
+def version_plantilla(plantilla) -> str:
+    """La versión de una plantilla es su fecha de última actualización"""
+    fecha = getattr(plantilla, "fecha_actualizacion", None)
+    return fecha.isoformat() if fecha else "0"
+
+
+@lru_cache(maxsize=512)
+def compilar_texto(texto: str) -> PlantillaCompilada:
+    """Compila textos sueltos (HTML libre, campos del certificado) con caché por contenido"""
+    return PlantillaCompilada(texto)
+
+
+def html_para_envio(plantilla) -> str:
+    """
+    HTML preprocesado que se guardó con la plantilla (CSS en línea, minificado)
+    Las plantillas guardadas antes del preprocesado se procesan aquí, una vez por versión
+    """
+    procesado = getattr(plantilla, "contenido_html_procesado", None)
+    if procesado:
+        return procesado
+    from app.html_email import preprocesar_html
+    return preprocesar_html(plantilla.contenido_html)
+
+
+# ==================== CACHÉ POR PLANTILLA Y VERSIÓN ====================
+
+_cache: "OrderedDict[Tuple[str, str], PlantillaEmailCompilada]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def compilar_plantilla_email(plantilla) -> PlantillaEmailCompilada:
+    """
+    Compila una PlantillaEmail y la guarda en caché por (id, versión).
+    Se llama al guardar la plantilla para que el primer envío ya la encuentre.
+    """
+    clave = (str(plantilla.id), version_plantilla(plantilla))
+    compilada = PlantillaEmailCompilada(clave[0], clave[1], plantilla.asunto, html_para_envio(plantilla))
+
+    with _cache_lock:
+        # Descartar versiones anteriores de la misma plantilla
+        for anterior in [c for c in _cache if c[0] == clave[0] and c != clave]:
+            del _cache[anterior]
+        _cache[clave] = compilada
+        _cache.move_to_end(clave)
+        while len(_cache) > TEMPLATE_CACHE_MAX:
+            _cache.popitem(last=False)
+
+    desconocidas = compilada.variables_desconocidas()
+    if desconocidas:
+        print(f"⚠️ Plantilla {clave[0]}: variables no estándar {desconocidas}")
+    return compilada
+
+
+def obtener_plantilla_compilada(plantilla) -> PlantillaEmailCompilada:
+    """Devuelve la plantilla compilada desde caché o la compila si cambió de versión"""
+    clave = (str(plantilla.id), version_plantilla(plantilla))
+    with _cache_lock:
+        compilada = _cache.get(clave)
+        if compilada is not None:
+            _cache.move_to_end(clave)
+            return compilada
+    return compilar_plantilla_email(plantilla)
+
+
+def invalidar_plantilla(plantilla_id):
+    """Elimina todas las versiones de una plantilla de la caché"""
+    with _cache_lock:
+        for clave in [c for c in _cache if c[0] == str(plantilla_id)]:
+            del _cache[clave]
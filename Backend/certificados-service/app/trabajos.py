@@ -0,0 +1,258 @@
+# app/trabajos.py - CERTIFICADOS SERVICE
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import case, func, or_, text, update
+
+from app.database import SessionLocal, engine
+from app.models import TrabajoEnvio, EstadoTrabajo
+from app.eventos import bus_eventos
+
+# Cada cuánto se buscan trabajos interrumpidos (además de al arrancar)
+TRABAJOS_REANUDAR_INTERVALO_SEG = float(os.getenv("TRABAJOS_REANUDAR_INTERVALO_SEG", "60"))
+# Interrupciones seguidas sin avanzar el checkpoint antes de dar el trabajo por fallido (ERROR)
+TRABAJOS_MAX_INTERRUPCIONES = int(os.getenv("TRABAJOS_MAX_INTERRUPCIONES", "5"))
+# Zona horaria de las ventanas de ejecución ("HH:MM")
+TRABAJOS_ZONA_HORARIA = ZoneInfo(os.getenv("TRABAJOS_ZONA_HORARIA", "America/Guayaquil"))
+
+
+def parsear_hora(valor: str) -> time:
+    """'HH:MM' -> time; lanza ValueError si el formato no es válido"""
+    try:
+        return datetime.strptime(valor, "%H:%M").time()
+    except (TypeError, ValueError):
+        raise ValueError(f"Hora inválida: {valor!r} (formato HH:MM)")
+
+
+def dentro_de_ventana(ventana_inicio: Optional[str], ventana_fin: Optional[str],
+                      ahora: Optional[datetime] = None) -> bool:
+    """
+    True si la hora local está dentro de la ventana [inicio, fin)
+    Una ventana como 22:00-06:00 cruza la medianoche. Sin ventana siempre es True.
+    """
+    if not ventana_inicio or not ventana_fin:
+        return True
+    local = (ahora or datetime.now(timezone.utc)).astimezone(TRABAJOS_ZONA_HORARIA).time()
+    inicio, fin = parsear_hora(ventana_inicio), parsear_hora(ventana_fin)
+    if inicio <= fin:
+        return inicio <= local < fin
+    return local >= inicio or local < fin
+
+
+def puede_ejecutarse(no_antes_de: Optional[datetime], ventana_inicio: Optional[str],
+                     ventana_fin: Optional[str], ahora: Optional[datetime] = None) -> bool:
+    """Un trabajo programado puede correr si ya pasó no_antes_de y está dentro de su ventana"""
+    ahora = ahora or datetime.now(timezone.utc)
+    if no_antes_de is not None and ahora < no_antes_de:
+        return False
+    return dentro_de_ventana(ventana_inicio, ventana_fin, ahora)
+
+
+@contextmanager
+def bloquear_trabajo(clave: str):
+    """
+    Lock de sesión de Postgres (advisory lock) sobre la clave de un trabajo
+    Garantiza un solo ejecutor por trabajo; si el proceso muere, la conexión se cierra
+    y el lock se libera solo, así el trabajo puede reanudarse enseguida.
+    Devuelve True si se obtuvo el lock.
+    """
+    conn = engine.connect()
+    try:
+        bloqueado = conn.execute(
+            text("SELECT pg_try_advisory_lock(hashtext(:clave))"), {"clave": clave}
+        ).scalar()
+        conn.commit()
+        try:
+            yield bool(bloqueado)
+        finally:
+            if bloqueado:
+                conn.execute(text("SELECT pg_advisory_unlock(hashtext(:clave))"), {"clave": clave})
+                conn.commit()
+    finally:
+        conn.close()
+
+
+def guardar_checkpoint(trabajo_id, total_destinatarios: int, ultimo_destinatario_id,
+                       enviados_exitosos: int, errores: int):
+    """
+    Guarda el avance de un trabajo al terminar cada lote
+    Usa su propia conexión para no cerrar el cursor de destinatarios de la sesión del envío.
+    """
+    tabla = TrabajoEnvio.__table__
+    with engine.begin() as conn:
+        conn.execute(update(tabla).where(tabla.c.id == trabajo_id).values(
+            total_destinatarios=total_destinatarios,
+            ultimo_destinatario_id=ultimo_destinatario_id,
+            enviados_exitosos=enviados_exitosos,
+            errores=errores,
+            fecha_checkpoint=datetime.now(timezone.utc)
+        ))
+
+
+def registrar_interrupcion(trabajo_id, checkpoint_inicial: Optional[datetime], error: str) -> bool:
+    """
+    Cuenta una interrupción del ejecutor; si avanzó el checkpoint desde checkpoint_inicial,
+    la cuenta vuelve a empezar. Tras TRABAJOS_MAX_INTERRUPCIONES seguidas sin avance
+    (un fallo que se repite siempre) el trabajo pasa a ERROR y deja de reanudarse.
+    Devuelve True si el trabajo quedó en ERROR.
+    """
+    tabla = TrabajoEnvio.__table__
+    with engine.begin() as conn:
+        interrupciones = conn.execute(update(tabla).where(
+            tabla.c.id == trabajo_id, tabla.c.estado == EstadoTrabajo.EN_CURSO
+        ).values(
+            interrupciones=case(
+                (tabla.c.fecha_checkpoint.is_distinct_from(checkpoint_inicial), 1),
+                else_=func.coalesce(tabla.c.interrupciones, 0) + 1
+            ),
+            ultimo_error=error[:1000]
+        ).returning(tabla.c.interrupciones)).scalar()
+        if interrupciones is None or interrupciones < TRABAJOS_MAX_INTERRUPCIONES:
+            return False
+        conn.execute(update(tabla).where(tabla.c.id == trabajo_id).values(
+            estado=EstadoTrabajo.ERROR,
+            fecha_fin=datetime.now(timezone.utc)
+        ))
+    return True
+
+
+def ejecutar_trabajo_con_lock(trabajo_id, clave: str, session_factory=SessionLocal) -> bool:
+    """
+    Ejecuta un trabajo si nadie más lo está ejecutando
+    Devuelve False si otro proceso tiene el lock.
+    """
+    from app.email_service import EmailService
+
+    with bloquear_trabajo(clave) as bloqueado:
+        if not bloqueado:
+            return False
+
+        db = session_factory()
+        checkpoint_inicial = None
+        try:
+            trabajo = db.query(TrabajoEnvio).filter(TrabajoEnvio.id == trabajo_id).first()
+            # Puede haber terminado antes de obtener el lock
+            if trabajo is None or trabajo.estado != EstadoTrabajo.EN_CURSO:
+                return True
+            if trabajo.ultimo_destinatario_id:
+                print(f"♻️ Reanudando trabajo {trabajo_id} desde el destinatario {trabajo.ultimo_destinatario_id}")
+            checkpoint_inicial = trabajo.fecha_checkpoint
+            EmailService(db).ejecutar_trabajo(trabajo)
+        except ValueError as e:
+            # Error de validación: el trabajo ya quedó en ERROR y se publicó error_trabajo
+            print(f"❌ Trabajo {trabajo_id}: {e}")
+        except Exception as e:
+            db.rollback()
+            if registrar_interrupcion(trabajo_id, checkpoint_inicial, str(e)):
+                mensaje = f"El trabajo falló {TRABAJOS_MAX_INTERRUPCIONES} veces seguidas sin avanzar: {e}"
+                print(f"☠️ Trabajo {trabajo_id}: {mensaje}")
+                bus_eventos.publicar(trabajo_id, "error_trabajo", {"mensaje": mensaje}, final=True)
+            else:
+                # El trabajo sigue EN_CURSO y se retomará desde su checkpoint
+                print(f"❌ Trabajo {trabajo_id} interrumpido: {e}")
+                bus_eventos.publicar(trabajo_id, "interrumpido", {"mensaje": str(e)})
+        finally:
+            db.close()
+        return True
+
+
+def lanzar_trabajo(trabajo_id, clave: str):
+    """Ejecuta un trabajo en segundo plano (POST /trabajos-envio)"""
+    hilo = threading.Thread(
+        target=ejecutar_trabajo_con_lock, args=(trabajo_id, clave),
+        name=f"trabajo-envio-{trabajo_id}", daemon=True
+    )
+    hilo.start()
+
+
+class ReanudadorTrabajos:
+    """
+    Hilo que arranca y retoma los envíos masivos
+    - Trabajos PROGRAMADOS o PAUSADOS: cuando llega su no_antes_de y están dentro de su
+      ventana pasan a EN_CURSO (fuera de la ventana, el propio trabajo se pausa entre lotes).
+    - Trabajos EN_CURSO cuyo lock esté libre (su ejecutor murió): se continúan desde el
+      último destinatario guardado.
+    Todo el estado vive en trabajos_envio, así la programación sobrevive a reinicios.
+    """
+
+    def __init__(self, session_factory=SessionLocal, intervalo: float = TRABAJOS_REANUDAR_INTERVALO_SEG):
+        self.session_factory = session_factory
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="reanudador-trabajos", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._hilo = None
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                self.reanudar_pendientes()
+            except Exception as e:
+                print(f"❌ Reanudador: error buscando trabajos interrumpidos: {e}")
+            self._detener.wait(timeout=self.intervalo)
+
+    def activar_programados(self, ahora: Optional[datetime] = None) -> int:
+        """Pasa a EN_CURSO los trabajos programados o pausados que ya pueden ejecutarse"""
+        ahora = ahora or datetime.now(timezone.utc)
+        db = self.session_factory()
+        try:
+            candidatos = db.query(
+                TrabajoEnvio.id, TrabajoEnvio.ventana_inicio, TrabajoEnvio.ventana_fin
+            ).filter(
+                TrabajoEnvio.estado.in_([EstadoTrabajo.PROGRAMADO, EstadoTrabajo.PAUSADO]),
+                or_(TrabajoEnvio.no_antes_de.is_(None), TrabajoEnvio.no_antes_de <= ahora)
+            ).all()
+            listos = [t.id for t in candidatos if dentro_de_ventana(t.ventana_inicio, t.ventana_fin, ahora)]
+            if not listos:
+                return 0
+
+            # El filtro por estado evita activar dos veces si hay varios procesos
+            activados = db.query(TrabajoEnvio).filter(
+                TrabajoEnvio.id.in_(listos),
+                TrabajoEnvio.estado.in_([EstadoTrabajo.PROGRAMADO, EstadoTrabajo.PAUSADO])
+            ).update({"estado": EstadoTrabajo.EN_CURSO}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+        print(f"⏰ {activados} trabajos programados pasan a ejecución")
+        return activados
+
+    def reanudar_pendientes(self):
+        """
+        Lanza los trabajos EN_CURSO; cada uno corre en su hilo y solo arranca si su lock
+        está libre, así los que se están ejecutando en otro hilo o proceso no se tocan
+        """
+        self.activar_programados()
+
+        db = self.session_factory()
+        try:
+            pendientes = db.query(TrabajoEnvio.id, TrabajoEnvio.clave_idempotencia).filter(
+                TrabajoEnvio.estado == EstadoTrabajo.EN_CURSO,
+                TrabajoEnvio.parametros.isnot(None),
+                TrabajoEnvio.clave_idempotencia.isnot(None)
+            ).order_by(TrabajoEnvio.fecha_creacion).all()
+        finally:
+            db.close()
+
+        for trabajo_id, clave in pendientes:
+            if self._detener.is_set():
+                return
+            lanzar_trabajo(trabajo_id, clave)
+
+
+# Instancia compartida por todo el servicio
+reanudador_trabajos = ReanudadorTrabajos()
@@ -0,0 +1,203 @@
+# app/transportes.py - CERTIFICADOS SERVICE
+import os
+import ssl
+import base64
+import smtplib
+import socket
+import requests
+from abc import ABC, abstractmethod
+from email.message import EmailMessage
+from email.utils import make_msgid, parseaddr
+from typing import Dict, NamedTuple, Optional, Type
+
+# Transporte activo: smtp2go (API HTTP) o smtp (servidor SMTP, p. ej. uno de depuración local)
+EMAIL_TRANSPORTE = os.getenv("EMAIL_TRANSPORTE", "smtp2go").lower()
+SENDER_EMAIL = os.getenv("SMTP2GO_SENDER_EMAIL", "Centro de Desarrollo Profesional CDP <documentos@capacitacionescdp.com>")
+
+# SMTP2GO (la URL se puede apuntar a scripts/fake_smtp2go.py para pruebas sin cuenta)
+SMTP2GO_API_KEY = os.getenv("SMTP2GO_API_KEY")
+SMTP2GO_API_URL = os.getenv("SMTP2GO_API_URL", "https://api.smtp2go.com/v3/email/send")
+SMTP2GO_TIMEOUT_SEG = float(os.getenv("SMTP2GO_TIMEOUT_SEG", "30"))
+
+# SMTP
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))
+SMTP_USUARIO = os.getenv("SMTP_USUARIO")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "false").lower() == "true"
+SMTP_TIMEOUT_SEG = float(os.getenv("SMTP_TIMEOUT_SEG", "30"))
+
+
+class ResultadoEnvio(NamedTuple):
+    """Resultado de un envío al proveedor"""
+    exito: bool
+    mensaje: str
+    reintentable: bool = False
+    retry_after: Optional[float] = None  # segundos sugeridos por el proveedor (HTTP 429)
+    latencia: Optional[float] = None  # segundos que tardó el proveedor (lo completa EmailService)
+    message_id: Optional[str] = None  # id del proveedor; lo traen sus eventos de entrega (webhook)
+
+
+def _leer_retry_after(response) -> Optional[float]:
+    """Lee la cabecera Retry-After en segundos, si viene"""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class Transporte(ABC):
+    """
+    Interfaz de los transportes de correo
+    Un transporte solo entrega un correo ya armado; tasa, reintentos y logs quedan
+    en EmailService. Debe ser seguro llamarlo desde varios hilos.
+    """
+    nombre = "base"
+
+    @property
+    def configurado(self) -> bool:
+        return True
+
+    @abstractmethod
+    def enviar(self, destinatario: str, asunto: str, contenido_html: str,
+               adjunto_pdf: Optional[bytes] = None, nombre_adjunto: str = "certificado.pdf") -> ResultadoEnvio:
+        ...
+
+
+class TransporteSMTP2GO(Transporte):
+    """
+    API HTTP de SMTP2GO
+    Timeouts, errores de conexión, HTTP 429 y 5xx se marcan como reintentables
+    """
+    nombre = "smtp2go"
+
+    def __init__(self, api_url: str = SMTP2GO_API_URL, api_key: Optional[str] = SMTP2GO_API_KEY):
+        self.api_url = api_url
+        self.api_key = api_key
+        # Sesión compartida: reutiliza las conexiones HTTP entre envíos
+        self._sesion = requests.Session()
+
+    @property
+    def configurado(self) -> bool:
+        return bool(self.api_key)
+
+    def enviar(self, destinatario: str, asunto: str, contenido_html: str,
+               adjunto_pdf: Optional[bytes] = None, nombre_adjunto: str = "certificado.pdf") -> ResultadoEnvio:
+        try:
+            payload = {
+                "api_key": self.api_key,
+                "sender": SENDER_EMAIL,
+                "to": [destinatario],
+                "subject": asunto,
+                "html_body": contenido_html
+            }
+
+            if adjunto_pdf:
+                payload["attachments"] = [{
+                    "filename": nombre_adjunto,
+                    "fileblob": base64.b64encode(adjunto_pdf).decode('utf-8'),
+                    "mimetype": "application/pdf"
+                }]
+
+            response = self._sesion.post(
+                self.api_url,
+                json=payload,
+                headers={"Content-Type": "application/json"},
+                timeout=SMTP2GO_TIMEOUT_SEG
+            )
+
+            if response.status_code == 200:
+                data = response.json().get('data', {})
+                if data.get('succeeded', 0) > 0:
+                    return ResultadoEnvio(True, "Email enviado exitosamente", message_id=data.get('email_id'))
+                error = data.get('failures', ['Error desconocido'])[0] if data.get('failures') else "Error API"
+                return ResultadoEnvio(False, f"Falló el envío: {error}")
+
+            reintentable = response.status_code == 429 or response.status_code >= 500
+            return ResultadoEnvio(
+                False, f"HTTP {response.status_code}: {response.text}",
+                reintentable, _leer_retry_after(response)
+            )
+
+        except requests.RequestException as e:
+            return ResultadoEnvio(False, f"Error de conexión: {str(e)}", reintentable=True)
+        except Exception as e:
+            return ResultadoEnvio(False, f"Error de conexión: {str(e)}")
+
+
+class TransporteSMTP(Transporte):
+    """
+    Envío por SMTP (una conexión por correo)
+    Pensado para servidores de depuración locales (p. ej. `python -m aiosmtpd -n -l localhost:1025`
+    o MailHog); también sirve para un relay SMTP real con usuario y STARTTLS.
+    Respuestas 4xx y errores de conexión son reintentables; 5xx es un rechazo permanente.
+    """
+    nombre = "smtp"
+
+    def __init__(self, host: str = SMTP_HOST, puerto: int = SMTP_PORT):
+        self.host = host
+        self.puerto = puerto
+
+    def _mensaje(self, destinatario: str, asunto: str, contenido_html: str,
+                 adjunto_pdf: Optional[bytes], nombre_adjunto: str) -> EmailMessage:
+        mensaje = EmailMessage()
+        mensaje["From"] = SENDER_EMAIL
+        mensaje["To"] = destinatario
+        mensaje["Subject"] = asunto
+        mensaje["Message-ID"] = make_msgid(domain=parseaddr(SENDER_EMAIL)[1].partition("@")[2] or None)
+        mensaje.set_content("Este correo requiere un cliente con soporte HTML.")
+        mensaje.add_alternative(contenido_html, subtype="html")
+        if adjunto_pdf:
+            mensaje.add_attachment(adjunto_pdf, maintype="application", subtype="pdf", filename=nombre_adjunto)
+        return mensaje
+
+    def enviar(self, destinatario: str, asunto: str, contenido_html: str,
+               adjunto_pdf: Optional[bytes] = None, nombre_adjunto: str = "certificado.pdf") -> ResultadoEnvio:
+        try:
+            # Dentro del try: una dirección o un adjunto mal formados son un fallo del envío, no una excepción
+            mensaje = self._mensaje(destinatario, asunto, contenido_html, adjunto_pdf, nombre_adjunto)
+            with smtplib.SMTP(self.host, self.puerto, timeout=SMTP_TIMEOUT_SEG) as servidor:
+                if SMTP_STARTTLS:
+                    servidor.starttls(context=ssl.create_default_context())
+                if SMTP_USUARIO:
+                    servidor.login(SMTP_USUARIO, SMTP_PASSWORD or "")
+                servidor.send_message(mensaje, from_addr=parseaddr(SENDER_EMAIL)[1], to_addrs=[destinatario])
+            return ResultadoEnvio(True, "Email enviado exitosamente", message_id=mensaje["Message-ID"].strip("<>"))
+
+        except smtplib.SMTPRecipientsRefused as e:
+            codigo, detalle = next(iter(e.recipients.values()))
+            return ResultadoEnvio(False, f"SMTP {codigo}: {detalle!r}", reintentable=400 <= codigo < 500)
+        except smtplib.SMTPResponseException as e:
+            return ResultadoEnvio(
+                False, f"SMTP {e.smtp_code}: {e.smtp_error!r}", reintentable=400 <= e.smtp_code < 500
+            )
+        except (socket.timeout, OSError) as e:
+            # Incluye SMTPServerDisconnected y conexiones rechazadas
+            return ResultadoEnvio(False, f"Error de conexión: {str(e)}", reintentable=True)
+        except ValueError as e:
+            # Cabeceras o adjunto que no se pueden armar: reintentar no cambia nada
+            return ResultadoEnvio(False, f"Mensaje inválido: {str(e)}")
+        except Exception as e:
+            return ResultadoEnvio(False, f"Error de conexión: {str(e)}")
+
+
+# Transportes disponibles por nombre (EMAIL_TRANSPORTE)
+TRANSPORTES: Dict[str, Type[Transporte]] = {
+    TransporteSMTP2GO.nombre: TransporteSMTP2GO,
+    TransporteSMTP.nombre: TransporteSMTP,
+}
+
+_transporte: Optional[Transporte] = None
+
+
+def obtener_transporte() -> Transporte:
+    """Instancia compartida del transporte configurado en EMAIL_TRANSPORTE"""
+    global _transporte
+    if _transporte is None:
+        if EMAIL_TRANSPORTE not in TRANSPORTES:
+            raise ValueError(
+                f"EMAIL_TRANSPORTE desconocido: {EMAIL_TRANSPORTE} (opciones: {', '.join(TRANSPORTES)})"
+            )
+        _transporte = TRANSPORTES[EMAIL_TRANSPORTE]()
+        print(f"📮 Transporte de correo: {_transporte.nombre}")
+    return _transporte
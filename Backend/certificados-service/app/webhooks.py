@@ -0,0 +1,264 @@
+# app/webhooks.py - CERTIFICADOS SERVICE
+import os
+import atexit
+import threading
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.log_writer import log_writer
+from app.models import MotivoSupresion
+from app.supresiones import suprimir, indice_supresiones
+
+# Token compartido que el proveedor envía en la URL del webhook (?token=); vacío = webhook deshabilitado
+SMTP2GO_WEBHOOK_TOKEN = os.getenv("SMTP2GO_WEBHOOK_TOKEN", "")
+# Mensajes distintos por UPDATE y cada cuánto se aplica el buffer
+WEBHOOK_LOTE = int(os.getenv("WEBHOOK_LOTE", "1000"))
+WEBHOOK_INTERVALO_MS = int(os.getenv("WEBHOOK_INTERVALO_MS", "1000"))
+# Por encima de esto se responde 503 y el proveedor reintenta más tarde
+WEBHOOK_BUFFER_MAX = int(os.getenv("WEBHOOK_BUFFER_MAX", "200000"))
+# Ciclos que se espera a que aparezca el log de un evento (puede seguir en el buffer de logs)
+WEBHOOK_REINTENTOS = int(os.getenv("WEBHOOK_REINTENTOS", "5"))
+# Solo se buscan logs enviados en esta ventana: acota las particiones que toca cada UPDATE
+WEBHOOK_VENTANA_DIAS = int(os.getenv("WEBHOOK_VENTANA_DIAS", "45"))
+
+
+class EventoEntrega(NamedTuple):
+    """Evento del proveedor ya normalizado"""
+    message_id: str
+    tipo: str  # entregado, rebote, apertura
+    fecha: datetime
+    detalle: Optional[str] = None
+
+
+def _leer_fecha(valor) -> datetime:
+    """Fecha del evento (epoch o ISO 8601); si no viene o no se entiende, ahora"""
+    try:
+        if isinstance(valor, (int, float)) or (isinstance(valor, str) and valor.isdigit()):
+            return datetime.fromtimestamp(float(valor), timezone.utc)
+        fecha = datetime.fromisoformat(str(valor).replace("Z", "+00:00"))
+        return fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError, OverflowError):
+        return datetime.now(timezone.utc)
+
+
+def normalizar_evento(payload: Dict[str, Any]) -> Optional[EventoEntrega]:
+    """
+    Convierte un evento del webhook de SMTP2GO en EventoEntrega
+    Se usan delivered, open y los rebotes duros; el resto (processed, soft bounce,
+    click, spam, unsubscribe) no cambia el log y devuelve None.
+    """
+    message_id = payload.get("email_id") or payload.get("message_id")
+    evento = str(payload.get("event") or "").lower()
+    if not message_id:
+        return None
+
+    fecha = _leer_fecha(payload.get("time") or payload.get("timestamp") or payload.get("sendtime"))
+    if evento == "delivered":
+        return EventoEntrega(str(message_id), "entregado", fecha)
+    if evento == "open":
+        return EventoEntrega(str(message_id), "apertura", fecha)
+    if evento in ("bounce", "hard_bounce", "reject"):
+        tipo_rebote = str(payload.get("bounce") or payload.get("bounce_type") or "hard").lower()
+        if tipo_rebote != "hard":
+            return None
+        detalle = payload.get("message") or payload.get("smtp_response") or payload.get("context")
+        return EventoEntrega(str(message_id), "rebote", fecha, str(detalle or "Rebote duro")[:1000])
+    return None
+
+
+# UPDATE por lote: los cambios llegan como arreglos paralelos (unnest), una fila por mensaje.
+# Un rebote es final; una entrega solo avanza desde ENVIADO; la apertura guarda la primera.
+ACTUALIZAR_LOGS = text("""
+    UPDATE logs_email AS l SET
+        estado = CASE
+            WHEN v.rebote THEN 'REBOTADO'::estadoemail
+            WHEN v.fecha_entrega IS NOT NULL AND l.estado = 'ENVIADO' THEN 'ENTREGADO'::estadoemail
+            ELSE l.estado
+        END,
+        fecha_entrega = CASE
+            WHEN v.fecha_entrega IS NOT NULL AND l.estado IN ('ENVIADO', 'ENTREGADO') THEN v.fecha_entrega
+            ELSE l.fecha_entrega
+        END,
+        fecha_apertura = LEAST(l.fecha_apertura, v.fecha_apertura),
+        mensaje_error = CASE WHEN v.rebote THEN v.detalle ELSE l.mensaje_error END
+    FROM unnest(
+        CAST(:ids AS text[]), CAST(:entregas AS timestamptz[]), CAST(:aperturas AS timestamptz[]),
+        CAST(:rebotes AS boolean[]), CAST(:detalles AS text[])
+    ) AS v(message_id, fecha_entrega, fecha_apertura, rebote, detalle)
+    WHERE l.proveedor_message_id = v.message_id AND l.fecha_envio >= :desde
+    RETURNING l.proveedor_message_id, l.destinatario_email, v.rebote
+""")
+
+
+class BufferEventosEntrega:
+    """
+    Buffer de eventos de entrega del webhook
+
+    El endpoint solo encola y responde; un hilo aplica los eventos a logs_email en
+    UPDATEs por lote cada WEBHOOK_INTERVALO_MS. Los eventos de un mismo mensaje se
+    combinan en memoria (última entrega, primera apertura, rebote), así una ráfaga
+    ocupa a lo sumo una entrada y una fila de UPDATE por mensaje.
+    Los eventos cuyo log todavía no existe (sigue en el buffer de logs) se reintentan
+    WEBHOOK_REINTENTOS ciclos y después se descartan.
+    Los rebotes duros agregan la dirección a la lista de supresión en la misma transacción.
+    """
+
+    def __init__(self, lote: int = WEBHOOK_LOTE, intervalo_ms: int = WEBHOOK_INTERVALO_MS,
+                 maximo: int = WEBHOOK_BUFFER_MAX):
+        self.lote = lote
+        self.intervalo = intervalo_ms / 1000
+        self.maximo = maximo
+        # message_id -> cambios combinados, en orden de llegada
+        self._pendientes: Dict[str, Dict[str, Any]] = {}
+        self._contadores = {"recibidos": 0, "aplicados": 0, "sin_log": 0, "rechazados": 0}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    # ==================== API PÚBLICA ====================
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="eventos-entrega", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        """Detiene el hilo y aplica lo que quede en el buffer"""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None and self._hilo is not threading.current_thread():
+            self._hilo.join(timeout=30)
+        self._hilo = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"❌ Webhook: se perdieron {len(self._pendientes)} eventos de entrega al cerrar: {e}")
+
+    def encolar(self, eventos: List[EventoEntrega]) -> bool:
+        """Combina los eventos en el buffer; False si está lleno (el llamador responde 503)"""
+        with self._lock:
+            if len(self._pendientes) >= self.maximo:
+                self._contadores["rechazados"] += len(eventos)
+                return False
+            for evento in eventos:
+                self._combinar(self._pendientes.setdefault(evento.message_id, {"reintentos": 0}), evento)
+            self._contadores["recibidos"] += len(eventos)
+            lleno = len(self._pendientes) >= self.lote
+        if lleno:
+            self._despertar.set()
+        return True
+
+    def flush(self):
+        """Aplica todo el buffer, en UPDATEs de hasta WEBHOOK_LOTE mensajes"""
+        with self._flush_lock:
+            with self._lock:
+                pendientes, self._pendientes = self._pendientes, {}
+            if not pendientes:
+                return
+
+            # Los logs recién enviados pueden estar todavía en el buffer de escritura
+            log_writer.flush()
+
+            restantes = dict(pendientes)
+            sin_log = {}
+            try:
+                while restantes:
+                    grupo = dict(islice(restantes.items(), self.lote))
+                    aplicados = self._aplicar(grupo)
+                    for message_id, cambios in grupo.items():
+                        del restantes[message_id]
+                        if message_id not in aplicados:
+                            sin_log[message_id] = cambios
+                    with self._lock:
+                        self._contadores["aplicados"] += len(aplicados)
+            except Exception:
+                self._devolver({**sin_log, **restantes})
+                raise
+
+            reintentar = {}
+            for message_id, cambios in sin_log.items():
+                cambios["reintentos"] += 1
+                if cambios["reintentos"] <= WEBHOOK_REINTENTOS:
+                    reintentar[message_id] = cambios
+            with self._lock:
+                self._contadores["sin_log"] += len(sin_log) - len(reintentar)
+            self._devolver(reintentar)
+
+    def metricas(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._contadores, "pendientes": len(self._pendientes)}
+
+    # ==================== INTERNOS ====================
+
+    @staticmethod
+    def _combinar(cambios: Dict[str, Any], evento: EventoEntrega):
+        if evento.tipo == "rebote":
+            cambios["rebote"] = True
+            cambios["detalle"] = evento.detalle
+        elif evento.tipo == "entregado":
+            cambios["fecha_entrega"] = max(cambios.get("fecha_entrega") or evento.fecha, evento.fecha)
+        elif evento.tipo == "apertura":
+            cambios["fecha_apertura"] = min(cambios.get("fecha_apertura") or evento.fecha, evento.fecha)
+            # Una apertura implica que el correo llegó
+            cambios.setdefault("fecha_entrega", evento.fecha)
+
+    def _aplicar(self, grupo: Dict[str, Dict[str, Any]]) -> set:
+        """
+        Un UPDATE para el grupo (más la supresión de los que rebotaron);
+        devuelve los message_id que encontraron su log
+        """
+        with engine.begin() as conn:
+            filas = conn.execute(ACTUALIZAR_LOGS, {
+                "ids": list(grupo),
+                "entregas": [c.get("fecha_entrega") for c in grupo.values()],
+                "aperturas": [c.get("fecha_apertura") for c in grupo.values()],
+                "rebotes": [c.get("rebote", False) for c in grupo.values()],
+                "detalles": [c.get("detalle") for c in grupo.values()],
+                "desde": datetime.now(timezone.utc) - timedelta(days=WEBHOOK_VENTANA_DIAS)
+            }).all()
+            rebotados = {email for _, email, rebote in filas if rebote}
+            suprimir(conn, rebotados, MotivoSupresion.REBOTE, "Rebote duro informado por el proveedor")
+        indice_supresiones.agregar(rebotados)
+        return {message_id for message_id, _, _ in filas}
+
+    def _devolver(self, pendientes: Dict[str, Dict[str, Any]]):
+        """Reincorpora eventos al buffer, combinándolos con los que llegaron mientras tanto"""
+        if not pendientes:
+            return
+        with self._lock:
+            for message_id, viejos in pendientes.items():
+                nuevos = self._pendientes.get(message_id)
+                if nuevos is None:
+                    self._pendientes[message_id] = viejos
+                    continue
+                nuevos["reintentos"] = viejos["reintentos"]
+                if viejos.get("rebote"):
+                    nuevos.setdefault("rebote", True)
+                    nuevos.setdefault("detalle", viejos.get("detalle"))
+                for clave, elegir in (("fecha_entrega", max), ("fecha_apertura", min)):
+                    fechas = [f for f in (viejos.get(clave), nuevos.get(clave)) if f is not None]
+                    if fechas:
+                        nuevos[clave] = elegir(fechas)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._despertar.wait(timeout=self.intervalo)
+            self._despertar.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Webhook: error aplicando eventos de entrega, se reintentará: {e}")
+
+
+# Instancia compartida por todo el servicio
+buffer_eventos_entrega = BufferEventosEntrega()
+atexit.register(buffer_eventos_entrega.detener)
@@ -0,0 +1,276 @@
+# scripts/fake_smtp2go.py - CERTIFICADOS SERVICE
+"""
+Servidor local que imita la API de envío de SMTP2GO, para probar y medir el envío sin cuenta
+
+Uso:
+    python scripts/fake_smtp2go.py --puerto 8025 --latencia-ms 120 --tasa-error 0.02 --limite-por-segundo 15
+
+y en el servicio:
+    SMTP2GO_API_URL=http://localhost:8025/v3/email/send SMTP2GO_API_KEY=falsa
+
+Comportamiento configurable:
+- latencia (con jitter) de cada respuesta
+- tasa de errores 5xx y de rechazos permanentes (200 con "failures")
+- 429 con Retry-After al superar un límite de pedidos por segundo, o al azar
+- con --webhook-url, eventos delivered / bounce / open de cada correo aceptado, enviados
+  en lotes al webhook del servicio (como hace SMTP2GO)
+GET /stats devuelve los contadores (incluida la concurrencia máxima observada);
+POST /reset los pone en cero. GET /fondo.png sirve una imagen de fondo para plantillas
+de certificado de prueba.
+Solo usa la biblioteca estándar.
+"""
+import argparse
+import json
+import random
+import struct
+import threading
+import time
+import urllib.request
+import uuid
+import zlib
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class EstadoFalso:
+    """Configuración y contadores compartidos por los hilos del servidor"""
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.contadores = Counter()
+        self.ventana = deque()  # instantes de los pedidos del último segundo
+        self.inicio = time.monotonic()
+        self.en_vuelo = 0
+        self.concurrencia_max = 0
+        self.eventos = []  # eventos de webhook por enviar
+        if args.webhook_url:
+            threading.Thread(target=self._enviar_webhooks, name="webhooks", daemon=True).start()
+
+    def limitado(self) -> bool:
+        """True si el pedido supera el límite por segundo (o cae en el 429 al azar)"""
+        ahora = time.monotonic()
+        with self.lock:
+            while self.ventana and ahora - self.ventana[0] > 1.0:
+                self.ventana.popleft()
+            self.ventana.append(ahora)
+            excedido = self.args.limite_por_segundo > 0 and len(self.ventana) > self.args.limite_por_segundo
+        return excedido or random.random() < self.args.tasa_429
+
+    def entrar(self):
+        with self.lock:
+            self.en_vuelo += 1
+            self.concurrencia_max = max(self.concurrencia_max, self.en_vuelo)
+
+    def salir(self):
+        with self.lock:
+            self.en_vuelo -= 1
+
+    def contar(self, clave: str, cantidad: int = 1):
+        with self.lock:
+            self.contadores[clave] += cantidad
+
+    def stats(self) -> dict:
+        with self.lock:
+            transcurrido = time.monotonic() - self.inicio
+            return {
+                **self.contadores,
+                "concurrencia_max": self.concurrencia_max,
+                "segundos": round(transcurrido, 1),
+                "aceptados_por_segundo": round(self.contadores["aceptados"] / transcurrido, 2) if transcurrido else 0
+            }
+
+    def registrar_entrega(self, email_id: str, destinatario: str):
+        """Encola los eventos que el proveedor informaría para un correo aceptado"""
+        if not self.args.webhook_url:
+            return
+        ahora = int(time.time())
+        base = {"email_id": email_id, "rcpt": destinatario, "time": ahora}
+        if random.random() < self.args.tasa_rebote:
+            eventos = [{**base, "event": "bounce", "bounce": "hard", "message": "550 5.1.1 User unknown"}]
+        else:
+            eventos = [{**base, "event": "delivered"}]
+            if random.random() < self.args.tasa_apertura:
+                eventos.append({**base, "event": "open", "time": ahora + 5})
+        with self.lock:
+            self.eventos.extend(eventos)
+
+    def _enviar_webhooks(self):
+        """Cada --webhook-intervalo segundos envía los eventos acumulados en un solo POST"""
+        while True:
+            time.sleep(self.args.webhook_intervalo)
+            with self.lock:
+                lote, self.eventos = self.eventos, []
+            if not lote:
+                continue
+            pedido = urllib.request.Request(
+                self.args.webhook_url, data=json.dumps(lote).encode("utf-8"),
+                headers={"Content-Type": "application/json"}, method="POST"
+            )
+            try:
+                with urllib.request.urlopen(pedido, timeout=10) as respuesta:
+                    respuesta.read()
+                self.contar("webhooks_enviados")
+                self.contar("eventos_enviados", len(lote))
+            except Exception as e:
+                # Como el proveedor real: se reintenta en el siguiente ciclo
+                self.contar("webhooks_fallidos")
+                with self.lock:
+                    self.eventos[:0] = lote
+                if self.args.verbose:
+                    print(f"webhook falló: {e}")
+
+    def reset(self):
+        with self.lock:
+            self.contadores.clear()
+            self.ventana.clear()
+            self.inicio = time.monotonic()
+            self.concurrencia_max = self.en_vuelo
+
+
+def png_fondo(ancho: int = 1600, alto: int = 1131) -> bytes:
+    """PNG liso (sin dependencias) del tamaño del canvas de las plantillas"""
+    def bloque(tipo: bytes, datos: bytes) -> bytes:
+        return struct.pack(">I", len(datos)) + tipo + datos + struct.pack(">I", zlib.crc32(tipo + datos))
+
+    fila = b"\x00" + bytes((245, 240, 225)) * ancho
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + bloque(b"IHDR", struct.pack(">IIBBBBB", ancho, alto, 8, 2, 0, 0, 0))
+        + bloque(b"IDAT", zlib.compress(fila * alto, 9))
+        + bloque(b"IEND", b"")
+    )
+
+
+def crear_handler(estado: EstadoFalso):
+    args = estado.args
+    fondo = png_fondo()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+
+        def _responder(self, codigo: int, cuerpo, cabeceras: dict = None,
+                       tipo: str = "application/json"):
+            datos = cuerpo if isinstance(cuerpo, bytes) else json.dumps(cuerpo).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(datos)))
+            for nombre, valor in (cabeceras or {}).items():
+                self.send_header(nombre, valor)
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                return self._responder(200, estado.stats())
+            if self.path == "/fondo.png":
+                return self._responder(200, fondo, tipo="image/png")
+            self._responder(404, {"error": "no encontrado"})
+
+        def do_POST(self):
+            largo = int(self.headers.get("Content-Length") or 0)
+            cuerpo = self.rfile.read(largo)
+
+            if self.path == "/reset":
+                estado.reset()
+                return self._responder(200, {"ok": True})
+            if self.path != "/v3/email/send":
+                return self._responder(404, {"error": "no encontrado"})
+
+            estado.contar("pedidos")
+            estado.contar("bytes_recibidos", largo)
+            estado.entrar()
+            try:
+                self._enviar(cuerpo)
+            finally:
+                estado.salir()
+
+        def _enviar(self, cuerpo: bytes):
+            try:
+                payload = json.loads(cuerpo or b"{}")
+            except ValueError:
+                estado.contar("invalidos")
+                return self._responder(400, {"data": {"error": "JSON inválido"}})
+            if not payload.get("api_key") or not payload.get("to"):
+                estado.contar("invalidos")
+                return self._responder(400, {"data": {"error": "Faltan api_key o to"}})
+
+            if estado.limitado():
+                estado.contar("limitados_429")
+                return self._responder(
+                    429, {"data": {"error": "Rate limit exceeded"}},
+                    {"Retry-After": str(args.retry_after)}
+                )
+
+            # Latencia simulada del proveedor
+            latencia = max(0.0, random.gauss(args.latencia_ms, args.jitter_ms)) / 1000
+            time.sleep(latencia)
+
+            if random.random() < args.tasa_error:
+                estado.contar("errores_5xx")
+                return self._responder(503, {"data": {"error": "Service unavailable"}})
+
+            request_id = str(uuid.uuid4())
+            if random.random() < args.tasa_rechazo:
+                estado.contar("rechazados")
+                return self._responder(200, {"request_id": request_id, "data": {
+                    "succeeded": 0, "failed": 1, "failures": [f"{payload['to'][0]}: mailbox unavailable"]
+                }})
+
+            estado.contar("aceptados")
+            if payload.get("attachments"):
+                estado.contar("con_adjunto")
+            estado.registrar_entrega(request_id, payload["to"][0])
+            self._responder(200, {"request_id": request_id, "data": {
+                "succeeded": len(payload["to"]), "failed": 0, "failures": [], "email_id": request_id
+            }})
+
+        def log_message(self, formato, *valores):
+            if args.verbose:
+                super().log_message(formato, *valores)
+
+    return Handler
+
+
+def parsear_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Servidor falso de la API de SMTP2GO")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8025)
+    parser.add_argument("--latencia-ms", type=float, default=100, help="latencia media de cada envío")
+    parser.add_argument("--jitter-ms", type=float, default=30, help="desvío estándar de la latencia")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="fracción de respuestas 503")
+    parser.add_argument("--tasa-rechazo", type=float, default=0.0, help="fracción de rechazos permanentes")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="fracción de 429 al azar")
+    parser.add_argument("--limite-por-segundo", type=int, default=0, help="429 por encima de este ritmo (0 = sin límite)")
+    parser.add_argument("--retry-after", type=int, default=2, help="segundos de Retry-After en los 429")
+    parser.add_argument("--webhook-url", help="URL del webhook de eventos, p. ej. "
+                        "http://localhost:8003/webhooks/smtp2go")
+    parser.add_argument("--webhook-intervalo", type=float, default=1.0, help="segundos entre POSTs de eventos")
+    parser.add_argument("--tasa-rebote", type=float, default=0.0, help="fracción de aceptados que rebotan")
+    parser.add_argument("--tasa-apertura", type=float, default=0.3, help="fracción de entregados que se abren")
+    parser.add_argument("--verbose", action="store_true", help="registrar cada pedido")
+    return parser.parse_args(argv)
+
+
+def crear_servidor(args: argparse.Namespace):
+    """Servidor y su estado, sin arrancar (el benchmark lo corre en un hilo)"""
+    estado = EstadoFalso(args)
+    servidor = ThreadingHTTPServer((args.host, args.puerto), crear_handler(estado))
+    servidor.daemon_threads = True
+    return servidor, estado
+
+
+def main():
+    args = parsear_args()
+    servidor, _ = crear_servidor(args)
+    print(f"📮 SMTP2GO falso en http://{args.host}:{servidor.server_address[1]}/v3/email/send")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
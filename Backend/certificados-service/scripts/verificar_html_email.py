@@ -0,0 +1,87 @@
+# scripts/verificar_html_email.py - CERTIFICADOS SERVICE
+"""
+Compara el HTML de plantillas de email antes y después de preprocesar_html (app/html_email.py)
+
+Para cada archivo verifica que:
+- cada declaración de un @media del original sigue en el resultado y es !important
+  (el CSS base pasa a atributos style, que le ganan a toda regla sin !important)
+- se conservan todas las variables {VARIABLE}
+e informa el tamaño antes y después. Sale con código 1 si algo no se cumple.
+
+Uso (no necesita base de datos):
+    python scripts/verificar_html_email.py                  # templates-mail/*.html
+    python scripts/verificar_html_email.py plantilla.html ...
+"""
+import glob
+import os
+import re
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ["EMAIL_HTML_PREPROCESAR"] = "true"
+# Los módulos de app leen esta configuración al importarse; no se abre ninguna conexión
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/sin-uso")
+os.environ.setdefault("SECRET_KEY", "verificar-html")
+
+from app.html_email import (  # noqa: E402
+    PATRON_STYLE, PATRON_COMENTARIO_CSS, _fin_regla_arroba, _minificar_css,
+    parsear_declaraciones, preprocesar_html
+)
+
+PATRON_VARIABLE = re.compile(r"\{[A-Z_]+\}")
+
+
+def reglas_media(html: str):
+    """[(consulta, selector, propiedad, valor, importante)] de los @media de los <style>"""
+    css = PATRON_COMENTARIO_CSS.sub("", "\n".join(PATRON_STYLE.findall(html)))
+    reglas, posicion = [], css.find("@media")
+    while posicion != -1:
+        fin = _fin_regla_arroba(css, posicion)
+        bloque = _minificar_css(css[posicion:fin])
+        consulta, _, interior = bloque.partition("{")
+        for selector, cuerpo in re.findall(r"([^{}]+)\{([^{}]*)\}", interior):
+            for propiedad, valor, importante in parsear_declaraciones(cuerpo):
+                reglas.append((consulta, selector, propiedad, valor, importante))
+        posicion = css.find("@media", fin)
+    return reglas
+
+
+def verificar(ruta: str) -> bool:
+    with open(ruta, encoding="utf-8") as f:
+        original = f.read()
+    procesado = preprocesar_html(original)
+    errores = []
+
+    despues = {(c, s, p): (v, i) for c, s, p, v, i in reglas_media(procesado)}
+    antes = reglas_media(original)
+    for consulta, selector, propiedad, valor, _ in antes:
+        resultado = despues.get((consulta, selector, propiedad))
+        if resultado is None:
+            errores.append(f"{consulta} {selector} {{{propiedad}}} desapareció")
+        elif resultado != (valor, True):
+            errores.append(f"{consulta} {selector} {{{propiedad}: {valor}}} no quedó !important")
+
+    faltantes = set(PATRON_VARIABLE.findall(original)) - set(PATRON_VARIABLE.findall(procesado))
+    if faltantes:
+        errores.append(f"variables perdidas: {', '.join(sorted(faltantes))}")
+
+    tamano_antes, tamano_despues = len(original.encode("utf-8")), len(procesado.encode("utf-8"))
+    estado = "OK" if not errores else "FALLA"
+    print(f"{estado} {ruta}: {tamano_antes} -> {tamano_despues} bytes, {len(antes)} declaraciones @media")
+    for error in errores:
+        print(f"  - {error}")
+    return not errores
+
+
+def main():
+    rutas = sys.argv[1:] or sorted(glob.glob(os.path.join(RAIZ, "templates-mail", "*.html")))
+    if not rutas:
+        print("No hay plantillas para verificar")
+        sys.exit(1)
+    resultados = [verificar(ruta) for ruta in rutas]
+    sys.exit(0 if all(resultados) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 # app/models.py
-from sqlalchemy import Column, String, DateTime, Boolean, Enum, Text, Integer, Date
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, DateTime, Boolean, Enum, Text, Integer, Date, Index, text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 import uuid
@@ -53,4 +53,26 @@ class Inscripcion(Base):
     estudiante_id = Column(UUID(as_uuid=True), nullable=False)  # FK a usuarios
     fecha_inscripcion = Column(DateTime(timezone=True), server_default=func.now())
     completado = Column(Boolean, default=False)
-    is_active = Column(Boolean, default=True)
\ No newline at end of file
+    is_active = Column(Boolean, default=True)
+
+class EventoSalida(Base):
+    """
+    Outbox: eventos para otros servicios, escritos en la misma transacción que el cambio que los origina
+    certificados-service los toma con FOR UPDATE SKIP LOCKED y completa fecha_procesado
+    """
+    __tablename__ = "eventos_salida"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    tipo = Column(String(50), nullable=False)  # p. ej. CURSO_GRADUADO
+    agregado_id = Column(UUID(as_uuid=True), nullable=False)  # entidad que cambió (curso, inscripción)
+    payload = Column(JSONB, nullable=False)
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+    fecha_procesado = Column(DateTime(timezone=True), nullable=True)
+    intentos = Column(Integer, nullable=False, default=0)
+    ultimo_error = Column(Text, nullable=True)
+    resultado = Column(JSONB, nullable=True)  # lo que hizo el consumidor (p. ej. el trabajo de envío creado)
+
+    __table_args__ = (
+        # Solo los pendientes: es lo único que consulta el consumidor
+        Index("ix_eventos_salida_pendientes", "fecha_creacion", postgresql_where=text("fecha_procesado IS NULL")),
+    )
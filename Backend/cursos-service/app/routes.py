@@ -7,13 +7,15 @@ import re
 from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
+from sqlalchemy import or_, update
+import uuid
 
 from app.database import get_db
-from app.models import Usuario, Curso, Inscripcion, RolUsuario
+from app.models import Usuario, Curso, Inscripcion, RolUsuario, EventoSalida
 from app.schemas import (
     CursoCreate, CursoUpdate, CursoResponse, 
     InscripcionCreate, InscripcionResponse,
+    GraduacionCursoRequest, GraduacionCursoResponse,
     UsuarioResponse, CSVImportResponse, PaginatedResponse,
     EstudianteCSV
 )
@@ -718,11 +720,84 @@ def marcar_inscripcion_completada(
         if not curso or str(curso.instructor_id) != str(current_user.id):
             raise HTTPException(status_code=403, detail="Sin permisos para modificar esta inscripción")
     
-    inscripcion.completado = True
-    db.commit()
+    if not inscripcion.completado:
+        inscripcion.completado = True
+        # Evento en la misma transacción: certificados-service pregenera el certificado
+        db.add(EventoSalida(
+            id=uuid.uuid4(),
+            tipo="INSCRIPCION_COMPLETADA",
+            agregado_id=inscripcion.id,
+            payload={
+                "inscripcion_id": str(inscripcion.id),
+                "curso_id": str(inscripcion.curso_id),
+                "estudiante_id": str(inscripcion.estudiante_id)
+            }
+        ))
+        db.commit()
     
     return {"message": "Inscripción marcada como completada"}
 
+@router.post("/cursos/{curso_id}/graduar", response_model=GraduacionCursoResponse)
+def graduar_curso(
+    curso_id: str,
+    graduacion: GraduacionCursoRequest,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_teacher_or_admin)
+):
+    """
+    Graduar un curso: marca completadas sus inscripciones en un solo UPDATE y, en la misma
+    transacción, deja un evento CURSO_GRADUADO (outbox) con el que certificados-service
+    genera los certificados y envía los correos en segundo plano.
+    Repetirlo no vuelve a emitir nada para quienes ya estaban completados.
+    """
+    
+    curso = db.query(Curso).filter(Curso.id == curso_id, Curso.is_active == True).first()
+    if not curso:
+        raise HTTPException(status_code=404, detail="Curso no encontrado")
+    
+    # Verificar permisos de profesor
+    if current_user.rol == RolUsuario.PROFESOR and str(curso.instructor_id) != str(current_user.id):
+        raise HTTPException(status_code=403, detail="Sin permisos para graduar este curso")
+    
+    # Un solo UPDATE para todo el curso; RETURNING da los que cambiaron con esta graduación
+    consulta = update(Inscripcion).where(
+        Inscripcion.curso_id == curso.id,
+        Inscripcion.is_active == True,
+        or_(Inscripcion.completado == False, Inscripcion.completado.is_(None))
+    )
+    if graduacion.estudiantes_ids is not None:
+        consulta = consulta.where(Inscripcion.estudiante_id.in_(graduacion.estudiantes_ids))
+    graduados = db.execute(
+        consulta.values(completado=True).returning(Inscripcion.estudiante_id)
+    ).scalars().all()
+    
+    evento = None
+    if graduados:
+        plantilla_certificado_id = graduacion.plantilla_certificado_id or curso.plantilla_id
+        evento = EventoSalida(
+            id=uuid.uuid4(),
+            tipo="CURSO_GRADUADO",
+            agregado_id=curso.id,
+            payload={
+                "curso_id": str(curso.id),
+                "estudiantes_ids": [str(estudiante_id) for estudiante_id in graduados],
+                "plantilla_email_id": str(graduacion.plantilla_email_id) if graduacion.plantilla_email_id else None,
+                "plantilla_certificado_id": str(plantilla_certificado_id) if plantilla_certificado_id else None,
+                "variables_globales": graduacion.variables_globales or {},
+                "modo_entrega": graduacion.modo_entrega
+            }
+        )
+        db.add(evento)
+    
+    # Completados y evento se confirman juntos: no hay graduación sin su evento ni al revés
+    db.commit()
+    
+    return {
+        "curso_id": curso.id,
+        "completados": len(graduados),
+        "evento_id": evento.id if evento else None
+    }
+
 @router.delete("/inscripciones/{inscripcion_id}")
 def desactivar_inscripcion(
     inscripcion_id: str,
@@ -1,6 +1,6 @@
 # app/schemas.py
 from pydantic import BaseModel, EmailStr, Field, validator
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime, date
 from uuid import UUID
 from app.models import RolUsuario
@@ -76,6 +76,19 @@ class InscripcionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Schemas de Graduación
+class GraduacionCursoRequest(BaseModel):
+    estudiantes_ids: Optional[List[UUID]] = None  # None = todos los inscritos activos
+    plantilla_email_id: Optional[UUID] = None  # sin plantilla de email no se envían correos
+    plantilla_certificado_id: Optional[UUID] = None  # por defecto la plantilla del curso
+    variables_globales: Optional[Dict[str, str]] = None
+    modo_entrega: str = Field("ADJUNTO", pattern="^(ADJUNTO|ENLACE)$")
+
+class GraduacionCursoResponse(BaseModel):
+    curso_id: UUID
+    completados: int  # inscripciones que pasaron a completadas con esta graduación
+    evento_id: Optional[UUID] = None  # evento para certificados-service (None si no hubo cambios)
+
 # Schema para CSV Import
 class EstudianteCSV(BaseModel):
     email: EmailStr
@@ -2,7 +2,7 @@
 
 import { useState, useEffect } from 'react';
 import DashboardLayout from "@/components/layout/DashboardLayout";
-import { useEmail, PlantillaEmail } from '@/hooks/useEmail';
+import { useEmail, PlantillaEmail, PlantillaEmailResumen } from '@/hooks/useEmail';
 import { useInscripciones } from '@/hooks/useInscripciones';
 
 interface PlantillaCertificado {
@@ -22,6 +22,7 @@ interface Estudiante {
 export default function EnvioIndividualPage() {
   const {
     getPlantillasEmail,
+    getPlantillaEmail,
     enviarEmailIndividual,
     procesarVariables,
     loading: emailLoading,
@@ -30,7 +31,8 @@ export default function EnvioIndividualPage() {
 
   const { inscripciones, loading: inscripcionesLoading } = useInscripciones();
   
-  const [plantillasEmail, setPlantillasEmail] = useState<PlantillaEmail[]>([]);
+  const [plantillasEmail, setPlantillasEmail] = useState<PlantillaEmailResumen[]>([]);
+  const [plantillaEmailActual, setPlantillaEmailActual] = useState<PlantillaEmail | null>(null);
   const [plantillasCertificado, setPlantillasCertificado] = useState<PlantillaCertificado[]>([]);
   
   // Estados del formulario
@@ -103,7 +105,18 @@ export default function EnvioIndividualPage() {
     }
   };
 
-  const plantillaEmailActual = plantillasEmail.find(p => p.id === plantillaEmailSeleccionada);
+  // El listado no trae el HTML: se pide la plantilla seleccionada
+  useEffect(() => {
+    if (!plantillaEmailSeleccionada) {
+      setPlantillaEmailActual(null);
+      return;
+    }
+    let vigente = true;
+    getPlantillaEmail(plantillaEmailSeleccionada)
+      .then(plantilla => { if (vigente) setPlantillaEmailActual(plantilla); })
+      .catch(err => console.error('Error cargando plantilla de email:', err));
+    return () => { vigente = false; };
+  }, [plantillaEmailSeleccionada]);
 
   const handleEnviar = async () => {
     if (!estudianteSeleccionado) {
@@ -139,6 +152,8 @@ export default function EnvioIndividualPage() {
         contenido = procesarVariables(contenido, variables);
       }
 
+      // Una clave por clic en "Enviar": un reenvío posterior es un correo nuevo
+      const idempotencyKey = crypto.randomUUID();
       const resultado = await enviarEmailIndividual({
         destinatario_email: estudianteActual!.email,
         destinatario_nombre: `${estudianteActual!.nombre} ${estudianteActual!.apellido}`,
@@ -146,7 +161,7 @@ export default function EnvioIndividualPage() {
         contenido_html: contenido,
         plantilla_certificado_id: plantillaCertificadoSeleccionada || undefined,
         variables
-      });
+      }, idempotencyKey);
 
       setResultadoEnvio(resultado);
 
@@ -1,12 +1,12 @@
 'use client';
 
-import { useState, useEffect } from 'react';
-import { useEmail, PlantillaEmail } from '@/hooks/useEmail';
+import { useState, useEffect, useRef } from 'react';
+import { useEmail, PlantillaEmailResumen } from '@/hooks/useEmail';
 import DashboardLayout from "@/components/layout/DashboardLayout";
 import { useCursos, useEstudiantesCurso } from '@/hooks/useCursos';
 import ConfiguracionLotes from '@/components/correos/ConfiguracionLotes';
 import ProgresoEnvio from '@/components/correos/ProgresoEnvio';
-import { listTemplates } from '@/lib/api';
+import { listTemplates, crearTrabajoEnvio, abrirEventosTrabajo } from '@/lib/api';
 
 interface PlantillaCertificado {
   id: string;
@@ -17,13 +17,12 @@ interface PlantillaCertificado {
 export default function EnvioMasivoPage() {
   const {
     getPlantillasEmail,
-    enviarEmailMasivo,
     loading: emailLoading,
     error: emailError
   } = useEmail();
 
   const { cursos, loading: cursosLoading } = useCursos();
-  const [plantillasEmail, setPlantillasEmail] = useState<PlantillaEmail[]>([]);
+  const [plantillasEmail, setPlantillasEmail] = useState<PlantillaEmailResumen[]>([]);
   const [plantillasCertificado, setPlantillasCertificado] = useState<PlantillaCertificado[]>([]);
   
   // Estados del formulario
@@ -48,6 +47,10 @@ export default function EnvioMasivoPage() {
     tiempoInicio: 0
   });
   const [resultadoEnvio, setResultadoEnvio] = useState<any>(null);
+  const eventosRef = useRef<EventSource | null>(null);
+
+  // Cerrar el stream de progreso al salir de la página
+  useEffect(() => () => eventosRef.current?.close(), []);
 
   // Inscripciones del curso seleccionado
   const { estudiantes, loading: inscripcionesLoading } = useEstudiantesCurso(
@@ -111,30 +114,59 @@ export default function EnvioMasivoPage() {
         tiempoInicio: Date.now()
       });
 
-      const destinatariosIds = estudiantes?.estudiantes
-        ?.map(estudiante => estudiante.estudiante_id)
-        ?.filter(id => id !== undefined && id !== null) || [];
-      
-      if (destinatariosIds.length === 0) {
-        throw new Error('No hay destinatarios válidos para enviar');
-      }
-      
-      const resultado = await enviarEmailMasivo({
+      // Una clave por clic en "Enviar": un reenvío posterior es un trabajo nuevo
+      const idempotencyKey = crypto.randomUUID();
+
+      // Los estudiantes del curso se resuelven en el servidor; el envío corre en segundo plano
+      const trabajo = await crearTrabajoEnvio({
         plantilla_email_id: plantillaEmailSeleccionada,
         plantilla_certificado_id: plantillaCertificadoSeleccionada || undefined,
         curso_id: cursoSeleccionado,
-        destinatarios_ids: destinatariosIds,
         variables_globales: variablesGlobales,
         configuracion_lotes: configuracionLotes
+      }, idempotencyKey);
+
+      // Progreso en vivo: un evento por destinatario hasta 'fin'
+      const eventos = await abrirEventosTrabajo(trabajo.id);
+      eventosRef.current = eventos;
+
+      await new Promise<void>((resolve, reject) => {
+        eventos.addEventListener('estado', (e: MessageEvent) => {
+          const datos = JSON.parse(e.data);
+          if (datos.estado !== 'EN_CURSO') {
+            // Trabajo ya terminado (por ejemplo, un pedido repetido)
+            setResultadoEnvio(datos);
+            eventos.close();
+            resolve();
+          }
+        });
+        eventos.addEventListener('destinatario', (e: MessageEvent) => {
+          const datos = JSON.parse(e.data);
+          setProgresoEnvio(prev => ({
+            ...prev,
+            total: datos.total ?? prev.total,
+            enviados: datos.enviados_exitosos,
+            errores: datos.errores
+          }));
+        });
+        eventos.addEventListener('fin', (e: MessageEvent) => {
+          const datos = JSON.parse(e.data);
+          setResultadoEnvio(datos);
+          setProgresoEnvio(prev => ({
+            ...prev,
+            enviados: datos.enviados_exitosos,
+            errores: datos.errores
+          }));
+          eventos.close();
+          resolve();
+        });
+        eventos.addEventListener('error_trabajo', (e: MessageEvent) => {
+          eventos.close();
+          reject(new Error(JSON.parse(e.data).mensaje));
+        });
+        // Si la conexión se corta, EventSource reconecta solo enviando Last-Event-ID
       });
 
-      setResultadoEnvio(resultado);
-      setProgresoEnvio(prev => ({
-        ...prev,
-        enviados: resultado.enviados_exitosos,
-        errores: resultado.errores
-      }));
-
     } catch (err: any) {
       console.error('Error enviando correos:', err);
       alert(`Error enviando correos: ${err.message}`);
@@ -145,6 +177,7 @@ export default function EnvioMasivoPage() {
 
   const handleCancelarEnvio = () => {
     if (confirm('¿Estás seguro de cancelar el envío?')) {
+      eventosRef.current?.close();
       setEnviando(false);
       setProgresoEnvio({
         total: 0,
@@ -1,7 +1,7 @@
 'use client';
 
 import { useState, useEffect } from 'react';
-import { useEmail, PlantillaEmail } from '@/hooks/useEmail';
+import { useEmail, PlantillaEmail, PlantillaEmailResumen } from '@/hooks/useEmail';
 import DashboardLayout from "@/components/layout/DashboardLayout";
 import PlantillaEmailEditor from '@/components/correos/PlantillaEmailEditor';
 import PlantillasEmailList from '@/components/correos/PlantillasEmailList';
@@ -9,6 +9,7 @@ import PlantillasEmailList from '@/components/correos/PlantillasEmailList';
 export default function PlantillasEmailPage() {
   const {
     getPlantillasEmail,
+    getPlantillaEmail,
     createPlantillaEmail,
     updatePlantillaEmail,
     deletePlantillaEmail,
@@ -16,7 +17,7 @@ export default function PlantillasEmailPage() {
     error
   } = useEmail();
 
-  const [plantillas, setPlantillas] = useState<PlantillaEmail[]>([]);
+  const [plantillas, setPlantillas] = useState<PlantillaEmailResumen[]>([]);
   const [showEditor, setShowEditor] = useState(false);
   const [editingPlantilla, setEditingPlantilla] = useState<PlantillaEmail | null>(null);
   const [loadingData, setLoadingData] = useState(true);
@@ -42,9 +43,15 @@ export default function PlantillasEmailPage() {
     setShowEditor(true);
   };
 
-  const handleEdit = (plantilla: PlantillaEmail) => {
-    setEditingPlantilla(plantilla);
-    setShowEditor(true);
+  const handleEdit = async (plantilla: PlantillaEmailResumen) => {
+    // El listado no trae el HTML: se pide la plantilla completa (con ETag, el navegador revalida)
+    try {
+      const completa = await getPlantillaEmail(plantilla.id);
+      setEditingPlantilla(completa);
+      setShowEditor(true);
+    } catch (err) {
+      console.error('Error cargando plantilla:', err);
+    }
   };
 
   const handleSave = async (data: Partial<PlantillaEmail>) => {
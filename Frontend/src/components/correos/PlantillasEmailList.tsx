@@ -1,11 +1,11 @@
 'use client';
 
 import { useState } from 'react';
-import { PlantillaEmail } from '@/hooks/useEmail';
+import { PlantillaEmailResumen } from '@/hooks/useEmail';
 
 interface PlantillasEmailListProps {
-  plantillas: PlantillaEmail[];
-  onEdit: (plantilla: PlantillaEmail) => void;
+  plantillas: PlantillaEmailResumen[];
+  onEdit: (plantilla: PlantillaEmailResumen) => void;
   onDelete: (id: string) => void;
   onToggleActive: (id: string, isActive: boolean) => void;
   loading?: boolean;
@@ -23,6 +23,9 @@ export interface PlantillaEmail {
   fecha_actualizacion: string;
 }
 
+// Lo que devuelve el listado: la plantilla sin su HTML (se pide con getPlantillaEmail)
+export type PlantillaEmailResumen = Omit<PlantillaEmail, 'contenido_html'>;
+
 export interface EnvioIndividualRequest {
   destinatario_email: string;
   destinatario_nombre?: string;
@@ -36,6 +39,7 @@ export interface EnvioMasivoRequest {
   plantilla_email_id: string;
   plantilla_certificado_id?: string;
   curso_id?: string;
+  cursos_ids?: string[];
   destinatarios_ids?: string[];
   variables_globales?: Record<string, string>;
   configuracion_lotes?: {
@@ -43,15 +47,20 @@ export interface EnvioMasivoRequest {
     pausa_lotes?: number;
     pausa_individual?: number;
   };
+  modo_entrega?: 'ADJUNTO' | 'ENLACE';
 }
 
 export interface EnvioMasivoResponse {
+  trabajo_id?: string;
   total_destinatarios: number;
   enviados_exitosos: number;
   errores: number;
   log_ids: string[];
   errores_detalle: string[];
   tiempo_total?: number;
+  omitidos?: number;
+  suprimidos?: number;
+  repetido?: boolean;
 }
 
 export interface EstadisticasEmail {
@@ -70,7 +79,7 @@ export interface LogEmail {
   asunto: string;
   plantilla_email_id?: string;
   plantilla_certificado_id?: string;
-  estado: 'PENDIENTE' | 'ENVIADO' | 'ERROR' | 'ENTREGADO';
+  estado: 'PENDIENTE' | 'ENVIADO' | 'ERROR' | 'ENTREGADO' | 'DESCARTADO' | 'REBOTADO';
   mensaje_error?: string;
   fecha_envio: string;
   fecha_entrega?: string;
@@ -83,7 +92,7 @@ export const useEmail = () => {
 
   // ==================== PLANTILLAS DE EMAIL ====================
 
-  const getPlantillasEmailList = useCallback(async (): Promise<PlantillaEmail[]> => {
+  const getPlantillasEmailList = useCallback(async (): Promise<PlantillaEmailResumen[]> => {
     try {
       setLoading(true);
       setError(null);
@@ -159,11 +168,11 @@ export const useEmail = () => {
 
   // ==================== ENVÍO DE CORREOS ====================
 
-  const enviarEmailIndividualData = useCallback(async (data: EnvioIndividualRequest): Promise<LogEmail> => {
+  const enviarEmailIndividualData = useCallback(async (data: EnvioIndividualRequest, idempotencyKey?: string): Promise<LogEmail> => {
     try {
       setLoading(true);
       setError(null);
-      const result = await enviarEmailIndividual(data);
+      const result = await enviarEmailIndividual(data, idempotencyKey);
       return result;
     } catch (err: any) {
       const errorMessage = err.message || 'Error enviando email individual';
@@ -174,11 +183,11 @@ export const useEmail = () => {
     }
   }, []);
 
-  const enviarEmailMasivoData = useCallback(async (data: EnvioMasivoRequest): Promise<EnvioMasivoResponse> => {
+  const enviarEmailMasivoData = useCallback(async (data: EnvioMasivoRequest, idempotencyKey?: string): Promise<EnvioMasivoResponse> => {
     try {
       setLoading(true);
       setError(null);
-      const result = await enviarEmailMasivo(data);
+      const result = await enviarEmailMasivo(data, idempotencyKey);
       return result;
     } catch (err: any) {
       const errorMessage = err.message || 'Error enviando emails masivos';
@@ -400,6 +400,17 @@ export async function marcarInscripcionCompletada(inscripcionId: string) {
   return cursosApi.put(`/inscripciones/${inscripcionId}/completar`, {});
 }
 
+// Graduar un curso: completa las inscripciones y certificados-service genera y envía los certificados
+export async function graduarCurso(cursoId: string, data: {
+  estudiantes_ids?: string[];
+  plantilla_email_id?: string;
+  plantilla_certificado_id?: string;
+  variables_globales?: Record<string, string>;
+  modo_entrega?: 'ADJUNTO' | 'ENLACE';
+} = {}) {
+  return cursosApi.post(`/cursos/${cursoId}/graduar`, data);
+}
+
 export async function desactivarInscripcion(inscripcionId: string) {
   return cursosApi.delete(`/inscripciones/${inscripcionId}`);
 }
@@ -473,13 +484,16 @@ export const deletePlantillaEmail = async (id: string) => {
 };
 
 // Envío de Correos
-export const enviarEmailIndividual = async (data: any) => {
+// Cada envío lleva una Idempotency-Key: una por acción del usuario. Reintentar la misma
+// acción reutiliza la clave (no duplica correos); una acción nueva es un envío nuevo.
+export const enviarEmailIndividual = async (data: any, idempotencyKey: string = crypto.randomUUID()) => {
   const session = await getSession();
   const response = await fetch(`${CERTIFICADOS_SERVICE_URL}/enviar-individual`, {
     method: "POST",
     headers: {
       Authorization: `Bearer ${session?.accessToken}`,
       "Content-Type": "application/json",
+      "Idempotency-Key": idempotencyKey,
     },
     body: JSON.stringify(data),
   });
@@ -487,13 +501,14 @@ export const enviarEmailIndividual = async (data: any) => {
   return response.json();
 };
 
-export const enviarEmailMasivo = async (data: any) => {
+export const enviarEmailMasivo = async (data: any, idempotencyKey: string = crypto.randomUUID()) => {
   const session = await getSession();
   const response = await fetch(`${CERTIFICADOS_SERVICE_URL}/enviar-masivo`, {
     method: "POST",
     headers: {
       Authorization: `Bearer ${session?.accessToken}`,
       "Content-Type": "application/json",
+      "Idempotency-Key": idempotencyKey,
     },
     body: JSON.stringify(data),
   });
@@ -501,6 +516,47 @@ export const enviarEmailMasivo = async (data: any) => {
   return response.json();
 };
 
+// Envío masivo en segundo plano con progreso por Server-Sent Events
+export const crearTrabajoEnvio = async (data: any, idempotencyKey: string = crypto.randomUUID()) => {
+  const session = await getSession();
+  const response = await fetch(`${CERTIFICADOS_SERVICE_URL}/trabajos-envio`, {
+    method: "POST",
+    headers: {
+      Authorization: `Bearer ${session?.accessToken}`,
+      "Content-Type": "application/json",
+      "Idempotency-Key": idempotencyKey,
+    },
+    body: JSON.stringify(data),
+  });
+  if (!response.ok) throw new Error("Error al iniciar el envío masivo");
+  return response.json();
+};
+
+// Campaña: varios cursos, cada uno con sus plantillas, en un solo trabajo de envío
+export const crearCampanaEnvio = async (data: any, idempotencyKey: string = crypto.randomUUID()) => {
+  const session = await getSession();
+  const response = await fetch(`${CERTIFICADOS_SERVICE_URL}/campanas-envio`, {
+    method: "POST",
+    headers: {
+      Authorization: `Bearer ${session?.accessToken}`,
+      "Content-Type": "application/json",
+      "Idempotency-Key": idempotencyKey,
+    },
+    body: JSON.stringify(data),
+  });
+  if (!response.ok) throw new Error("Error al iniciar la campaña de envío");
+  return response.json();
+};
+
+export const abrirEventosTrabajo = async (trabajoId: string) => {
+  // EventSource no permite cabeceras: el token viaja como parámetro
+  const session = await getSession();
+  const token = encodeURIComponent(session?.accessToken || "");
+  return new EventSource(
+    `${CERTIFICADOS_SERVICE_URL}/trabajos-envio/${trabajoId}/eventos?token=${token}`
+  );
+};
+
 // Estadísticas y Logs
 export const getEstadisticasEmail = async () => {
   const session = await getSession();